@@ -4,15 +4,17 @@ from datetime import datetime
 
 import streamlit as st
 from dotenv import load_dotenv
-from PIL import Image
 import traceback  # ← 追加（例外の全文を表示するため）
 
 # ---- Local modules (5-file structure) ----
 try:
     from haiku_core import load_haiku_df, pick_references
-    from haiku_gpt import call_gpt_haiku, generate_english_tweet_block
-    from image_gen import build_image_prompt, generate_image, save_artifacts
-    from x_client import post_to_x
+    from haiku_gpt import (stream_gpt_haiku, call_gpt_haiku_candidates, ensure_candidate_575,
+                           generate_english_tweet_block, HAIKU_CANDIDATES)
+    from image_gen import build_image_prompt, generate_image, save_artifacts, get_rendition
+    from pipeline import start_pipeline
+    from dedup_index import get_dedup_index
+    import haiku_log
 except Exception as e:
     # Streamlit UI に赤枠で表示
     st.error("❌ モジュールの読み込みに失敗しました。詳細を以下に表示します。")
@@ -90,6 +92,8 @@ st.markdown("""
 # =============================
 # Session State
 # =============================
+if "log_session_id" not in st.session_state: st.session_state.log_session_id = haiku_log.new_id()
+haiku_log.set_session(st.session_state.log_session_id)   # このセッションのログに session_id を付ける
 if "haiku_data" not in st.session_state: st.session_state.haiku_data = None
 if "image_prompt" not in st.session_state: st.session_state.image_prompt = None
 if "img" not in st.session_state: st.session_state.img = None
@@ -233,6 +237,10 @@ prioritize_giongo = st.checkbox(
     "ステップ6: 擬音語（繰り返し表現）を優先する場合はチェックを入れてください",
     value=True
 )
+use_semantic = st.checkbox(
+    "体験・感情の文章に意味が近い句も参照する（意味検索）",
+    value=False
+)
 
 
 
@@ -245,8 +253,11 @@ if st.button("ステップ7: 条件を確定（📚参照句を確定）"):
         aesthetic=st.session_state.aesthetic,
         keyword=keyword,
         k=3,
-        prioritize_giongo=prioritize_giongo
+        prioritize_giongo=prioritize_giongo,
+        retrieval="semantic" if use_semantic else "keyword",
+        experience=experience
     )
+    get_dedup_index(df)   # 生成後の既存句チェック用インデックスを先に作っておく
     st.session_state.references_locked = True
     st.session_state.haiku_data = None
     st.session_state.image_prompt = None
@@ -320,8 +331,35 @@ with col1:
                     "references": st.session_state.references
                 }
 
-                with st.spinner("俳句を生成中..."):
-                    st.session_state.haiku_data = call_gpt_haiku(payload)
+                # 同じ条件で再度押された＝「別の句がほしい」なのでキャッシュを使わない
+                regenerate = st.session_state.get("last_haiku_payload") == payload
+                candidates = st.session_state.get("haiku_candidates") or []
+                if regenerate and candidates:
+                    # 候補モードで作った残りの候補があれば、API を呼ばずに次の候補を出す
+                    with st.spinner("次の候補を確認中..."):
+                        st.session_state.haiku_data = ensure_candidate_575(candidates.pop(0))
+                elif st.session_state.get("candidates_mode"):
+                    with st.spinner(f"俳句の候補を{HAIKU_CANDIDATES}句まとめて生成中..."):
+                        ranked = call_gpt_haiku_candidates(
+                            payload, n=HAIKU_CANDIDATES, df=load_haiku_df(ISSA_CSV_PATH),
+                            use_cache=not regenerate)
+                    st.session_state.haiku_data = ranked[0] if ranked else None
+                    st.session_state.haiku_candidates = ranked[1:]
+                else:
+                    st.session_state.haiku_candidates = []
+                    # ストリーミングで受け取り、俳句本体が届いた時点で先に表示する
+                    preview = st.empty()
+                    with st.spinner("俳句を生成中..."):
+                        for field, value in stream_gpt_haiku(payload, use_cache=not regenerate):
+                            if field == "haiku_ja":
+                                preview.markdown(
+                                    f"<p style='font-size:28px; font-weight:bold; text-align:center;'>{value}</p>",
+                                    unsafe_allow_html=True
+                                )
+                            elif field == "done":
+                                st.session_state.haiku_data = value
+                    preview.empty()
+                st.session_state.last_haiku_payload = payload
 
                 if st.session_state.haiku_data:
                     h = st.session_state.haiku_data
@@ -332,11 +370,33 @@ with col1:
                         keyword=keyword,
                         aesthetic=st.session_state.aesthetic
                     )
+
+                    # 前回の先行ジョブは不要になるので取り消す
+                    old_job = st.session_state.get("pipeline_job")
+                    if old_job is not None:
+                        old_job.cancel()
+                    st.session_state.pipeline_job = None
+
+                    # まとめて生成モード：画像と英語ブロックを並行して先回り生成
+                    if st.session_state.get("pipeline_mode"):
+                        st.session_state.pipeline_job = start_pipeline(
+                            st.session_state.image_prompt,
+                            h.get("haiku_ja", ""),
+                            h.get("explanation_ja", ""),
+                            size="1024x1024"
+                        )
+                        st.session_state.img = None
+                        st.session_state.img_paths = None
+                        st.session_state.twitter_block = ""
         finally:
             st.session_state["busy"] = False  # 実行完了後に解除
 
 with col2:
     st.caption("①で俳句を確定 → 下の②画像生成ボタンで画像生成できます。")
+    st.checkbox("まとめて生成（①の直後に画像と英語俳句も並行して作成）", key="pipeline_mode")
+    st.checkbox(f"候補から選ぶ（1回で{HAIKU_CANDIDATES}句作り、良い順に①で次の候補へ）", key="candidates_mode")
+    if st.session_state.get("haiku_candidates"):
+        st.caption(f"残りの候補: {len(st.session_state.haiku_candidates)} 句（もう一度①で表示）")
 
 
 # 俳句表示
@@ -351,6 +411,17 @@ if st.session_state.get("haiku_data"):
         f"<p style='font-size:28px; font-weight:bold; text-align:center;'>{haiku_ja}</p>",
         unsafe_allow_html=True
     )
+    mora = h.get("mora") or {}
+    if mora.get("ok") is False:
+        st.caption(f"⚠️ 音数 {'-'.join(map(str, mora.get('counts', [])))}（5-7-5 に整えられませんでした）")
+    dup = get_dedup_index(load_haiku_df(ISSA_CSV_PATH)).check(haiku_ja, h.get("reading_ja"))
+    if dup["duplicate"]:
+        near = dup["nearest"][0]
+        st.warning(f"⚠️ 一茶の既存句とよく似ています（類似度 {near['similarity']:.2f}）：{near['text']}")
+    rank = h.get("rank")
+    if rank:
+        st.caption(f"候補スコア {rank['score']:.2f}（音数 {rank['mora']:.1f} / 参照句 {rank['overlap']:.1f} / "
+                   f"繰り返し {rank['repetition']:.1f} / 新しさ {rank['novelty']:.2f}）")
 
     with st.expander("📖 意訳・背景（俳句の情景と感情）", expanded=True):
         st.markdown(explanation_ja if explanation_ja.strip() else "（意訳なし）")
@@ -358,7 +429,6 @@ if st.session_state.get("haiku_data"):
     with st.expander("🧭 参照句の要素をどう使ったか", expanded=True):
         st.markdown(reasons_refs_ja or "（理由なし）")
 
-from PIL import Image
 from datetime import datetime
 from pathlib import Path
 
@@ -372,16 +442,19 @@ if st.session_state.get("haiku_data"):
         # 2) ここで “画像を表示する置き場” をボタンの下に確保
         image_area = st.container()
 
-        # 3) 押されたら生成
-        if clicked:
+        # 3) 押されたら生成（まとめて生成モードでは先行ジョブの結果を受け取る）
+        job = st.session_state.get("pipeline_job")
+        from_pipeline = job is not None and "image" in job.futures
+        if clicked or from_pipeline:
             if not st.session_state.get("image_prompt"):
                 st.warning("先に『① 俳句生成』を実行してください。")
             else:
                 with st.spinner("浮世絵風画像を生成中..."):
-                    img = generate_image(st.session_state.image_prompt, size="1024x1024")
-                if isinstance(img, Image.Image):
-                    img = img.convert("RGB").copy()
-                st.session_state.img = img
+                    if from_pipeline:
+                        img = job.take("image")
+                    else:
+                        img = generate_image(st.session_state.image_prompt, size="1024x1024")
+                st.session_state.img = img   # ImageArtifact（元の PNG バイト列を保持）
 
                 # 保存（DLボタン用のパスも保持）
                 meta = {
@@ -406,23 +479,37 @@ if st.session_state.get("haiku_data"):
         with image_area:
             if st.session_state.get("img") is not None:
                 st.subheader("🖼️ 生成画像")
-                st.image(st.session_state.img, caption="1024x1024 / Utagawa Hiroshige style", width=500)
+                # 表示は軽い WebP 派生（間に合わなければマスター PNG）
+                disp = get_rendition(st.session_state.img, "display", timeout=2.0) or st.session_state.img
+                st.image(disp.data, caption="1024x1024 / Utagawa Hiroshige style", width=500)
 
                 paths = st.session_state.get("img_paths")
                 if paths:
-                    with open(paths["png"], "rb") as f:
+                    st.download_button(
+                        "📥 画像PNGをダウンロード",
+                        data=st.session_state.img.data,   # 保存済みファイルを読み直さない
+                        file_name=Path(paths["png"]).name,
+                        mime=st.session_state.img.mime,
+                        key=f"download_png_{Path(paths['png']).name}"  # 重複防止
+                    )
+                    jpeg = get_rendition(st.session_state.img, "display_jpeg", timeout=2.0)
+                    if jpeg is not None:
                         st.download_button(
-                            "📥 画像PNGをダウンロード",
-                            data=f,
-                            file_name=Path(paths["png"]).name,
-                            mime="image/png",
-                            key=f"download_png_{Path(paths['png']).name}"  # 重複防止
+                            "📥 軽量JPEGをダウンロード",
+                            data=jpeg.data,
+                            file_name=f"{Path(paths['png']).stem}.jpg",
+                            mime=jpeg.mime,
+                            key=f"download_jpg_{Path(paths['png']).name}"
                         )
 
 
 
 # ③ 英語俳句（X用）生成
 st.markdown("---")
+_job = st.session_state.get("pipeline_job")
+if _job is not None and "english" in _job.futures and st.session_state.get("haiku_data"):
+    with st.spinner("英語俳句を生成中..."):
+        st.session_state.twitter_block = _job.take("english")
 if st.button("③ 英語俳句を生成", key="btn_make_english"):
     if not st.session_state.get("haiku_data"):
         st.warning("先に『① 俳句生成』を実行してください。")
@@ -438,8 +525,8 @@ if st.session_state.get("twitter_block"):
 
 
 # ==== ④ 画像を英語俳句入りで再出力（API合成：画像内に文字） ==========================
-from image_gen import edit_image_with_text
-import re, io
+from image_gen import ImageArtifact, edit_image_with_text, overlay_text_local
+import re
 import streamlit as st
 
 st.markdown("### ④ 画像を英語俳句入りで再出力")
@@ -581,22 +668,37 @@ else:
             key="remix_directives_area",
             height=260
         )
+    overlay_mode = st.radio(
+        "合成方法",
+        ["ローカル合成（高速）", "API 編集（gpt-image-1）"],
+        key="overlay_mode",
+        horizontal=True,
+        help="ローカル合成は配置・インセット・行間の設定で手元で文字を重ねます（レイアウト指示文は API 編集でのみ使用）。",
+    )
     # 実行ボタン
     if st.button("④ 英語俳句入りで再出力", key="btn_remix_en_overlay"):
         with st.spinner("英語俳句を画像に配置中..."):
-            final_img = edit_image_with_text(base_img, directives, size="1024x1024")
+            if overlay_mode.startswith("ローカル"):
+                final_img = overlay_text_local(
+                    base_img, haiku_en,
+                    pos_choice=st.session_state.pos_choice,
+                    inset_pct=st.session_state.inset_pct,
+                    min_bottom_px=st.session_state.min_bottom_px,
+                    line_spacing=st.session_state.line_spacing,
+                )
+            else:
+                final_img = edit_image_with_text(base_img, directives, size="1024x1024")
 
         if final_img.size != base_img.size:
-            final_img = final_img.resize(base_img.size)
+            final_img = ImageArtifact.from_image(final_img.image.resize(base_img.size))
 
         st.session_state.img_with_en = final_img
-        st.image(final_img, caption="✅ 最終画像（画像内に英語俳句）", width=500)
+        disp = get_rendition(final_img, "display", timeout=2.0) or final_img
+        st.image(disp.data, caption="✅ 最終画像（画像内に英語俳句）", width=500)
 
-        buf = io.BytesIO()
-        final_img.save(buf, format="PNG")
         st.download_button(
             "📥 最終画像PNGをダウンロード",
-            data=buf.getvalue(),
-            file_name="artwork_final_with_english_haiku.png",
-            mime="image/png"
+            data=final_img.data,
+            file_name=f"artwork_final_with_english_haiku.{final_img.ext}",
+            mime=final_img.mime
         )
@@ -0,0 +1,217 @@
+"""
+生成物（画像・メタ JSON）の保存先。
+
+- ファイル名は内容の sha256（同じ秒に複数セッションが保存しても衝突しない）
+- キーは <YYYY>/<MM>/<DD>/<ハッシュ先頭2桁>/<ハッシュ>.<拡張子> に分散（1ディレクトリに溜めない）
+- 書込みはバックグラウンドのライタースレッドで行い、呼び出し元はキーだけ受け取って先へ進む
+- ローカルディスクへの書込みは一時ファイル → os.replace のアトミックな置換
+- 保存先（バックエンド）は差し替え可能: ローカルディスク（既定）/ S3 互換（MinIO など、boto3 が必要）
+
+環境変数:
+    HAIKU_ARTIFACT_BACKEND (local | s3) / HAIKU_ARTIFACT_ROOT (outputs)
+    HAIKU_ARTIFACT_BUCKET / HAIKU_S3_ENDPOINT_URL（s3 のとき）
+"""
+from __future__ import annotations
+import os, queue, hashlib, logging, tempfile, threading
+from concurrent.futures import Future
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+_logger = logging.getLogger("haiku_artifacts")
+
+
+def content_id(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def make_key(digest: str, ext: str, when: Optional[datetime] = None) -> str:
+    when = when or datetime.now()
+    return f"{when:%Y/%m/%d}/{digest[:2]}/{digest}.{ext.lstrip('.')}"
+
+
+# =============================
+# バックエンド
+# =============================
+class LocalBackend:
+    """root 以下にキーのパスで保存する。"""
+
+    def __init__(self, root: str | Path):
+        self.root = Path(root)
+
+    def locate(self, key: str) -> str:
+        return str(self.root / key)
+
+    def exists(self, key: str) -> bool:
+        return (self.root / key).exists()
+
+    def put(self, key: str, data: bytes) -> None:
+        path = self.root / key
+        path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.", suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp, path)
+        except BaseException:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+
+    def get(self, key: str) -> bytes:
+        return (self.root / key).read_bytes()
+
+
+_s3_client = None
+_s3_client_lock = threading.Lock()
+
+def _get_s3_client():
+    """プロセス共有の boto3 クライアント（HAIKU_S3_ENDPOINT_URL を使う）。"""
+    global _s3_client
+    with _s3_client_lock:
+        if _s3_client is None:
+            import boto3
+            _s3_client = boto3.client("s3", endpoint_url=os.getenv("HAIKU_S3_ENDPOINT_URL") or None)
+    return _s3_client
+
+
+class S3Backend:
+    """S3 互換ストレージ（MinIO 等は endpoint_url を指定）。boto3 は使う時だけ import する。"""
+
+    def __init__(self, bucket: str, prefix: str = "", endpoint_url: Optional[str] = None):
+        import boto3
+        self.bucket = bucket
+        self.prefix = prefix.strip("/")
+        self._s3 = boto3.client("s3", endpoint_url=endpoint_url)
+
+    def _k(self, key: str) -> str:
+        return f"{self.prefix}/{key}" if self.prefix else key
+
+    def locate(self, key: str) -> str:
+        return f"s3://{self.bucket}/{self._k(key)}"
+
+    def exists(self, key: str) -> bool:
+        try:
+            self._s3.head_object(Bucket=self.bucket, Key=self._k(key))
+            return True
+        except Exception:
+            return False
+
+    def put(self, key: str, data: bytes) -> None:
+        self._s3.put_object(Bucket=self.bucket, Key=self._k(key), Body=data)
+
+    def get(self, key: str) -> bytes:
+        return self._s3.get_object(Bucket=self.bucket, Key=self._k(key))["Body"].read()
+
+
+def _split_s3(location: str) -> Tuple[str, str]:
+    bucket, _, key = location[len("s3://"):].partition("/")
+    return bucket, key
+
+
+def location_exists(location: str) -> bool:
+    """locate() の返り値（ローカルパスまたは s3://バケット/キー）の実体があるか。"""
+    if location.startswith("s3://"):
+        bucket, key = _split_s3(location)
+        try:
+            _get_s3_client().head_object(Bucket=bucket, Key=key)
+            return True
+        except Exception:
+            return False
+    return os.path.exists(location)
+
+
+def read_location(location: str) -> bytes:
+    """locate() の返り値からバイト列を読む（X 投稿など、保存先を問わず読み出す側用）。"""
+    if location.startswith("s3://"):
+        bucket, key = _split_s3(location)
+        return _get_s3_client().get_object(Bucket=bucket, Key=key)["Body"].read()
+    return Path(location).read_bytes()
+
+
+# =============================
+# ストア本体
+# =============================
+class ArtifactStore:
+    """
+    put() はキーを決めて書込みをキューに積み、すぐ返す。
+    書込み完了前の get() は手元のバイト列から返すので、直後の読み出しでも欠けない。
+    """
+
+    def __init__(self, backend):
+        self.backend = backend
+        self._queue: "queue.Queue[Tuple[str, bytes, bool, Future]]" = queue.Queue()
+        self._pending: Dict[str, Tuple[bytes, Future]] = {}
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, name="haiku-artifact-writer", daemon=True)
+        self._thread.start()
+
+    def _run(self) -> None:
+        while True:
+            key, data, overwrite, fut = self._queue.get()
+            try:
+                if overwrite or not self.backend.exists(key):   # 内容ハッシュのキーは書き直さない
+                    self.backend.put(key, data)
+                fut.set_result(key)
+            except Exception as e:
+                _logger.error(f"artifact write failed ({key}): {e}")
+                fut.set_exception(e)
+            finally:
+                with self._lock:
+                    # 後から同じキーに別の内容が積まれていれば、そちらの書込みまで残す
+                    if self._pending.get(key, (None, None))[1] is fut:
+                        del self._pending[key]
+                self._queue.task_done()
+
+    def put_key(self, key: str, data: bytes, overwrite: bool = True) -> Future:
+        """
+        指定キーで非同期に保存する。返り値の Future は書込み完了でキーを返す。
+        同じキーの書込みが待ち中なら、内容が同じときはその Future を返し、
+        違うときは新しい内容を後ろに積む（最後に積んだ内容が残る）。
+        """
+        with self._lock:
+            pending = self._pending.get(key)
+            if pending is not None and pending[0] == data:
+                return pending[1]
+            fut: Future = Future()
+            self._pending[key] = (data, fut)
+        self._queue.put((key, data, overwrite, fut))
+        return fut
+
+    def put(self, data: bytes, ext: str, when: Optional[datetime] = None) -> Tuple[str, Future]:
+        """内容ハッシュのキーで非同期に保存し、(キー, Future) を返す。"""
+        key = make_key(content_id(data), ext, when)
+        return key, self.put_key(key, data, overwrite=False)
+
+    def get(self, key: str) -> bytes:
+        with self._lock:
+            pending = self._pending.get(key)
+        return pending[0] if pending is not None else self.backend.get(key)
+
+    def locate(self, key: str) -> str:
+        return self.backend.locate(key)
+
+    def flush(self) -> None:
+        """キューに積まれた書込みがすべて終わるまで待つ。"""
+        self._queue.join()
+
+
+_stores: Dict[str, ArtifactStore] = {}
+_stores_lock = threading.Lock()
+
+def get_store(root: str | Path | None = None) -> ArtifactStore:
+    """
+    root ごとのプロセス共有ストア。HAIKU_ARTIFACT_BACKEND=s3 のときは root を
+    バケット内のプレフィックスとして使う。
+    """
+    root = str(root or os.getenv("HAIKU_ARTIFACT_ROOT", "outputs"))
+    with _stores_lock:
+        store = _stores.get(root)
+        if store is None:
+            if os.getenv("HAIKU_ARTIFACT_BACKEND", "local") == "s3":
+                backend = S3Backend(os.environ["HAIKU_ARTIFACT_BUCKET"], prefix=root,
+                                    endpoint_url=os.getenv("HAIKU_S3_ENDPOINT_URL") or None)
+            else:
+                backend = LocalBackend(root)
+            store = _stores[root] = ArtifactStore(backend)
+    return store
@@ -0,0 +1,249 @@
+"""
+俳句＋浮世絵のバッチ生成（ブラウザ不要のヘッドレス実行）。
+
+ジョブ一覧（JSONL または CSV）の各行について
+pick_references → call_gpt_haiku → build_image_prompt → generate_image → save_artifacts
+を並列度を制限して実行する。完了したジョブはチェックポイントに追記し、
+再実行時（クラッシュ後など）はスキップする。
+
+ジョブの列: id（省略時は行番号と内容のハッシュ）, season, plutchik, aesthetic, keyword, experience
+任意: k, prioritize_giongo, retrieval
+
+使い方:
+    python batch.py jobs.jsonl --concurrency 4 --out outputs/batch
+    python batch.py jobs.jsonl --post      # 生成した作品を X の投稿キューへ（レート上限内で順次投稿）
+"""
+from __future__ import annotations
+import os, sys, csv, json, time, random, hashlib, argparse, threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Set
+
+from openai import RateLimitError
+
+import haiku_log
+
+_logger = haiku_log.get_logger("haiku_batch")
+
+JOB_FIELDS = ["season", "plutchik", "aesthetic", "keyword", "experience"]
+
+
+def load_jobs(path: str | Path) -> List[dict]:
+    path = Path(path)
+    if path.suffix.lower() == ".csv":
+        with open(path, encoding="utf-8-sig", newline="") as f:
+            jobs = [dict(row) for row in csv.DictReader(f)]
+    else:
+        with open(path, encoding="utf-8") as f:
+            jobs = [json.loads(line) for line in f if line.strip()]
+    for i, job in enumerate(jobs):
+        if not job.get("id"):
+            # 同じ内容の行が複数あっても別ジョブになるよう、行番号もハッシュに含める
+            canon = json.dumps({"_line": i, **{k: job.get(k, "") for k in JOB_FIELDS}},
+                               ensure_ascii=False, sort_keys=True)
+            job["id"] = hashlib.sha256(canon.encode("utf-8")).hexdigest()[:12]
+    return jobs
+
+
+class Checkpoint:
+    """完了ジョブを JSONL に追記するチェックポイント（1行書くごとに fsync）。"""
+
+    def __init__(self, path: Path):
+        self.path = path
+        self._lock = threading.Lock()
+        self.done: Set[str] = set()
+        self._torn = False   # 末尾が改行で終わっていない（書きかけ行がある）
+        if path.exists():
+            with open(path, encoding="utf-8") as f:
+                for line in f:
+                    self._torn = not line.endswith("\n")
+                    try:
+                        rec = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue   # クラッシュ時の書きかけ行
+                    if rec.get("status") == "done":
+                        self.done.add(rec["id"])
+
+    def record(self, rec: dict) -> None:
+        line = json.dumps(rec, ensure_ascii=False) + "\n"
+        with self._lock:
+            if self._torn:
+                # 書きかけ行の続きにすると次回読めないので、改行してから書く
+                line, self._torn = "\n" + line, False
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(line)
+                f.flush()
+                os.fsync(f.fileno())
+            if rec.get("status") == "done":
+                self.done.add(rec["id"])
+
+
+class RateGate:
+    """
+    レート制限の共有ゲート。どこかのワーカーが 429 を受けたら全ワーカーの開始を一時停止し、
+    min_interval 秒より短い間隔ではジョブを開始しない。
+    """
+
+    def __init__(self, min_interval: float = 0.0, cooldown: float = 30.0):
+        self.min_interval = min_interval
+        self.cooldown = cooldown
+        self._lock = threading.Lock()
+        self._next_start = 0.0
+        self._paused_until = 0.0
+
+    def wait(self) -> None:
+        with self._lock:
+            now = time.time()
+            start = max(now, self._next_start, self._paused_until)
+            self._next_start = start + self.min_interval
+        if start > now:
+            time.sleep(start - now)
+
+    def trip(self) -> None:
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.time() + self.cooldown)
+        _logger.warning(f"rate limited → pausing new calls for {self.cooldown:.0f}s")
+
+
+def run_job(job: dict, df, out_root: Path, with_english: bool = False, post: bool = False) -> dict:
+    from haiku_core import pick_references
+    from haiku_gpt import call_gpt_haiku, generate_english_tweet_block
+    from image_gen import build_image_prompt, generate_image, save_artifacts
+    from dedup_index import get_dedup_index
+
+    payload = {k: job.get(k, "") for k in JOB_FIELDS}
+    payload["aesthetic"] = job.get("aesthetic") or "スキップ"   # 画面の未選択と同じ値に揃える
+    refs = pick_references(
+        df,
+        season=payload["season"],
+        plutchik=payload["plutchik"],
+        aesthetic=payload["aesthetic"],
+        keyword=payload["keyword"],
+        k=int(job.get("k") or 3),
+        prioritize_giongo=str(job.get("prioritize_giongo", True)).lower() not in ("0", "false", "no"),
+        retrieval=job.get("retrieval") or "keyword",
+        experience=payload["experience"],
+    )
+    payload["references"] = refs
+    h = call_gpt_haiku(payload)
+    if not h.get("haiku_ja"):
+        raise RuntimeError("俳句の生成結果が空です")
+
+    image_prompt = build_image_prompt(
+        haiku_ja=h.get("haiku_ja", ""),
+        explanation_ja=h.get("explanation_ja", ""),
+        season=payload["season"],
+        keyword=payload["keyword"],
+        aesthetic=payload["aesthetic"],
+    )
+    img = generate_image(image_prompt, size="1024x1024")
+    meta = {
+        **{k: payload[k] for k in JOB_FIELDS},
+        "job_id": job["id"],
+        "haiku": {"ja": h.get("haiku_ja", ""), "reading": h.get("reading_ja", "")},
+        "near_duplicate": get_dedup_index(df).check(h.get("haiku_ja", ""), h.get("reading_ja"), k=1),
+        "explanation_ja": h.get("explanation_ja", ""),
+        "reasons_ja": h.get("reasons_refs_ja", ""),
+        "references": refs,
+        "image_prompt": image_prompt,
+        "size": "1024x1024",
+        "model": "gpt-image-1",
+        "created_at": datetime.now().isoformat(timespec="seconds"),
+    }
+    if with_english or post:
+        meta["twitter_block"] = generate_english_tweet_block(h.get("haiku_ja", ""), h.get("explanation_ja", ""))
+    # チェックポイントに done を書く前にファイルが揃っているよう、書込み完了を待つ
+    paths = save_artifacts(img, meta, output_dir=out_root, wait=True)
+    if post:
+        from x_client import enqueue_post
+        paths["post_job"] = enqueue_post(meta["twitter_block"], paths["png"])
+    return paths
+
+
+def run_batch(jobs: Iterable[dict], csv_path: str, out_root: Path, *, concurrency: int = 4,
+              min_interval: float = 0.0, max_attempts: int = 3, with_english: bool = False,
+              post: bool = False, post_jobs: Optional[List[str]] = None) -> Dict[str, int]:
+    """post_jobs を渡すと、このバッチで X の投稿キューに積んだ job id を追記する。"""
+    from haiku_core import load_haiku_df
+    from dedup_index import get_dedup_index
+
+    out_root.mkdir(parents=True, exist_ok=True)
+    ckpt = Checkpoint(out_root / "checkpoint.jsonl")
+    jobs = list(jobs)
+    pending = [j for j in jobs if j["id"] not in ckpt.done]
+    stats = {"skipped": len(jobs) - len(pending), "done": 0, "failed": 0}
+    if not pending:
+        return stats
+
+    df = load_haiku_df(csv_path)
+    get_dedup_index(df)   # 既存句との重複チェック用（ワーカーが並行して作り始めないよう先に構築）
+    gate = RateGate(min_interval=min_interval)
+
+    def _worker(job: dict) -> dict:
+        for attempt in range(1, max_attempts + 1):
+            gate.wait()
+            t0 = time.time()
+            try:
+                with haiku_log.context(session_id=str(job["id"])):   # 生成・投稿のログをジョブ単位で追える
+                    paths = run_job(job, df, out_root, with_english=with_english, post=post)
+                return {"id": job["id"], "status": "done", "attempts": attempt,
+                        "elapsed_sec": round(time.time() - t0, 2), **paths}
+            except RateLimitError as e:
+                gate.trip()
+                err = e
+            except Exception as e:
+                err = e
+                time.sleep(min(30.0, 2 ** attempt) + random.uniform(0, 1))
+            _logger.warning(f"job {job['id']} attempt {attempt}/{max_attempts} failed: {err}")
+        return {"id": job["id"], "status": "failed", "attempts": max_attempts,
+                "error": f"{err.__class__.__name__}: {err}"}
+
+    with ThreadPoolExecutor(max_workers=max(1, concurrency), thread_name_prefix="haiku-batch") as ex:
+        futures = [ex.submit(_worker, j) for j in pending]
+        for fut in as_completed(futures):
+            rec = fut.result()
+            ckpt.record(rec)
+            stats[rec["status"]] += 1
+            if post_jobs is not None and rec.get("post_job"):
+                post_jobs.append(rec["post_job"])
+            _logger.info(f"[{sum(stats.values())}] {rec['id']}: {rec['status']}")
+    return stats
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    ap = argparse.ArgumentParser(description="一茶コーパスからの俳句＋浮世絵バッチ生成")
+    ap.add_argument("jobs", help="ジョブ一覧（.jsonl / .csv）")
+    ap.add_argument("--csv", default="haiku_with_repetition.csv", help="一茶コーパスの CSV")
+    ap.add_argument("--out", default="outputs/batch", help="出力ディレクトリ（チェックポイントもここ）")
+    ap.add_argument("--concurrency", type=int, default=4, help="同時実行ジョブ数")
+    ap.add_argument("--min-interval", type=float, default=0.0, help="ジョブ開始の最小間隔（秒）")
+    ap.add_argument("--max-attempts", type=int, default=3, help="1ジョブあたりの最大試行回数")
+    ap.add_argument("--with-english", action="store_true", help="X 用の英語ブロックもメタに含める")
+    ap.add_argument("--post", action="store_true",
+                    help="完了したジョブを X の投稿キューに積み、終了前にそれらの投稿が終わるまで待つ")
+    ap.add_argument("--post-timeout", type=float, default=900.0,
+                    help="--post のとき投稿完了を待つ最大秒数（残りはキューに残り、次回以降に投稿される）")
+    args = ap.parse_args(argv)
+
+    try:
+        from dotenv import load_dotenv
+        load_dotenv()
+    except ImportError:
+        pass
+
+    jobs = load_jobs(args.jobs)
+    post_jobs: List[str] = []
+    stats = run_batch(jobs, args.csv, Path(args.out), concurrency=args.concurrency,
+                      min_interval=args.min_interval, max_attempts=args.max_attempts,
+                      with_english=args.with_english, post=args.post, post_jobs=post_jobs)
+    if args.post:
+        from x_client import wait_posts
+        stats["posts_pending"] = wait_posts(post_jobs, timeout=args.post_timeout)
+    print(json.dumps(stats, ensure_ascii=False))
+    return 0 if stats["failed"] == 0 else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,124 @@
+"""
+コーパス読込と参照句選定のマイクロベンチマーク（ネットワーク不要）。
+
+- CSV 直読み / コーパスのビルド（コールド）/ コンパイル済みコーパス読込（ウォーム）
+- n-gram・ファセット・ベクトル・近似重複（MinHash/LSH）各インデックスの構築時間と重複照会
+- pick_references を 季節×感情×情緒×キーワード の全組み合わせで実行したときの分位点
+
+使い方:
+    python bench/bench_core.py [--csv haiku_with_repetition.csv] [--repeat 3] [--json out.json]
+"""
+from __future__ import annotations
+import sys, json, time, shutil, argparse, tempfile, itertools
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import pandas as pd
+
+import metrics
+from corpus_store import build_corpus, load_corpus
+from haiku_index import NgramIndex, FacetIndex, _CACHE
+from vector_index import get_vector_index
+from dedup_index import DedupIndex, get_dedup_index
+
+SEASONS = ["春", "夏", "秋", "冬", "新年", "無季"]
+PLUTCHIK = ["喜び", "信頼", "恐れ", "驚き", "悲しみ", "嫌悪", "怒り", "期待"]
+KEYWORDS = ["", "道", "子供", "海", "桜", "紅葉の葉"]
+
+
+def _time(fn, repeat: int = 1):
+    samples = []
+    result = None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        result = fn()
+        samples.append(time.perf_counter() - t0)
+    return result, samples
+
+
+def _row(name: str, samples: list) -> dict:
+    qs = metrics.percentiles(samples)
+    return {"name": name, "n": len(samples), "mean_ms": 1000 * sum(samples) / len(samples),
+            **{k: 1000 * v for k, v in qs.items()}}
+
+
+def run(csv_path: str, repeat: int = 3) -> list:
+    from haiku_core import AESTHETICS, load_haiku_df, pick_references
+
+    rows = []
+    _, s = _time(lambda: pd.read_csv(csv_path, encoding="utf-8-sig"), repeat)
+    rows.append(_row("load: pd.read_csv", s))
+
+    tmp = Path(tempfile.mkdtemp(prefix="corpus_bench_"))
+    try:
+        def cold():
+            shutil.rmtree(tmp, ignore_errors=True)
+            return build_corpus(csv_path, tmp)
+        _, s = _time(cold, repeat)
+        rows.append(_row("load: build_corpus (cold)", s))
+        _, s = _time(lambda: load_corpus(csv_path, tmp, build=False), repeat)
+        rows.append(_row("load: load_corpus (warm)", s))
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+    raw_load = getattr(load_haiku_df, "__wrapped__", load_haiku_df)   # st.cache_data を通さない本体
+    df, s = _time(lambda: raw_load(csv_path), repeat)
+    rows.append(_row("load: load_haiku_df (uncached)", s))
+
+    _, s = _time(lambda: NgramIndex.from_df(df), 1)
+    rows.append(_row("index: NgramIndex build", s))
+    _, s = _time(lambda: FacetIndex(df), repeat)
+    rows.append(_row("index: FacetIndex build", s))
+    _, s = _time(lambda: get_vector_index(df), 1)
+    rows.append(_row("index: VectorIndex load/build", s))
+    _, s = _time(lambda: DedupIndex.from_df(df), 1)
+    rows.append(_row("index: DedupIndex (MinHash/LSH) build", s))
+
+    dedup = get_dedup_index(df)
+    sample = df.sample(min(2000, len(df)), random_state=0)
+    samples = []
+    for haiku, reading in zip(sample["俳句"].astype(str), sample["読み"].astype(str)):
+        t0 = time.perf_counter()
+        dedup.nearest(haiku, reading)
+        samples.append(time.perf_counter() - t0)
+    rows.append(_row(f"dedup nearest ({len(samples)} corpus haiku)", samples))
+
+    # 以降はキャッシュ済みインデックスで計測（初回構築分を含めない）
+    pick_references(df, "秋", "悲しみ", "無常", "道")
+    grid = list(itertools.product(SEASONS, PLUTCHIK, AESTHETICS, KEYWORDS))
+    samples = []
+    for season, plutchik, aesthetic, kw in grid:
+        t0 = time.perf_counter()
+        pick_references(df, season, plutchik, aesthetic, kw)
+        samples.append(time.perf_counter() - t0)
+    rows.append(_row(f"pick_references keyword ({len(grid)} combos)", samples))
+
+    samples = []
+    for season, plutchik in itertools.product(SEASONS, PLUTCHIK):
+        t0 = time.perf_counter()
+        pick_references(df, season, plutchik, "スキップ", "道", retrieval="semantic",
+                        experience="紅葉の葉が濡れて貼りつく、土の道。")
+        samples.append(time.perf_counter() - t0)
+    rows.append(_row(f"pick_references semantic ({len(samples)} combos)", samples))
+    return rows
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description="コーパス読込・参照句選定のマイクロベンチマーク")
+    ap.add_argument("--csv", default="haiku_with_repetition.csv")
+    ap.add_argument("--repeat", type=int, default=3)
+    ap.add_argument("--json", help="結果を JSON で保存するパス")
+    args = ap.parse_args()
+
+    _CACHE.clear()
+    rows = run(args.csv, args.repeat)
+    print(f"{'benchmark':48s} {'n':>5s} {'mean':>9s} {'p50':>9s} {'p95':>9s} {'p99':>9s}  (ms)")
+    for r in rows:
+        print(f"{r['name']:48s} {r['n']:5d} {r['mean_ms']:9.3f} {r['p50']:9.3f} {r['p95']:9.3f} {r['p99']:9.3f}")
+    if args.json:
+        Path(args.json).write_text(json.dumps(rows, ensure_ascii=False, indent=2), encoding="utf-8")
+
+
+if __name__ == "__main__":
+    main()
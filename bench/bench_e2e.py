@@ -0,0 +1,125 @@
+"""
+生成パイプライン全体のエンドツーエンド・ベンチマーク（ローカル代替サーバ使用、オフライン可）。
+
+1セッション = pick_references → call_gpt_haiku → build_image_prompt → generate_image
+             → generate_english_tweet_block → post_to_x
+を --sessions 回、--concurrency 並列で実行し、段階ごとの p50/p95/p99 とスループットを出す。
+
+使い方:
+    python bench/bench_e2e.py --sessions 40 --concurrency 8 --chat-latency 0.5 --image-latency 2 --rate-429 0.05
+"""
+from __future__ import annotations
+import os, sys, json, time, argparse, tempfile
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from urllib.parse import urlsplit
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import requests
+
+from mock_server import MockServer, Profile
+
+
+class _RedirectAdapter(requests.adapters.HTTPAdapter):
+    """api.twitter.com / upload.twitter.com 宛てのリクエストを代替サーバへ向け直す。"""
+
+    def __init__(self, base_url: str, **kwargs):
+        super().__init__(**kwargs)
+        self.base = urlsplit(base_url)
+
+    def send(self, request, **kwargs):
+        u = urlsplit(request.url)
+        request.url = u._replace(scheme=self.base.scheme, netloc=self.base.netloc).geturl()
+        return super().send(request, **kwargs)
+
+
+def _configure(mock_url: str, out_dir: Path) -> None:
+    """環境変数とクライアントを代替サーバ向けに設定する（アプリ側モジュールの import 前に呼ぶ）。"""
+    os.environ["OPENAI_BASE_URL"] = f"{mock_url}/v1"
+    os.environ["OPENAI_API_KEY"] = "sk-mock"
+    os.environ.setdefault("HAIKU_CACHE_DISABLE", "1")
+    for k in ["TWITTER_API_KEY", "TWITTER_API_SECRET", "TWITTER_ACCESS_TOKEN", "TWITTER_ACCESS_SECRET"]:
+        os.environ.setdefault(k, "mock")
+
+    import x_client
+    orig = x_client._get_x_clients
+
+    def _patched():
+        client, api = orig()
+        for sess in (client.session, api.session):
+            sess.mount("https://", _RedirectAdapter(mock_url))
+        return client, api
+
+    x_client._get_x_clients = _patched
+
+
+def run_session(df, i: int, out_dir: Path) -> None:
+    from haiku_core import pick_references
+    from haiku_gpt import call_gpt_haiku, generate_english_tweet_block
+    from image_gen import build_image_prompt, generate_image, save_artifacts
+    from x_client import post_to_x
+
+    refs = pick_references(df, "秋", "悲しみ", "無常", "道")
+    payload = {"season": "秋", "plutchik": "悲しみ", "aesthetic": "無常", "keyword": "道",
+               "experience": f"bench session {i}", "references": refs}
+    h = call_gpt_haiku(payload, use_cache=False)
+    prompt = build_image_prompt(h["haiku_ja"], h["explanation_ja"], "秋", "道", "無常")
+    img = generate_image(prompt)
+    paths = save_artifacts(img, {"i": i}, output_dir=out_dir, wait=True)
+    block = generate_english_tweet_block(h["haiku_ja"], h["explanation_ja"], use_cache=False)
+    post_to_x(block, paths["png"])
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description="ローカル代替サーバを使ったエンドツーエンド・ベンチマーク")
+    ap.add_argument("--csv", default="haiku_with_repetition.csv")
+    ap.add_argument("--sessions", type=int, default=20)
+    ap.add_argument("--concurrency", type=int, default=4)
+    ap.add_argument("--chat-latency", type=float, default=0.3)
+    ap.add_argument("--image-latency", type=float, default=1.0)
+    ap.add_argument("--x-latency", type=float, default=0.1)
+    ap.add_argument("--jitter", type=float, default=0.05)
+    ap.add_argument("--error-rate", type=float, default=0.0)
+    ap.add_argument("--rate-429", type=float, default=0.0)
+    ap.add_argument("--json", help="段階ごとの集計を JSON で保存するパス")
+    args = ap.parse_args()
+
+    def prof(lat):
+        return Profile(lat, args.jitter, args.error_rate, args.rate_429)
+
+    out_dir = Path(tempfile.mkdtemp(prefix="haiku_bench_"))
+    with MockServer(profiles={"chat": prof(args.chat_latency), "image": prof(args.image_latency),
+                              "x": prof(args.x_latency)}) as srv:
+        _configure(srv.url, out_dir)
+        import metrics
+        from haiku_core import load_haiku_df
+
+        df = load_haiku_df(args.csv)
+        errors = 0
+        t0 = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.concurrency) as ex:
+            futures = [ex.submit(run_session, df, i, out_dir) for i in range(args.sessions)]
+            for f in futures:
+                try:
+                    f.result()
+                except Exception as e:
+                    errors += 1
+                    print(f"session failed: {e.__class__.__name__}: {e}", file=sys.stderr)
+        wall = time.perf_counter() - t0
+
+        stats = metrics.summary()
+        print(f"sessions={args.sessions} concurrency={args.concurrency} errors={errors} "
+              f"wall={wall:.2f}s throughput={args.sessions / wall:.2f} sessions/s")
+        print(f"server counts: {json.dumps(srv.state.counts, ensure_ascii=False)}")
+        print(f"{'endpoint':32s} {'n':>5s} {'err':>4s} {'p50':>8s} {'p95':>8s} {'p99':>8s}  latency (s)")
+        for ep, st in stats.items():
+            lat = st["latency_sec"] or {"p50": 0, "p95": 0, "p99": 0}
+            print(f"{ep:32s} {st['count']:5d} {st['errors']:4d} {lat['p50']:8.3f} {lat['p95']:8.3f} {lat['p99']:8.3f}")
+        if args.json:
+            Path(args.json).write_text(json.dumps({"wall_sec": wall, "errors": errors, "stages": stats},
+                                                  ensure_ascii=False, indent=2), encoding="utf-8")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,248 @@
+"""
+OpenAI / X(Twitter) API のローカル代替サーバ（ベンチマーク・オフライン検証用）。
+
+対応エンドポイント:
+    POST /v1/chat/completions      （stream=true なら SSE で分割送信）
+    POST /v1/images/generations
+    POST /v1/images/edits
+    POST /2/tweets
+    POST /1.1/media/upload.json
+
+遅延・エラー率・429 の注入率はエンドポイント種別ごとに設定できる。
+OpenAI SDK は OPENAI_BASE_URL=http://127.0.0.1:<port>/v1 でこちらに向く。
+
+単体起動:
+    python bench/mock_server.py --port 8765 --chat-latency 0.8 --image-latency 6 --rate-429 0.05
+"""
+from __future__ import annotations
+import io, json, time, random, base64, argparse, threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Optional
+
+HAIKU_JSON = {
+    "haiku_ja": "秋の道 濡れ葉の上を 雨の音",
+    "reading_ja": "あきのみち ぬれはのうえを あめのおと",
+    "explanation_ja": "雨に濡れた紅葉の道を歩く静かな情景。",
+    "reasons_refs_ja": "【結論】参照句の音とリズムを生かした。\n- (1) 擬音\n- (2) 構図\n- (3) 文末",
+    "references_numbered": "",
+}
+ENGLISH_BLOCK = ("🌿 俳句（日本語）\n\n秋の道 濡れ葉の上を 雨の音\n\n🍃 Haiku (English)\n\n"
+                 "Autumn path—\nover the wet leaves\nthe sound of rain\n\n✨ Explanation\n\nA quiet walk in the rain.")
+
+
+class Profile:
+    """エンドポイント種別ごとの振る舞い（秒、確率）。"""
+
+    def __init__(self, latency: float = 0.0, jitter: float = 0.0, error_rate: float = 0.0,
+                 rate_429: float = 0.0, ttfb: Optional[float] = None):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.rate_429 = rate_429
+        self.ttfb = latency * 0.2 if ttfb is None else ttfb
+
+    def delay(self) -> float:
+        return max(0.0, self.latency + random.uniform(-self.jitter, self.jitter))
+
+
+class MockState:
+    def __init__(self, profiles: Optional[Dict[str, Profile]] = None, image_size: int = 1024):
+        self.profiles = {"chat": Profile(), "image": Profile(), "x": Profile()}
+        self.profiles.update(profiles or {})
+        self.counts: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        self._png = _make_png(image_size)
+
+    def count(self, key: str) -> None:
+        with self._lock:
+            self.counts[key] = self.counts.get(key, 0) + 1
+
+
+def _make_png(size: int) -> bytes:
+    try:
+        from PIL import Image
+        img = Image.effect_noise((size, size), 64).convert("RGB")
+        buf = io.BytesIO()
+        img.save(buf, format="PNG")
+        return buf.getvalue()
+    except ImportError:
+        # 1x1 の透明 PNG
+        return base64.b64decode("iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAQAAAC1HAwCAAAAC0lEQVR42mNkYAAAAAYAAjCB0C8AAAAASUVORK5CYII=")
+
+
+def _handler(state: MockState):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, fmt, *args):   # 標準エラーへのアクセスログを抑止
+            pass
+
+        def _read_body(self) -> bytes:
+            n = int(self.headers.get("Content-Length") or 0)
+            return self.rfile.read(n) if n else b""
+
+        def _send_json(self, status: int, obj: dict, headers: Optional[dict] = None) -> None:
+            body = json.dumps(obj, ensure_ascii=False).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.send_header("x-request-id", f"req_mock_{random.getrandbits(32):08x}")
+            for k, v in (headers or {}).items():
+                self.send_header(k, v)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _inject_failure(self, kind: str) -> bool:
+            prof = state.profiles[kind]
+            r = random.random()
+            if r < prof.rate_429:
+                state.count(f"{kind}:429")
+                self._send_json(429, {"error": {"message": "Rate limit reached (mock)", "type": "requests",
+                                                "code": "rate_limit_exceeded"}},
+                                {"retry-after": "1", "x-rate-limit-reset": str(int(time.time()) + 1)})
+                return True
+            if r < prof.rate_429 + prof.error_rate:
+                state.count(f"{kind}:500")
+                self._send_json(500, {"error": {"message": "Internal error (mock)", "type": "server_error"}})
+                return True
+            return False
+
+        def do_POST(self):
+            path = self.path.split("?", 1)[0]
+            body = self._read_body()
+            if path.endswith("/chat/completions"):
+                return self._chat(body)
+            if path.endswith("/images/generations") or path.endswith("/images/edits"):
+                return self._image(path)
+            if path.endswith("/2/tweets"):
+                return self._tweet(body)
+            if path.endswith("/media/upload.json"):
+                return self._media()
+            self._send_json(404, {"error": {"message": f"unknown path {path}"}})
+
+        def _chat(self, body: bytes) -> None:
+            state.count("chat")
+            prof = state.profiles["chat"]
+            if self._inject_failure("chat"):
+                return
+            req = json.loads(body or b"{}")
+            is_json = (req.get("response_format") or {}).get("type") == "json_object"
+            content = json.dumps(HAIKU_JSON, ensure_ascii=False) if is_json else ENGLISH_BLOCK
+            n = int(req.get("n") or 1)
+            usage = {"prompt_tokens": sum(len(str(m.get("content", ""))) for m in req.get("messages", [])),
+                     "completion_tokens": len(content) * n}
+            usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+            base = {"id": "chatcmpl-mock", "created": int(time.time()), "model": req.get("model", "mock")}
+
+            if not req.get("stream"):
+                time.sleep(prof.delay())
+                self._send_json(200, {**base, "object": "chat.completion", "usage": usage, "choices": [
+                    {"index": i, "finish_reason": "stop", "message": {"role": "assistant", "content": content}}
+                    for i in range(n)]})
+                return
+
+            # SSE: ttfb 後に最初のチャンク、残りを latency に渡って均等に送る
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Cache-Control", "no-cache")
+            self.send_header("Connection", "close")
+            self.end_headers()
+            time.sleep(prof.ttfb)
+            pieces = [content[i:i + 8] for i in range(0, len(content), 8)]
+            gap = max(0.0, prof.delay() - prof.ttfb) / max(1, len(pieces))
+            for piece in pieces:
+                chunk = {**base, "object": "chat.completion.chunk",
+                         "choices": [{"index": 0, "delta": {"content": piece}, "finish_reason": None}]}
+                self.wfile.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode("utf-8"))
+                self.wfile.flush()
+                time.sleep(gap)
+            if (req.get("stream_options") or {}).get("include_usage"):
+                tail = {**base, "object": "chat.completion.chunk", "choices": [], "usage": usage}
+                self.wfile.write(f"data: {json.dumps(tail)}\n\n".encode("utf-8"))
+            self.wfile.write(b"data: [DONE]\n\n")
+            self.wfile.flush()
+            self.close_connection = True
+
+        def _image(self, path: str) -> None:
+            state.count("image.edit" if path.endswith("edits") else "image.generate")
+            if self._inject_failure("image"):
+                return
+            time.sleep(state.profiles["image"].delay())
+            self._send_json(200, {"created": int(time.time()),
+                                  "data": [{"b64_json": base64.b64encode(state._png).decode("ascii")}]})
+
+        def _tweet(self, body: bytes) -> None:
+            state.count("x.tweet")
+            if self._inject_failure("x"):
+                return
+            time.sleep(state.profiles["x"].delay())
+            text = (json.loads(body or b"{}") or {}).get("text", "")
+            self._send_json(201, {"data": {"id": str(random.getrandbits(60)), "text": text}})
+
+        def _media(self) -> None:
+            state.count("x.media")
+            if self._inject_failure("x"):
+                return
+            time.sleep(state.profiles["x"].delay())
+            media_id = random.getrandbits(60)
+            self._send_json(200, {"media_id": media_id, "media_id_string": str(media_id),
+                                  "size": len(state._png), "expires_after_secs": 86400})
+
+    return Handler
+
+
+class MockServer:
+    """バックグラウンドスレッドで動く代替サーバ。with 文で起動・停止できる。"""
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, **state_kwargs):
+        self.state = MockState(**state_kwargs)
+        self.httpd = ThreadingHTTPServer((host, port), _handler(self.state))
+        self.httpd.daemon_threads = True
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    @property
+    def url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "MockServer":
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self) -> "MockServer":
+        return self.start()
+
+    def __exit__(self, *exc) -> None:
+        self.stop()
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description="OpenAI / X API のローカル代替サーバ")
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=8765)
+    ap.add_argument("--chat-latency", type=float, default=0.8)
+    ap.add_argument("--image-latency", type=float, default=6.0)
+    ap.add_argument("--x-latency", type=float, default=0.3)
+    ap.add_argument("--jitter", type=float, default=0.1, help="遅延の揺らぎ（±秒）")
+    ap.add_argument("--error-rate", type=float, default=0.0, help="500 を返す確率")
+    ap.add_argument("--rate-429", type=float, default=0.0, help="429 を返す確率")
+    args = ap.parse_args()
+
+    def prof(lat):
+        return Profile(lat, args.jitter, args.error_rate, args.rate_429)
+
+    srv = MockServer(args.host, args.port, profiles={
+        "chat": prof(args.chat_latency), "image": prof(args.image_latency), "x": prof(args.x_latency)})
+    print(f"mock server on {srv.url}  (OPENAI_BASE_URL={srv.url}/v1)")
+    try:
+        srv.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
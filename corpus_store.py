@@ -0,0 +1,150 @@
+"""
+一茶コーパス（haiku_with_repetition.csv）の事前コンパイル＆高速ローダ。
+
+CSV を列ごとの .npy（カテゴリ列は int16 コード、テキスト列は UTF-8 連結バイト列）へ
+変換し、`<csv名>-v<版>-<sha256先頭16桁>/` ディレクトリにキャッシュする。
+CSV の中身が変わればハッシュが変わるため、自動的に再ビルドされる。
+
+速くなるのは CSV の解析部分だけで、メモリはワーカー間で共有しない。.npy は mmap で開くが、
+テキスト列は読み込み時にプロセスごとに str へ復号し、DataFrame もプロセスごとに作る。
+
+意味検索用のベクトルインデックス（vectors/）は、最初に retrieval="semantic" で検索したときに
+vector_index が作って保存する。コーパスと合わせて先にビルドしておく場合（コンテナのビルド工程など）:
+    python corpus_store.py haiku_with_repetition.csv
+"""
+from __future__ import annotations
+import os, sys, json, shutil, hashlib
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+
+CORPUS_VERSION = 1
+CATEGORICAL_COLUMNS = ["季節", "plutchik_main", "nihon_main", "nihon_sub", "ジャンル"]
+_TEXT_SEP = "\x1f"   # 俳句本文に現れない区切り文字（Unit Separator）
+
+
+def csv_sha256(path: str | Path) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _default_cache_root(csv_path: Path) -> Path:
+    return Path(os.getenv("HAIKU_CORPUS_CACHE", csv_path.parent / ".corpus_cache"))
+
+
+def corpus_dir_for(csv_path: str | Path, cache_root: str | Path | None = None,
+                   sha: Optional[str] = None) -> Path:
+    """CSV のハッシュから、対応するコンパイル済みコーパスのディレクトリを返す。"""
+    csv_path = Path(csv_path)
+    root = Path(cache_root) if cache_root else _default_cache_root(csv_path)
+    sha = sha or csv_sha256(csv_path)
+    return root / f"{csv_path.stem}-v{CORPUS_VERSION}-{sha[:16]}"
+
+
+def build_corpus(csv_path: str | Path, cache_root: str | Path | None = None) -> Path:
+    """CSV を読み込み、列指向バイナリ形式に書き出してディレクトリを返す。"""
+    csv_path = Path(csv_path)
+    sha = csv_sha256(csv_path)
+    out_dir = corpus_dir_for(csv_path, cache_root, sha=sha)
+    if (out_dir / "meta.json").exists():
+        return out_dir
+
+    df = pd.read_csv(csv_path, encoding="utf-8-sig")
+    tmp_dir = out_dir.with_name(f"{out_dir.name}.tmp{os.getpid()}")
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    tmp_dir.mkdir(parents=True)
+
+    columns = []
+    for i, col in enumerate(df.columns):
+        s = df[col]
+        entry = {"name": col, "file": f"c{i:02d}.npy"}
+        if col in CATEGORICAL_COLUMNS:
+            cat = pd.Categorical(s)
+            np.save(tmp_dir / entry["file"], np.asarray(cat.codes, dtype=np.int16))
+            entry.update(kind="category", categories=[str(c) for c in cat.categories])
+        elif pd.api.types.is_bool_dtype(s) or pd.api.types.is_numeric_dtype(s):
+            np.save(tmp_dir / entry["file"], s.to_numpy())
+            entry.update(kind="numeric")
+        else:
+            isna = s.isna().to_numpy()
+            blob = _TEXT_SEP.join(s.fillna("").astype(str)).encode("utf-8")
+            np.save(tmp_dir / entry["file"], np.frombuffer(blob, dtype=np.uint8))
+            entry.update(kind="text")
+            if isna.any():
+                entry["null_file"] = f"c{i:02d}_null.npy"
+                np.save(tmp_dir / entry["null_file"], isna)
+        columns.append(entry)
+
+    meta = {"version": CORPUS_VERSION, "sha256": sha, "source": csv_path.name,
+            "n_rows": int(len(df)), "columns": columns}
+    (tmp_dir / "meta.json").write_text(json.dumps(meta, ensure_ascii=False, indent=2), encoding="utf-8")
+
+    try:
+        os.replace(tmp_dir, out_dir)   # 原子的に公開（同時ビルドは先勝ち）
+    except OSError:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    # 古いハッシュのキャッシュを掃除
+    for old in out_dir.parent.glob(f"{csv_path.stem}-v*"):
+        if old != out_dir and ".tmp" not in old.name:
+            shutil.rmtree(old, ignore_errors=True)
+    return out_dir
+
+
+def load_corpus(csv_path: str | Path, cache_root: str | Path | None = None,
+                build: bool = True) -> Optional[pd.DataFrame]:
+    """
+    コンパイル済みコーパスを DataFrame として読み込む。
+    キャッシュが無い／古い場合は build=True ならビルドし、False なら None を返す。
+    """
+    csv_path = Path(csv_path)
+    out_dir = corpus_dir_for(csv_path, cache_root)
+    if not (out_dir / "meta.json").exists():
+        if not build:
+            return None
+        out_dir = build_corpus(csv_path, cache_root)
+
+    meta = json.loads((out_dir / "meta.json").read_text(encoding="utf-8"))
+    if meta.get("version") != CORPUS_VERSION:
+        return None
+
+    data = {}
+    for entry in meta["columns"]:
+        arr = np.load(out_dir / entry["file"], mmap_mode="r")
+        if entry["kind"] == "category":
+            data[entry["name"]] = pd.Categorical.from_codes(np.asarray(arr), categories=entry["categories"])
+        elif entry["kind"] == "numeric":
+            data[entry["name"]] = arr
+        else:
+            values = arr.tobytes().decode("utf-8").split(_TEXT_SEP) if len(arr) else [""] * meta["n_rows"]
+            s = pd.Series(values)
+            if "null_file" in entry:
+                s[np.load(out_dir / entry["null_file"])] = np.nan
+            data[entry["name"]] = s
+    df = pd.DataFrame(data)
+    df.attrs["corpus_sha256"] = meta["sha256"]   # haiku_index のキャッシュキー
+    df.attrs["corpus_dir"] = str(out_dir)         # 派生インデックス（vector_index）の保存先
+    return df
+
+
+def build_vectors(df: pd.DataFrame) -> None:
+    """
+    意味検索用のベクトルインデックスをビルド工程で作っておく（最初の意味検索で数秒待たせない）。
+    scikit-learn が無い・書込不可の環境では何もしない（その場合は初回検索時に作る）。
+    """
+    try:
+        from vector_index import ensure_saved
+        ensure_saved(df, Path(df.attrs["corpus_dir"]) / "vectors")
+    except (ImportError, OSError):
+        pass
+
+
+if __name__ == "__main__":
+    for p in sys.argv[1:] or ["haiku_with_repetition.csv"]:
+        print(build_corpus(p))
+        build_vectors(load_corpus(p))
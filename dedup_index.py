@@ -0,0 +1,214 @@
+"""
+生成句と一茶コーパスの近似重複検出（MinHash + LSH）。
+
+- 俳句・読みの2列を、それぞれ文字 2-gram のシングル集合にする（読みはひらがな・空白なし）
+- 集合ごとに NUM_PERM 個のハッシュの最小値（MinHash 署名）を numpy でまとめて計算する
+- 署名を BANDS 個の帯に分け、帯ごとのバケット表で候補を引く（Jaccard 0.5 前後から拾える）
+- 候補だけ実際のシングル集合で Jaccard を計算し直し、俳句・読みの高い方を類似度とする
+
+1回の照会は 1 ms 未満。DataFrame ごとに一度だけ構築してプロセス内で使い回す。
+バッチ出力の監査:
+    python dedup_index.py outputs/batch [--csv haiku_with_repetition.csv] [--threshold 0.6]
+"""
+from __future__ import annotations
+import re, sys, json, argparse
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional
+
+import numpy as np
+import pandas as pd
+
+from haiku_index import cached_index
+from mora import to_hiragana
+
+NUM_PERM = 64
+BANDS = 16                  # 1帯 4 行。候補に挙がる Jaccard の目安 (1/16)^(1/4) ≈ 0.5
+DUP_THRESHOLD = 0.6         # これ以上を「既存句とほぼ同じ」とみなす
+FIELDS = {"haiku": "俳句", "reading": "読み"}
+
+_SHIFT = np.uint64(32)     # multiply-shift ハッシュ: ((a·x + b) mod 2^64) の上位 32bit
+_STRIP = re.compile(r"[\s　、。・「」『』！？!?\-～〜〱〲/／]")
+
+
+def _norm(text: str, field: str) -> str:
+    text = _STRIP.sub("", str(text or ""))
+    return to_hiragana(text) if field == "reading" else text
+
+
+def _shingle_ids(text: str) -> List[int]:
+    """
+    文字 2-gram（1文字なら1-gram）を 32bit 整数にしたもの（重複なし・昇順）。
+    インデックスは保存せずプロセス内だけで使うので、組込みの hash() で足りる。
+    """
+    if len(text) < 2:
+        return [hash(text) & 0xFFFFFFFF] if text else []
+    return sorted({hash(text[i:i + 2]) & 0xFFFFFFFF for i in range(len(text) - 1)})
+
+
+def _shingles(text: str) -> np.ndarray:
+    return np.asarray(_shingle_ids(text), dtype=np.uint64)
+
+
+class _FieldIndex:
+    """
+    1列分のシングル集合（CSR）・MinHash 署名・LSH バケット。
+    バケットは帯ごとに「キー昇順に並べた (キー, 行番号)」の配列で持ち、searchsorted で引く。
+    """
+
+    def __init__(self, texts: List[str], a: np.ndarray, b: np.ndarray, band_mult: np.ndarray):
+        sets = [_shingle_ids(t) for t in texts]
+        self.indptr = np.zeros(len(sets) + 1, dtype=np.int64)
+        np.cumsum([len(s) for s in sets], out=self.indptr[1:])
+        self.data = np.fromiter((x for s in sets for x in s), dtype=np.uint64, count=int(self.indptr[-1]))
+        self._a, self._b, self._band_mult = a, b, band_mult
+        self.signatures = self._signatures()
+        self._bucket_keys, self._bucket_ids = self._buckets()
+
+    def _signatures(self) -> np.ndarray:
+        n = len(self.indptr) - 1
+        sig = np.full((n, NUM_PERM), np.iinfo(np.uint32).max, dtype=np.uint32)
+        nonempty = np.flatnonzero(np.diff(self.indptr) > 0)
+        starts = self.indptr[nonempty]
+        for j in range(0, NUM_PERM, 8):   # 置換を 8 個ずつ（一時配列を小さく保つ）
+            h = (self._a[j:j + 8, None] * self.data + self._b[j:j + 8, None]) >> _SHIFT
+            sig[nonempty, j:j + 8] = np.minimum.reduceat(h, starts, axis=1).T.astype(np.uint32)
+        return sig
+
+    def _band_keys(self, sig: np.ndarray) -> np.ndarray:
+        """(n, BANDS) の帯キー。帯内の行を乱数係数で混ぜて 64bit にする（オーバーフローは意図どおり）。"""
+        rows = NUM_PERM // BANDS
+        with np.errstate(over="ignore"):
+            return (sig.reshape(len(sig), BANDS, rows).astype(np.uint64) * self._band_mult).sum(axis=2)
+
+    def _buckets(self) -> tuple:
+        ids = np.flatnonzero(np.diff(self.indptr) > 0).astype(np.int32)
+        keys = self._band_keys(self.signatures[ids])            # (行, 帯)
+        order = np.argsort(keys, axis=0, kind="stable")         # 帯ごとにキー順
+        return (np.take_along_axis(keys, order, axis=0).T.copy(),   # (帯, 行)
+                ids[order].T.copy())
+
+    def signature(self, sh: np.ndarray) -> np.ndarray:
+        return ((sh[:, None] * self._a + self._b) >> _SHIFT).min(axis=0).astype(np.uint32)
+
+    def query(self, sh: np.ndarray) -> Dict[int, float]:
+        """{行番号: Jaccard}（LSH で候補に挙がった行のみ）。"""
+        if sh.size == 0:
+            return {}
+        keys = self._band_keys(self.signature(sh)[None, :])[0]
+        cand = []
+        for band in range(BANDS):
+            bk = self._bucket_keys[band]
+            lo, hi = np.searchsorted(bk, keys[band], "left"), np.searchsorted(bk, keys[band], "right")
+            if hi > lo:
+                cand.append(self._bucket_ids[band, lo:hi])
+        if not cand:
+            return {}
+        out = {}
+        for i in np.unique(np.concatenate(cand)).tolist():
+            other = self.data[self.indptr[i]:self.indptr[i + 1]]
+            inter = np.intersect1d(sh, other, assume_unique=True).size
+            out[i] = inter / (sh.size + other.size - inter)
+        return out
+
+
+class DedupIndex:
+    """俳句・読みの2列の MinHash/LSH インデックス。nearest() で最も近い既存句と類似度を返す。"""
+
+    def __init__(self, haiku: List[str], reading: List[str], seed: int = 0):
+        rng = np.random.default_rng(seed)
+        a = rng.integers(1, 1 << 63, NUM_PERM, dtype=np.uint64) * np.uint64(2) + np.uint64(1)   # 奇数
+        b = rng.integers(0, 1 << 63, NUM_PERM, dtype=np.uint64)
+        band_mult = rng.integers(1, 1 << 63, NUM_PERM // BANDS, dtype=np.uint64) | np.uint64(1)
+        self.haiku, self.reading = haiku, reading
+        self._fields = {
+            "haiku": _FieldIndex([_norm(t, "haiku") for t in haiku], a, b, band_mult),
+            "reading": _FieldIndex([_norm(t, "reading") for t in reading], a, b, band_mult),
+        }
+
+    @classmethod
+    def from_df(cls, df: pd.DataFrame) -> "DedupIndex":
+        cols = [df[c].fillna("").astype(str).tolist() if c in df.columns else [""] * len(df)
+                for c in FIELDS.values()]
+        return cls(*cols)
+
+    def nearest(self, haiku_ja: str, reading: Optional[str] = None, k: int = 3) -> List[dict]:
+        """
+        類似度の高い順に最大 k 件: {"row", "text", "reading", "similarity", "field"}。
+        類似度は俳句・読みそれぞれの 2-gram Jaccard の高い方（field はどちらで一致したか）。
+        LSH の候補に挙がらない（おおむね 0.3 未満の）句は返らない。
+        """
+        best: Dict[int, tuple] = {}
+        for field, text in (("haiku", haiku_ja), ("reading", reading)):
+            if not text:
+                continue
+            for i, sim in self._fields[field].query(_shingles(_norm(text, field))).items():
+                if sim > best.get(i, (0.0, ""))[0]:
+                    best[i] = (sim, field)
+        top = sorted(best.items(), key=lambda kv: kv[1][0], reverse=True)[:k]
+        return [{"row": i, "text": self.haiku[i], "reading": self.reading[i],
+                 "similarity": round(sim, 3), "field": field} for i, (sim, field) in top]
+
+    def check(self, haiku_ja: str, reading: Optional[str] = None,
+              threshold: float = DUP_THRESHOLD, k: int = 3) -> dict:
+        """生成直後の検査用: {"duplicate", "similarity", "nearest"}。"""
+        near = self.nearest(haiku_ja, reading, k=k)
+        sim = near[0]["similarity"] if near else 0.0
+        return {"duplicate": sim >= threshold, "similarity": sim, "nearest": near}
+
+
+def get_dedup_index(df: pd.DataFrame) -> DedupIndex:
+    return cached_index(df, "dedup", DedupIndex.from_df)
+
+
+# =============================
+# バッチ監査
+# =============================
+def audit(items: Iterable[dict], df: pd.DataFrame, threshold: float = DUP_THRESHOLD) -> List[dict]:
+    """
+    items（{"id", "haiku_ja", "reading_ja"} の dict 群）のうち、既存句との類似度が
+    threshold 以上のものを類似度の高い順に返す。
+    """
+    index = get_dedup_index(df)
+    flagged = []
+    for it in items:
+        res = index.check(it.get("haiku_ja", ""), it.get("reading_ja"), threshold=threshold, k=1)
+        if res["duplicate"]:
+            flagged.append({**it, "similarity": res["similarity"], "nearest": res["nearest"][0]})
+    flagged.sort(key=lambda r: r["similarity"], reverse=True)
+    return flagged
+
+
+def _iter_batch_meta(root: Path) -> Iterable[dict]:
+    """batch.py の出力（メタ JSON）から生成句を読み出す。"""
+    for p in sorted(root.rglob("*.json")):
+        try:
+            meta = json.loads(p.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            continue
+        haiku = (meta.get("haiku") or {}).get("ja") if isinstance(meta, dict) else None
+        if haiku:
+            yield {"id": meta.get("job_id") or meta.get("artifact_id") or p.stem, "haiku_ja": haiku,
+                   "reading_ja": (meta.get("haiku") or {}).get("reading"), "path": str(p)}
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    ap = argparse.ArgumentParser(description="生成句と一茶コーパスの近似重複を監査する")
+    ap.add_argument("root", help="batch.py の出力ディレクトリ")
+    ap.add_argument("--csv", default="haiku_with_repetition.csv", help="一茶コーパスの CSV")
+    ap.add_argument("--threshold", type=float, default=DUP_THRESHOLD)
+    args = ap.parse_args(argv)
+
+    from corpus_store import load_corpus
+    df = load_corpus(args.csv)
+    if df is None:
+        df = pd.read_csv(args.csv, encoding="utf-8-sig")
+    items = list(_iter_batch_meta(Path(args.root)))
+    flagged = audit(items, df, threshold=args.threshold)
+    for r in flagged:
+        print(json.dumps(r, ensure_ascii=False))
+    print(json.dumps({"checked": len(items), "flagged": len(flagged)}, ensure_ascii=False), file=sys.stderr)
+    return 0 if not flagged else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,9 +1,14 @@
 
 from __future__ import annotations
-import re
+import numpy as np
 import pandas as pd
 import streamlit as st
 
+from corpus_store import load_corpus
+from haiku_index import get_ngram_index, get_facet_index, get_haiku_texts
+from vector_index import get_vector_index
+import metrics
+
 # =============================
 # 日本的情緒 定義（13種）
 # =============================
@@ -72,67 +77,82 @@ SYNONYMS = {
 
 @st.cache_data(show_spinner=False)
 def load_haiku_df(path: str) -> pd.DataFrame:
-    """CSV を読み込んで必要な列を補完."""
+    """CSV を読み込んで必要な列を補完.（コンパイル済みコーパスがあればそちらを使う）"""
     try:
-        df = pd.read_csv(path, encoding="utf-8-sig")
-    except Exception as e:
-        st.error(f"CSV読込エラー: {e}")
-        df = pd.DataFrame()
+        df = load_corpus(path)
+    except Exception:
+        df = None   # キャッシュ破損・書込不可などは CSV 直読みにフォールバック
+
+    if df is None:
+        try:
+            df = pd.read_csv(path, encoding="utf-8-sig")
+        except Exception as e:
+            st.error(f"CSV読込エラー: {e}")
+            df = pd.DataFrame()
 
     for col in ["俳句","読み","季語候補","季節","plutchik_main","nihon_main","nihon_sub","出典","年"]:
         if col not in df.columns:
             df[col] = ""
     return df
 
+RETRIEVAL_MODES = ["keyword", "semantic"]
+SEMANTIC_TOP_N = 20
+
+@metrics.instrument("retrieval.pick_references")
 def pick_references(df: pd.DataFrame, season: str, plutchik: str, aesthetic: str,
-                    keyword: str, k: int = 3, prioritize_giongo: bool = True):
+                    keyword: str, k: int = 3, prioritize_giongo: bool = True,
+                    retrieval: str = "keyword", experience: str = ""):
     """
     参照句を抽出。元アプリと同等のロジック。
+    retrieval="semantic" ではキーワード一致の代わりに、keyword＋experience に
+    意味的に近い句（vector_index の上位 SEMANTIC_TOP_N 件）を自由枠の候補にする。
     """
     search_terms = SYNONYMS.get(keyword, [keyword]) if keyword else []
-    pattern = "|".join(map(re.escape, search_terms)) if search_terms else None
-
-    df_base = df.copy()
-    if season:
-        df_base = df_base[df_base["季節"] == season]
-    if plutchik:
-        df_base = df_base[df_base["plutchik_main"] == plutchik]
-    if aesthetic and aesthetic != "スキップ":
-        df_base = df_base[df_base["nihon_main"] == aesthetic]
-
-    if pattern:
-        df_free = df[
-            df["俳句"].astype(str).str.contains(pattern, na=False) |
-            df["読み"].astype(str).str.contains(pattern, na=False) |
-            df["季語候補"].astype(str).str.contains(pattern, na=False)
-        ]
+
+    # 以降は行番号（iloc）だけで選定し、最後に k 件だけ dict 化する
+    # 事前計算したファセット・ビットマップの AND で絞り込み（フレーム全体のコピーはしない）
+    facets = get_facet_index(df)
+    base_ids = np.flatnonzero(facets.mask({
+        "季節": season,
+        "plutchik_main": plutchik,
+        "nihon_main": aesthetic if aesthetic != "スキップ" else None,
+    }))
+
+    if retrieval == "semantic":
+        query = " ".join(t for t in [keyword, experience] if t)
+        free_ids, _ = get_vector_index(df).search(query, k=SEMANTIC_TOP_N)
+    elif search_terms:
+        # 俳句・読み・季語候補の n-gram 転置インデックスで検索（全件の正規表現走査を避ける）
+        free_ids = get_ngram_index(df).search(search_terms)
     else:
-        df_free = df.iloc[0:0]
+        free_ids = base_ids[:0]
+
+    texts = get_haiku_texts(df)
+    chosen: list[int] = []
+    seen: set[str] = set()
+
+    def _add(i: int, dedup: bool = True) -> None:
+        if dedup and texts[i] in seen:
+            return
+        chosen.append(int(i))
+        seen.add(texts[i])
 
-    results = []
     if prioritize_giongo:
-        df_giongo = df[df.get("has_repetition") == True]
-        if not df_giongo.empty:
-            results.append(df_giongo.sample(1).iloc[0])
-
-    if not df_free.empty:
-        results.append(df_free.sample(1).iloc[0])
-
-    for _, r in df_base.head(10).iterrows():
-        if len(results) >= k:
-            break
-        if not any(str(res["俳句"]) == str(r["俳句"]) for res in results):
-            results.append(r)
-
-    if len(results) < k and not df_free.empty:
-        for _, r in df_free.iterrows():
-            if len(results) >= k:
+        giongo_ids = np.flatnonzero(facets.bitmap("has_repetition", True))
+        if giongo_ids.size:
+            _add(giongo_ids[np.random.randint(giongo_ids.size)], dedup=False)
+
+    if free_ids.size:
+        _add(free_ids[np.random.randint(free_ids.size)], dedup=False)
+
+    for pool in (base_ids[:10], free_ids):
+        for i in pool:
+            if len(chosen) >= k:
                 break
-            if not any(str(res["俳句"]) == str(r["俳句"]) for res in results):
-                results.append(r)
+            _add(i)
 
     refs = []
-    for r in results[:k]:
+    for r in df.iloc[chosen[:k]].to_dict("records"):
         src = f"{str(r.get('出典','')).strip()} ({str(r.get('年','')).strip()})"
         refs.append({
             "text":       str(r["俳句"]),
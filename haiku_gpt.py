@@ -1,18 +1,25 @@
 # --- haiku_gpt.py (先頭付近) ---
 from __future__ import annotations
-import os, re, json, time, random, logging
-from openai import OpenAI, RateLimitError, APIStatusError
-from typing import Optional, Dict, Any, Callable
+import os, re, json, time, random, asyncio, weakref, contextlib
+from openai import OpenAI, AsyncOpenAI, RateLimitError, APIStatusError
+from typing import Optional, Dict, Any, Callable, Awaitable
 
-# ===== ロギング設定 =====
-_logger = logging.getLogger("haiku_gpt")
-if not _logger.handlers:
-    _handler = logging.StreamHandler()
-    _handler.setFormatter(logging.Formatter("%(asctime)s [%(levelname)s] %(name)s: %(message)s"))
-    _logger.addHandler(_handler)
-    _logger.setLevel(logging.INFO)
+from response_cache import get_cache, make_key
+from rate_limit import limited, alimited, AsyncLimited, estimate_chat_tokens
+from prompts import HAIKU_PROMPT, ENGLISH_PROMPT, REPAIR_PROMPT
+from mora import check_575, PATTERN
+from haiku_rank import rank_candidates
+import metrics
+import haiku_log
 
-last_call_meta: Optional[Dict[str, Any]] = None
+_logger = haiku_log.get_logger("haiku_gpt")
+
+CHAT_MODEL = "gpt-4o-mini"
+HAIKU_TEMPERATURE = 0.7
+ENGLISH_TEMPERATURE = 0.5
+REPAIR_TEMPERATURE = 0.3
+MORA_MAX_REPAIRS = int(os.getenv("HAIKU_MORA_REPAIRS", 2))   # 5-7-5 修正依頼の上限回数
+HAIKU_CANDIDATES = int(os.getenv("HAIKU_CANDIDATES", 4))     # 候補まとめて生成の既定数
 
 
 def _extract_request_id(err: Exception) -> Optional[str]:
@@ -29,133 +36,148 @@ def _extract_request_id(err: Exception) -> Optional[str]:
         return None
 
 
+def _error_info(e: BaseException, with_request_id: bool = True) -> Dict[str, Any]:
+    return {
+        "type": e.__class__.__name__,
+        "msg": str(e),
+        "request_id": _extract_request_id(e) if with_request_id else None,
+    }
+
+
+def _log_fields(endpoint: str, model: Optional[str], tries: int, start: float, result: Any = None) -> dict:
+    """構造化ログの共通項目。request_id は応答に OpenAI の x-request-id があればそれを使う。"""
+    fields = {"endpoint": endpoint, "model": model, "tries": tries,
+              "latency_sec": round(time.time() - start, 4)}
+    req_id = getattr(result, "_request_id", None)
+    if req_id:
+        fields["request_id"] = req_id
+    return fields
+
+
+def _record(endpoint: str, model: Optional[str], record: bool, fields: Optional[dict] = None):
+    """record=False のときは呼び出し元が開いた計測レコードにそのまま書き込む。"""
+    if record:
+        return metrics.timed(endpoint, model=model, **(fields or {}))
+    metrics.note(**(fields or {}))
+    return contextlib.nullcontext(metrics.current() or {})
+
+
+def get_last_call_meta() -> Optional[Dict[str, Any]]:
+    """現在のスレッド（Streamlit セッション）で直近に完了した呼び出しの計測レコード。"""
+    return metrics.last_record()
+
+
 def _retry_call(
     fn: Callable[[], Any],
     *,
+    endpoint: str = "chat.completions",
+    model: Optional[str] = None,
+    record: bool = True,
     max_tries: int = 5,
     base: float = 0.8,
-    cap: float = 8.0
+    cap: float = 8.0,
+    retry_on: tuple = (RateLimitError, APIStatusError),
+    fields: Optional[dict] = None,
 ):
     """
     OpenAI呼び出しを指数バックオフ＋ジッターで再試行。
-    呼び出し側の挙動を壊さないため、成功時はそのまま結果を返し、
-    失敗時は例外を再送出。メタ情報は last_call_meta に保存。
+    呼び出し側の挙動を壊さないため、（成功時）元の返り値、（失敗時）例外を再送出。
+    全試行をまとめて1件の計測レコード（metrics）として記録する。
+    retry_on で再試行対象の例外を差し替えられる（SDK を通さない HTTP 呼び出し用）。
+    fields は計測レコードに足す項目（プロンプトのトークン内訳など）。
     """
-    global last_call_meta
-    tries, start = 0, time.time()
-    while True:
-        try:
-            result = fn()
-            last_call_meta = {
-                "ok": True,
-                "tries": tries + 1,
-                "elapsed_sec": round(time.time() - start, 3),
-                "error": None,
-                "ts": time.strftime("%Y-%m-%d %H:%M:%S"),
-            }
-            _logger.info(f"OpenAI call OK (tries={tries+1}, {last_call_meta['elapsed_sec']}s)")
-            return result
-        except (RateLimitError, APIStatusError) as e:
-            tries += 1
-            if tries < max_tries:
-                sleep = min(cap, base * (2 ** (tries - 1))) + random.uniform(0, 0.4)
-                _logger.warning(
-                    f"{e.__class__.__name__} (req_id={_extract_request_id(e)}) → retry {tries}/{max_tries} in {sleep:.1f}s"
-                )
-                time.sleep(sleep)
-                continue
-            last_call_meta = {
-                "ok": False,
-                "tries": tries,
-                "elapsed_sec": round(time.time() - start, 3),
-                "error": {
-                    "type": e.__class__.__name__,
-                    "msg": str(e),
-                    "request_id": _extract_request_id(e),
-                },
-                "ts": time.strftime("%Y-%m-%d %H:%M:%S"),
-            }
-            _logger.error(f"OpenAI call failed after {tries} tries (req_id={_extract_request_id(e)}): {e}")
-            raise
-        except Exception as e:
-            last_call_meta = {
-                "ok": False,
-                "tries": tries + 1,
-                "elapsed_sec": round(time.time() - start, 3),
-                "error": {
-                    "type": e.__class__.__name__,
-                    "msg": str(e),
-                    "request_id": None,
-                },
-                "ts": time.strftime("%Y-%m-%d %H:%M:%S"),
-            }
-            _logger.exception(f"Unexpected error during OpenAI call: {e}")
-            raise
+    with _record(endpoint, model, record, fields) as rec:
+        tries, start = 0, time.time()
+        while True:
+            try:
+                result = fn()
+                rec["tries"] = tries + 1
+                metrics.note_usage(result)
+                _logger.info(f"OpenAI call OK ({endpoint}, tries={tries+1}, {time.time() - start:.3f}s)",
+                             extra=_log_fields(endpoint, model, tries + 1, start, result))
+                return result
+            except retry_on as e:
+                tries += 1
+                req_id = _extract_request_id(e)
+                # 警告ログ：リトライ予定
+                if tries < max_tries:
+                    sleep = min(cap, base * (2 ** (tries - 1))) + random.uniform(0, 0.4)
+                    _logger.warning(
+                        f"{e.__class__.__name__} (req_id={req_id}) → retry {tries}/{max_tries} in {sleep:.1f}s",
+                        extra={**_log_fields(endpoint, model, tries, start), "request_id": req_id,
+                               "error": e.__class__.__name__, "retry_in_sec": round(sleep, 2)})
+                    time.sleep(sleep)
+                    continue
+                # エラーログ：打ち切り
+                rec["tries"] = tries
+                rec["error"] = _error_info(e)
+                _logger.error(f"OpenAI call failed after {tries} tries (req_id={req_id}): {e}",
+                              extra={**_log_fields(endpoint, model, tries, start), "request_id": req_id,
+                                     "error": e.__class__.__name__})
+                raise  # ← 失敗時は従来どおり例外を投げる（既存の挙動を維持）
+            except Exception as e:
+                # 想定外例外：即終了（挙動維持のため再送出）
+                rec["tries"] = tries + 1
+                rec["error"] = _error_info(e, with_request_id=False)
+                _logger.exception(f"Unexpected error during OpenAI call: {e}",
+                                  extra=_log_fields(endpoint, model, tries + 1, start))
+                raise
 
-def _retry_call(fn, *, max_tries: int = 5, base: float = 0.8, cap: float = 8.0):
+
+async def _retry_call_async(
+    fn: Callable[[], Awaitable[Any]],
+    *,
+    endpoint: str = "chat.completions",
+    model: Optional[str] = None,
+    record: bool = True,
+    max_tries: int = 5,
+    base: float = 0.8,
+    cap: float = 8.0,
+    timeout: Optional[float] = 60.0,
+    fields: Optional[dict] = None,
+):
     """
-    OpenAI呼び出しを指数バックオフ＋ジッターで再試行。
-    呼び出し側の挙動を壊さないため、（成功時）元の返り値、（失敗時）例外を再送出。
-    ただし副作用として、直近呼び出しのメタ情報を `last_call_meta` に保存する。
+    _retry_call の asyncio 版。待機は asyncio.sleep なのでイベントループを塞がない。
+    timeout（秒）を超えた試行はキャンセルして再試行対象にする。fn が alimited のときは
+    リミッタの枠待ちを除いた API 呼び出しだけに timeout を掛ける。
+    外側からキャンセルされた場合はそのまま CancelledError を伝播する。
     """
-    global last_call_meta
-    tries, start = 0, time.time()
-    while True:
-        try:
-            result = fn()
-            last_call_meta = {
-                "ok": True,
-                "tries": tries + 1,
-                "elapsed_sec": round(time.time() - start, 3),
-                "error": None,
-                "ts": time.strftime("%Y-%m-%d %H:%M:%S"),
-            }
-            # 情報ログ：成功
-            _logger.info(f"OpenAI call OK (tries={last_call_meta['tries']}, {last_call_meta['elapsed_sec']}s)")
-            return result
-        except (RateLimitError, APIStatusError) as e:
-            tries += 1
-            req_id = _extract_request_id(e)
-            # 警告ログ：リトライ予定
-            if tries < max_tries:
-                sleep = min(cap, base * (2 ** (tries - 1))) + random.uniform(0, 0.4)
-                _logger.warning(
-                    f"{e.__class__.__name__} (req_id={req_id}) → retry {tries}/{max_tries} in {sleep:.1f}s"
-                )
-                time.sleep(sleep)
-                continue
-            # エラーログ：打ち切り
-            last_call_meta = {
-                "ok": False,
-                "tries": tries,
-                "elapsed_sec": round(time.time() - start, 3),
-                "error": {
-                    "type": e.__class__.__name__,
-                    "msg": str(e),
-                    "request_id": req_id,
-                },
-                "ts": time.strftime("%Y-%m-%d %H:%M:%S"),
-            }
-            _logger.error(
-                f"OpenAI call failed after {tries} tries (req_id={req_id}): {e}"
-            )
-            raise  # ← 失敗時は従来どおり例外を投げる（既存の挙動を維持）
-
-        except Exception as e:
-            # 想定外例外：即終了（挙動維持のため再送出）
-            last_call_meta = {
-                "ok": False,
-                "tries": tries + 1,
-                "elapsed_sec": round(time.time() - start, 3),
-                "error": {
-                    "type": e.__class__.__name__,
-                    "msg": str(e),
-                    "request_id": None,
-                },
-                "ts": time.strftime("%Y-%m-%d %H:%M:%S"),
-            }
-            _logger.exception(f"Unexpected error during OpenAI call: {e}")
-            raise
+    with _record(endpoint, model, record, fields) as rec:
+        tries, start = 0, time.time()
+        while True:
+            try:
+                if isinstance(fn, AsyncLimited):
+                    result = await fn(timeout)
+                else:
+                    result = await asyncio.wait_for(fn(), timeout) if timeout else await fn()
+                rec["tries"] = tries + 1
+                metrics.note_usage(result)
+                _logger.info(f"OpenAI async call OK ({endpoint}, tries={tries+1}, {time.time() - start:.3f}s)",
+                             extra=_log_fields(endpoint, model, tries + 1, start, result))
+                return result
+            except (RateLimitError, APIStatusError, asyncio.TimeoutError) as e:
+                tries += 1
+                req_id = _extract_request_id(e)
+                if tries < max_tries:
+                    sleep = min(cap, base * (2 ** (tries - 1))) + random.uniform(0, 0.4)
+                    _logger.warning(
+                        f"{e.__class__.__name__} (req_id={req_id}) → retry {tries}/{max_tries} in {sleep:.1f}s",
+                        extra={**_log_fields(endpoint, model, tries, start), "request_id": req_id,
+                               "error": e.__class__.__name__, "retry_in_sec": round(sleep, 2)})
+                    await asyncio.sleep(sleep)
+                    continue
+                rec["tries"] = tries
+                rec["error"] = _error_info(e)
+                _logger.error(f"OpenAI async call failed after {tries} tries (req_id={req_id}): {e}",
+                              extra={**_log_fields(endpoint, model, tries, start), "request_id": req_id,
+                                     "error": e.__class__.__name__})
+                raise
+            except Exception as e:
+                rec["tries"] = tries + 1
+                rec["error"] = _error_info(e, with_request_id=False)
+                _logger.exception(f"Unexpected error during OpenAI async call: {e}",
+                                  extra=_log_fields(endpoint, model, tries + 1, start))
+                raise
 
 _client = None
 def _get_client() -> OpenAI:
@@ -164,73 +186,45 @@ def _get_client() -> OpenAI:
         _client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
     return _client
 
+# AsyncOpenAI はイベントループに紐づくため、ループごとに1つ保持する。
+# キーはループそのもの（id() だと、破棄されたループの id を再利用した新しいループに
+# 閉じたループのクライアントを渡してしまう）。クライアントの接続がループを参照し続けるので
+# 弱参照だけでは消えず、閉じたループの分は次の呼び出し時に捨てる。
+_async_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, AsyncOpenAI]" = weakref.WeakKeyDictionary()
+def _get_async_client() -> AsyncOpenAI:
+    loop = asyncio.get_running_loop()
+    for stale in [l for l in list(_async_clients.keys()) if l.is_closed()]:
+        _async_clients.pop(stale, None)
+    client = _async_clients.get(loop)
+    if client is None:
+        client = _async_clients[loop] = AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+    return client
 
-def call_gpt_haiku(payload: dict) -> dict:
-    """新作俳句＋意訳＋参照理由をJSONで返す。"""
-    client = _get_client()
+
+def _haiku_messages(payload: dict) -> tuple[list, str]:
+    """call_gpt_haiku 用の messages と、参照句の番号付き一覧を組み立てる。"""
     refs = payload.get('references', [])
     refs_numbered = "\n".join([f"{i+1}. {r.get('text','')} | 出典: {r.get('source','')}" for i, r in enumerate(refs)])
 
-    system_prompt = """あなたは「小林一茶 × 新作俳句 × 参照句運用」の専門家です。
-以下のJSONだけを出力してください（余文・解説・前置き禁止）：
-{
-  "haiku_ja": "五七五の新作（日本語）",
-  "explanation_ja": "日本語の意訳・背景（100-200字）",
-  "reasons_refs_ja": "結論ファースト1文＋改行＋(1)(2)(3)をMarkdown箇条書き形式（- (1) ... の形）で出力する。形式例:『【結論】...\\n- (1) ...\\n- (2) ...\\n- (3) ...』"
-  "references_numbered": "1. 〇〇 | 出典: △△ (年)\\n2. 〇〇 | 出典: △△ (年)\\n3. 〇〇 | 出典: △△ (年)"
-}
-厳守事項：
-- 必ず命を懸けて5音・7音・5音の構成にする（合計17モーラ）
-- 5音 7音 5音とスペースで5音 7音 5音を区切って表示する
-- モーラ数は、ゃゅょ→1モーラ、っ→1モーラ、ん→1モーラ、長音（ー）→1モーラとして数える
-- 記号・英語・ルビ・句読点・解説は出力しない（俳句のみ）
-- 文末は名詞・体言止め可、助詞で終わっても良い
--自己チェックを以下3点実行してください
-1) ひらがなに内部変換してモーラを数える（出力には見せない）
-2) 5-7-5になっていなければ即座に言い換えて再生成
-3) 最終出力は俳句3行のみ
-- 自然と感情をテーマにする
-- 選択された感情（plutchik）と日本的情緒（aesthetic）を句の内容または語感に必ず反映すること。   
-- 必ず参照句を活用して新作俳句を作成してください
-- 小林一茶らしさである、擬音語活用については参照句をして生かしてください。
-- 小動物への愛についても参照句を生かしてください。
-- 参照句の文末を似せてください。
-- 参照句(1)(2)(3)の具体要素（語／音象徴／構図）を最低1つずつ反映すること
-- JSON以外は出力しない。
-- 「理由」は“参照俳句の選定理由”。文頭を『この句は』で始めない。
-- 「reasons_refs_ja」は必ず『【結論】』で始め、次行以降に(1)(2)(3)を改行で並べる。
-- 各(1)(2)(3)では、参照句の具体要素（構造/リズム/テーマ/語感 等）と、新作への変奏を簡潔に述べる。
-- **参照句に擬音語（繰り返し表現 🎵）が含まれる場合、そのリズムや響きを新作でどう活かしたかを必ず書く。**
-- 「意訳」は俳句の情景と感情のみ（参照句の話は書かない）。日本的情緒を1つ以上含める。
-- 固有名詞や現代語過多を避け、一茶らしい素朴さと生命へのまなざしを重視。
-
-"""
-
-    user_prompt = f"""入力条件：
-season = {payload.get('season')}
-plutchik = {payload.get('plutchik')}
-aesthetic = {payload.get('aesthetic')}
-keyword = {payload.get('keyword')}
-experience = {payload.get('experience')}
-
-参照俳句（必ず(1)(2)(3)で言及）:
-{refs_numbered}
-"""
-
-# 例）call_gpt_haiku 内の呼び出し部（問題行まわりを置き換え）
-    resp = _retry_call(
-        lambda: client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_prompt},
-            ],
-            temperature=0.7,
-            response_format={"type": "json_object"},
-        )
+    # system は固定プレフィックス（毎回バイト単位で同一）、可変部分は user に寄せる
+    messages = HAIKU_PROMPT.messages(
+        season=payload.get('season'),
+        plutchik=payload.get('plutchik'),
+        aesthetic=payload.get('aesthetic'),
+        keyword=payload.get('keyword'),
+        experience=payload.get('experience'),
+        refs_numbered=refs_numbered,
     )
+    return messages, refs_numbered
 
-    content = resp.choices[0].message.content
+
+def _prompt_report(template, messages: list) -> dict:
+    """計測レコードに載せる prefix / suffix トークン数とキャッシュ見込み。"""
+    return template.report(messages[-1]["content"])
+
+
+def _parse_haiku_content(content: str, refs_numbered: str) -> dict:
+    """モデル出力の JSON を読み取る（崩れていれば修復を試みる）。"""
     try:
         data = json.loads(content)
     except json.JSONDecodeError:
@@ -265,35 +259,445 @@ experience = {payload.get('experience')}
 
     return data
 
-def generate_english_tweet_block(haiku_ja: str, explanation_ja: str) -> str:
-    """日本語俳句＋説明から X 向け英語ブロックを生成"""
+
+_KU_NAMES = ["上五", "中七", "下五"]
+
+def _mora_gap(check: dict) -> int:
+    """5-7-5 からのずれの大きさ（修正案の比較用）。"""
+    counts = check["counts"]
+    if len(counts) != len(PATTERN):
+        return abs(sum(counts) - sum(PATTERN)) + len(PATTERN)
+    return sum(abs(c - want) for c, want in zip(counts, PATTERN))
+
+
+def _repair_messages(data: dict, check: dict) -> list:
+    return REPAIR_PROMPT.messages(
+        haiku_ja=data.get("haiku_ja", ""),
+        reading=check["reading"],
+        counts=" / ".join(str(c) for c in check["counts"]),
+        lines="・".join(_KU_NAMES[i] for i in check["bad_lines"]) or "全体",
+    )
+
+
+def _repair_step(best: dict, best_check: dict, content: str) -> tuple:
+    """修正案を検査し、ずれが小さければ採用する。(best, best_check, 今回の検査結果) を返す。"""
+    fixed = _parse_haiku_content(content, "")
+    if not fixed.get("haiku_ja"):
+        return best, best_check, best_check
+    check = check_575(fixed["haiku_ja"], fixed.get("reading_ja"))
+    if check["ok"] is not None and _mora_gap(check) < _mora_gap(best_check):
+        return fixed, check, check
+    return best, best_check, check
+
+
+def _mora_result(data: dict, best: dict, best_check: dict, repairs: int) -> dict:
+    data = {**data, "haiku_ja": best["haiku_ja"], "reading_ja": best.get("reading_ja", "")}
+    data["mora"] = {"ok": best_check["ok"], "counts": best_check["counts"], "repairs": repairs}
+    return data
+
+
+def _ensure_575(data: dict, max_repairs: int = MORA_MAX_REPAIRS) -> dict:
+    """
+    haiku_ja を 5-7-5 で検査し、外れていれば該当句だけの修正依頼を max_repairs 回まで出す。
+    全体の再生成はしない。最もずれの小さい案を採用し、結果を data["mora"] に残す。
+    """
+    best = data
+    best_check = check = check_575(data.get("haiku_ja", ""), data.get("reading_ja"))
+    repairs = 0
+    while check["ok"] is False and repairs < max_repairs:
+        messages = _repair_messages(best, best_check)
+        client = _get_client()
+        resp = _retry_call(
+            limited("chat", lambda: client.chat.completions.create(
+                model=CHAT_MODEL,
+                messages=messages,
+                temperature=REPAIR_TEMPERATURE,
+                response_format={"type": "json_object"},
+            ), tokens=estimate_chat_tokens(messages, max_completion=100)),
+            endpoint="chat.completions.repair",
+            model=CHAT_MODEL,
+            fields=_prompt_report(REPAIR_PROMPT, messages),
+        )
+        repairs += 1
+        best, best_check, check = _repair_step(best, best_check, resp.choices[0].message.content)
+    return _mora_result(data, best, best_check, repairs)
+
+
+async def _aensure_575(data: dict, max_repairs: int = MORA_MAX_REPAIRS,
+                       timeout: Optional[float] = 60.0) -> dict:
+    """_ensure_575 の asyncio 版。"""
+    best = data
+    best_check = check = check_575(data.get("haiku_ja", ""), data.get("reading_ja"))
+    repairs = 0
+    while check["ok"] is False and repairs < max_repairs:
+        messages = _repair_messages(best, best_check)
+        client = _get_async_client()
+        resp = await _retry_call_async(
+            alimited("chat", lambda: client.chat.completions.create(
+                model=CHAT_MODEL,
+                messages=messages,
+                temperature=REPAIR_TEMPERATURE,
+                response_format={"type": "json_object"},
+            ), tokens=estimate_chat_tokens(messages, max_completion=100)),
+            endpoint="chat.completions.repair",
+            model=CHAT_MODEL,
+            timeout=timeout,
+            fields=_prompt_report(REPAIR_PROMPT, messages),
+        )
+        repairs += 1
+        best, best_check, check = _repair_step(best, best_check, resp.choices[0].message.content)
+    return _mora_result(data, best, best_check, repairs)
+
+
+def _cached(key: str, use_cache: bool):
+    """(キャッシュ, ヒットした値 or None) を返す。use_cache=False なら読まずに書くだけ。"""
+    cache = get_cache()
+    if cache is None or not use_cache:
+        return cache, None
+    return cache, cache.get(key)
+
+
+def _haiku_cache_key(payload: dict, messages: list) -> str:
+    # system プロンプトもキーに含め、プロンプト改訂時は自動的に別キーにする
+    return make_key("haiku", payload=payload, model=CHAT_MODEL,
+                    temperature=HAIKU_TEMPERATURE, system=messages[0]["content"])
+
+
+def call_gpt_haiku(payload: dict, *, use_cache: bool = True) -> dict:
+    """
+    新作俳句＋意訳＋参照理由をJSONで返す。5-7-5 を外れた句は該当句だけ修正を依頼する（_ensure_575）。
+    同一条件の結果はキャッシュから返す。use_cache=False で必ず新しく生成する（結果はキャッシュを更新）。
+    """
+    messages, refs_numbered = _haiku_messages(payload)
+    key = _haiku_cache_key(payload, messages)
+    cache, hit = _cached(key, use_cache)
+    if hit is not None:
+        return hit
+
     client = _get_client()
-    system_prompt = """あなたは「俳句英訳 × X（Twitter）投稿整形」の専門家です。
-次の4ブロックだけを出力：
-🌿 俳句（日本語）
+    resp = _retry_call(
+        limited("chat", lambda: client.chat.completions.create(
+            model=CHAT_MODEL,
+            messages=messages,
+            temperature=HAIKU_TEMPERATURE,
+            response_format={"type": "json_object"},
+        ), tokens=estimate_chat_tokens(messages)),
+        model=CHAT_MODEL,
+        fields=_prompt_report(HAIKU_PROMPT, messages),
+    )
+    data = _parse_haiku_content(resp.choices[0].message.content, refs_numbered)
+    if data.get("haiku_ja"):
+        data = _ensure_575(data)
+    if cache is not None and data.get("haiku_ja"):
+        cache.set(key, data)
+    return data
 
-{haiku_ja}
 
-🍃 Haiku (English)
+async def acall_gpt_haiku(payload: dict, *, timeout: Optional[float] = 60.0,
+                          use_cache: bool = True) -> dict:
+    """call_gpt_haiku の asyncio 版（AsyncOpenAI 使用）。"""
+    messages, refs_numbered = _haiku_messages(payload)
+    key = _haiku_cache_key(payload, messages)
+    cache, hit = _cached(key, use_cache)
+    if hit is not None:
+        return hit
 
-{haiku_en_3lines}
+    client = _get_async_client()
+    resp = await _retry_call_async(
+        alimited("chat", lambda: client.chat.completions.create(
+            model=CHAT_MODEL,
+            messages=messages,
+            temperature=HAIKU_TEMPERATURE,
+            response_format={"type": "json_object"},
+        ), tokens=estimate_chat_tokens(messages)),
+        model=CHAT_MODEL,
+        timeout=timeout,
+        fields=_prompt_report(HAIKU_PROMPT, messages),
+    )
+    data = _parse_haiku_content(resp.choices[0].message.content, refs_numbered)
+    if data.get("haiku_ja"):
+        data = await _aensure_575(data, timeout=timeout)
+    if cache is not None and data.get("haiku_ja"):
+        cache.set(key, data)
+    return data
 
-✨ Explanation
 
-{explanation_en_short}
+def call_gpt_haiku_candidates(payload: dict, *, n: int = HAIKU_CANDIDATES, df=None,
+                              use_cache: bool = True) -> list:
+    """
+    1回の呼び出し（n パラメータ）で n 句の候補を作り、haiku_rank で採点して良い順に返す。
+    df（一茶コーパス）を渡すと既存句との近さ（novelty）も採点に入る。
+    先頭の候補だけ、5-7-5 を外れていれば _ensure_575 で直す。残りは「次の候補」用にそのまま返し、
+    表示するときに ensure_candidate_575 を通す（使われない候補の修正依頼は出さない）。
+    """
+    messages, refs_numbered = _haiku_messages(payload)
+    key = make_key("haiku_candidates", payload=payload, model=CHAT_MODEL, n=n,
+                   temperature=HAIKU_TEMPERATURE, system=messages[0]["content"])
+    cache, hit = _cached(key, use_cache)
+    if hit is not None:
+        return hit
+
+    client = _get_client()
+    resp = _retry_call(
+        limited("chat", lambda: client.chat.completions.create(
+            model=CHAT_MODEL,
+            messages=messages,
+            temperature=HAIKU_TEMPERATURE,
+            n=n,
+            response_format={"type": "json_object"},
+        ), tokens=estimate_chat_tokens(messages, max_completion=800 * n)),
+        endpoint="chat.completions.candidates",
+        model=CHAT_MODEL,
+        fields={**_prompt_report(HAIKU_PROMPT, messages), "n": n},
+    )
+    cands = [_parse_haiku_content(c.message.content, refs_numbered) for c in resp.choices]
+    ranked = rank_candidates(cands, payload.get("references", []), df)
+    if ranked:
+        ranked[0] = ensure_candidate_575(ranked[0])
+    if cache is not None and ranked:
+        cache.set(key, ranked)
+    return ranked
+
+
+def ensure_candidate_575(cand: dict) -> dict:
+    """候補を表示する直前に、5-7-5 を外れていれば直す（検査・修正済みならそのまま返す）。"""
+    mora = cand.get("mora") or {}
+    if mora.get("ok") is False and not mora.get("repairs"):
+        return _ensure_575(cand)
+    return cand
+
+
+class _JsonFieldStream:
+    """
+    ストリーミング中の JSON オブジェクトを逐次読み、トップレベルの文字列フィールドが
+    閉じた時点で (キー, 値) を返す簡易パーサ。入れ子や数値は読み飛ばす。
+    """
+
+    def __init__(self):
+        self.buf = ""
+        self._pos = 0
+        self._depth = 0
+        self._in_str = False
+        self._escape = False
+        self._str_start = 0
+        self._expect_key = False
+        self._key: Optional[str] = None
+
+    def feed(self, chunk: str) -> list:
+        self.buf += chunk
+        out = []
+        buf = self.buf
+        for i in range(self._pos, len(buf)):
+            ch = buf[i]
+            if self._in_str:
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._in_str = False
+                    if self._depth == 1:
+                        try:
+                            text = json.loads(buf[self._str_start:i + 1])
+                        except json.JSONDecodeError:
+                            text = buf[self._str_start + 1:i]
+                        if self._expect_key:
+                            self._key = text
+                        elif self._key is not None:
+                            out.append((self._key, text))
+                            self._key = None
+                continue
+            if ch == '"':
+                self._in_str = True
+                self._str_start = i
+            elif ch in "{[":
+                self._depth += 1
+                self._expect_key = self._depth == 1 and ch == "{"
+            elif ch in "}]":
+                self._depth -= 1
+            elif self._depth == 1 and ch == ":":
+                self._expect_key = False
+            elif self._depth == 1 and ch == ",":
+                self._expect_key = True
+                self._key = None
+        self._pos = len(buf)
+        return out
+
+
+def _stream_chunk(chunk: Any, rec: dict, start: float, parser: _JsonFieldStream) -> list:
+    """ストリームの1チャンクを処理し、完成したフィールドを返す（usage・ttfb_sec は rec に書く）。"""
+    metrics.note_usage(chunk, rec)
+    if not chunk.choices:
+        return []
+    delta = chunk.choices[0].delta.content or ""
+    if delta and "ttfb_sec" not in rec:
+        rec["ttfb_sec"] = round(time.perf_counter() - start, 4)
+    return parser.feed(delta)
+
+
+def stream_gpt_haiku(payload: dict, *, use_cache: bool = True):
+    """
+    call_gpt_haiku のストリーミング版。フィールドが完成するたびに (キー, 値) を yield し、
+    最後に ("done", 完成した dict) を yield する。haiku_ja は先頭フィールドなので最初に届く。
+    """
+    messages, refs_numbered = _haiku_messages(payload)
+    key = _haiku_cache_key(payload, messages)
+    cache, hit = _cached(key, use_cache)
+    if hit is not None:
+        for k in ["haiku_ja", "explanation_ja", "reasons_refs_ja", "references_numbered"]:
+            yield k, hit.get(k, "")
+        yield "done", hit
+        return
+
+    client = _get_client()
+    # ストリーム全体を1レコードにし、最初の本文チャンクまでを ttfb_sec として記録。
+    # yield をまたいで metrics.timed を開いたままにすると ContextVar が呼び出し側に漏れるので、
+    # レコードは手元で組み立て、ストリームが終わってから1回だけ emit する
+    rec = metrics.new_record("chat.completions.stream", CHAT_MODEL, **_prompt_report(HAIKU_PROMPT, messages))
+    start = time.perf_counter()
+    parser = _JsonFieldStream()
+    try:
+        with metrics.attach(rec):
+            stream = _retry_call(
+                limited("chat", lambda: client.chat.completions.create(
+                    model=CHAT_MODEL,
+                    messages=messages,
+                    temperature=HAIKU_TEMPERATURE,
+                    response_format={"type": "json_object"},
+                    stream=True,
+                    stream_options={"include_usage": True},
+                ), tokens=estimate_chat_tokens(messages)),
+                record=False,
+            )
+        for chunk in stream:
+            yield from _stream_chunk(chunk, rec, start, parser)
+        rec["ok"] = True
+    except BaseException as e:
+        rec.setdefault("error", {"type": e.__class__.__name__, "msg": str(e)})
+        raise
+    finally:
+        rec["latency_sec"] = round(time.perf_counter() - start, 4)
+        metrics.emit(rec)
+
+    data = _parse_haiku_content(parser.buf, refs_numbered)
+    if data.get("haiku_ja"):
+        streamed = data["haiku_ja"]
+        data = _ensure_575(data)
+        if data["haiku_ja"] != streamed:
+            yield "haiku_ja", data["haiku_ja"]   # 修正後の句で表示を差し替える
+    if cache is not None and data.get("haiku_ja"):
+        cache.set(key, data)
+    yield "done", data
+
+
+async def astream_gpt_haiku(payload: dict, *, timeout: Optional[float] = 60.0, use_cache: bool = True):
+    """stream_gpt_haiku の asyncio 版（async generator）。timeout はストリーム開始までに適用。"""
+    messages, refs_numbered = _haiku_messages(payload)
+    key = _haiku_cache_key(payload, messages)
+    cache, hit = _cached(key, use_cache)
+    if hit is not None:
+        for k in ["haiku_ja", "explanation_ja", "reasons_refs_ja", "references_numbered"]:
+            yield k, hit.get(k, "")
+        yield "done", hit
+        return
+
+    client = _get_async_client()
+    rec = metrics.new_record("chat.completions.stream", CHAT_MODEL, **_prompt_report(HAIKU_PROMPT, messages))
+    start = time.perf_counter()
+    parser = _JsonFieldStream()
+    try:
+        with metrics.attach(rec):
+            stream = await _retry_call_async(
+                alimited("chat", lambda: client.chat.completions.create(
+                    model=CHAT_MODEL,
+                    messages=messages,
+                    temperature=HAIKU_TEMPERATURE,
+                    response_format={"type": "json_object"},
+                    stream=True,
+                    stream_options={"include_usage": True},
+                ), tokens=estimate_chat_tokens(messages)),
+                record=False,
+                timeout=timeout,
+            )
+        async for chunk in stream:
+            for field in _stream_chunk(chunk, rec, start, parser):
+                yield field
+        rec["ok"] = True
+    except BaseException as e:
+        rec.setdefault("error", {"type": e.__class__.__name__, "msg": str(e)})
+        raise
+    finally:
+        rec["latency_sec"] = round(time.perf_counter() - start, 4)
+        metrics.emit(rec)
+
+    data = _parse_haiku_content(parser.buf, refs_numbered)
+    if data.get("haiku_ja"):
+        streamed = data["haiku_ja"]
+        data = await _aensure_575(data, timeout=timeout)
+        if data["haiku_ja"] != streamed:
+            yield "haiku_ja", data["haiku_ja"]
+    if cache is not None and data.get("haiku_ja"):
+        cache.set(key, data)
+    yield "done", data
+
+
+def _english_messages(haiku_ja: str, explanation_ja: str) -> list:
+    """generate_english_tweet_block 用の messages を組み立てる。"""
+    return ENGLISH_PROMPT.messages(haiku_ja=haiku_ja, explanation_ja=explanation_ja)
+
+
+def _english_cache_key(messages: list) -> str:
+    return make_key("english", messages=messages, model=CHAT_MODEL, temperature=ENGLISH_TEMPERATURE)
+
+
+def generate_english_tweet_block(haiku_ja: str, explanation_ja: str, *, use_cache: bool = True) -> str:
+    """日本語俳句＋説明から X 向け英語ブロックを生成"""
+    messages = _english_messages(haiku_ja, explanation_ja)
+    key = _english_cache_key(messages)
+    cache, hit = _cached(key, use_cache)
+    if hit is not None:
+        return hit
+
+    client = _get_client()
+    resp = _retry_call(
+        limited("chat", lambda: client.chat.completions.create(
+            model=CHAT_MODEL,
+            messages=messages,
+            temperature=ENGLISH_TEMPERATURE,
+        ), tokens=estimate_chat_tokens(messages)),
+        endpoint="chat.completions.english",
+        model=CHAT_MODEL,
+        fields=_prompt_report(ENGLISH_PROMPT, messages),
+    )
+    text = resp.choices[0].message.content.strip()
+    if cache is not None and text:
+        cache.set(key, text)
+    return text
 
-制約：合計280字以内。英訳は3行、説明は1-2文。絵文字は🌿🍃✨のみ。"""
 
-    user_prompt = f"""俳句（日本語）:
-{haiku_ja}
+async def agenerate_english_tweet_block(haiku_ja: str, explanation_ja: str,
+                                        *, timeout: Optional[float] = 60.0,
+                                        use_cache: bool = True) -> str:
+    """generate_english_tweet_block の asyncio 版。"""
+    messages = _english_messages(haiku_ja, explanation_ja)
+    key = _english_cache_key(messages)
+    cache, hit = _cached(key, use_cache)
+    if hit is not None:
+        return hit
 
-俳句の説明（日本語の意訳/背景の要点）:
-{explanation_ja}
-"""
-    resp = client.chat.completions.create(
-        model="gpt-4o-mini",
-        messages=[{"role":"system","content":system_prompt},
-                  {"role":"user","content":user_prompt}],
-        temperature=0.5,
+    client = _get_async_client()
+    resp = await _retry_call_async(
+        alimited("chat", lambda: client.chat.completions.create(
+            model=CHAT_MODEL,
+            messages=messages,
+            temperature=ENGLISH_TEMPERATURE,
+        ), tokens=estimate_chat_tokens(messages)),
+        endpoint="chat.completions.english",
+        model=CHAT_MODEL,
+        fields=_prompt_report(ENGLISH_PROMPT, messages),
+        timeout=timeout,
     )
-    return resp.choices[0].message.content.strip()
+    text = resp.choices[0].message.content.strip()
+    if cache is not None and text:
+        cache.set(key, text)
+    return text
@@ -0,0 +1,175 @@
+"""
+一茶コーパス用のメモリ内インデックス群。
+
+DataFrame ごとに一度だけ構築し、プロセス内でキャッシュして使い回す。
+行番号はすべて DataFrame の位置（iloc）で表す。
+"""
+from __future__ import annotations
+import weakref
+from collections import defaultdict
+from typing import Any, Callable, Dict, Iterable, List
+
+import numpy as np
+import pandas as pd
+
+SEARCH_FIELDS = ["俳句", "読み", "季語候補"]
+FACET_COLUMNS = ["季節", "plutchik_main", "nihon_main", "nihon_sub", "has_repetition"]
+_FIELD_SEP = "\x1f"   # フィールド境界をまたぐ n-gram を作らないための区切り
+
+
+# =============================
+# インデックスのプロセス内キャッシュ
+# =============================
+_CACHE: Dict[tuple, Any] = {}
+_CACHE_MAX = 16
+
+
+_KEYS: Dict[int, tuple] = {}   # id(df) → キー（DataFrame ごとに一度だけ計算する）
+
+
+def _index_fingerprint(index: pd.Index) -> tuple:
+    """行の並び（index）の識別子。並べ替え・抽出したフレームを元のフレームと区別する。"""
+    if isinstance(index, pd.RangeIndex):
+        return ("range", index.start, index.stop, index.step)
+    return ("idx", int(pd.util.hash_pandas_object(index, index=False).sum()), len(index))
+
+
+def corpus_key(df: pd.DataFrame) -> tuple:
+    """
+    DataFrame を識別するキー。
+    corpus_store で読んだものは attrs の sha256、それ以外は本文列のハッシュで内容を表し、
+    行の並び（index）も含める。attrs は sort_values / sample などでも引き継がれるため、
+    sha256 だけだと行番号のずれたインデックスを使い回してしまう。
+    計算はフレームのオブジェクトごとに一度だけ（その後の破壊的な並べ替えには追従しない）。
+    """
+    key = _KEYS.get(id(df))
+    if key is not None:
+        return key
+    sha = df.attrs.get("corpus_sha256")
+    if sha:
+        content = ("sha", sha)
+    else:
+        col = df["俳句"] if "俳句" in df.columns else pd.Series([], dtype=object)
+        content = ("h", int(pd.util.hash_pandas_object(col.astype(str), index=False).sum()))
+    key = _KEYS[id(df)] = content + _index_fingerprint(df.index)
+    weakref.finalize(df, _KEYS.pop, id(df), None)
+    return key
+
+
+def cached_index(df: pd.DataFrame, name: str, builder: Callable[[pd.DataFrame], Any]) -> Any:
+    key = (name,) + corpus_key(df)
+    idx = _CACHE.get(key)
+    if idx is None:
+        if len(_CACHE) >= _CACHE_MAX:
+            _CACHE.clear()
+        idx = _CACHE[key] = builder(df)
+    return idx
+
+
+def get_haiku_texts(df: pd.DataFrame) -> List[str]:
+    """俳句列を str のリストとして返す（重複判定用、キャッシュ済み）。"""
+    return cached_index(df, "texts", lambda d: d["俳句"].astype(str).tolist())
+
+
+# =============================
+# 文字 n-gram 転置インデックス（キーワード検索）
+# =============================
+class NgramIndex:
+    """
+    俳句・読み・季語候補を対象とした文字 1-gram / 2-gram 転置インデックス。
+    かな・漢字を区別せず Unicode 1文字単位で切るため、形態素解析は不要。
+    1文字の語はポスティングそのもの、2文字以上は 2-gram の積集合を候補として本文で検証する。
+    """
+
+    def __init__(self, docs: List[str]):
+        self.docs = docs
+        postings: Dict[str, List[int]] = defaultdict(list)
+        for i, doc in enumerate(docs):
+            grams = set(doc)
+            grams.update(doc[j:j + 2] for j in range(len(doc) - 1))
+            for g in grams:
+                postings[g].append(i)
+        self._postings = {g: np.asarray(ids, dtype=np.int32) for g, ids in postings.items()}
+        self._empty = np.empty(0, dtype=np.int32)
+
+    @classmethod
+    def from_df(cls, df: pd.DataFrame, fields: Iterable[str] = SEARCH_FIELDS) -> "NgramIndex":
+        cols = [df[c].fillna("").astype(str).tolist() if c in df.columns else [""] * len(df) for c in fields]
+        return cls([_FIELD_SEP.join(vals) for vals in zip(*cols)])
+
+    def _lookup_term(self, term: str) -> np.ndarray:
+        if not term:
+            return np.arange(len(self.docs), dtype=np.int32)   # 空文字は全件にマッチ（str.contains 互換）
+        if len(term) == 1:
+            return self._postings.get(term, self._empty)
+        lists = [self._postings.get(term[j:j + 2], self._empty) for j in range(len(term) - 1)]
+        lists.sort(key=len)
+        cand = lists[0]
+        for p in lists[1:]:
+            if cand.size == 0:
+                break
+            cand = np.intersect1d(cand, p, assume_unique=True)
+        if len(term) == 2:
+            return cand
+        docs = self.docs
+        return np.asarray([i for i in cand if term in docs[i]], dtype=np.int32)
+
+    def search(self, terms: Iterable[str]) -> np.ndarray:
+        """いずれかの語を含む行番号（昇順・重複なし）を返す。"""
+        hits = [self._lookup_term(t) for t in terms]
+        if not hits:
+            return self._empty
+        if len(hits) == 1:
+            return hits[0]
+        return np.unique(np.concatenate(hits))
+
+
+def get_ngram_index(df: pd.DataFrame) -> NgramIndex:
+    return cached_index(df, "ngram", NgramIndex.from_df)
+
+
+# =============================
+# ファセット・ビットマップ（季節／感情／情緒の絞り込み）
+# =============================
+class FacetIndex:
+    """
+    ファセット列の値ごとに bool 配列を事前計算しておき、
+    条件の組み合わせをベクトル化された AND だけで評価する。
+    """
+
+    def __init__(self, df: pd.DataFrame, columns: Iterable[str] = FACET_COLUMNS):
+        self.n_rows = len(df)
+        self._bits: Dict[str, Dict[Any, np.ndarray]] = {}
+        for col in columns:
+            if col not in df.columns:
+                continue
+            codes, uniques = pd.factorize(df[col])
+            self._bits[col] = {v: codes == i for i, v in enumerate(uniques)}
+            for bits in self._bits[col].values():
+                bits.flags.writeable = False
+        self._none = np.zeros(self.n_rows, dtype=bool)
+        self._none.flags.writeable = False
+
+    def values(self, column: str) -> List[Any]:
+        return list(self._bits.get(column, {}))
+
+    def bitmap(self, column: str, value: Any) -> np.ndarray:
+        """column == value の行を True とする bool 配列（読み取り専用・共有）。"""
+        return self._bits.get(column, {}).get(value, self._none)
+
+    def mask(self, conditions: Dict[str, Any]) -> np.ndarray:
+        """
+        {列名: 値} の条件をすべて満たす行の bool 配列を返す。
+        値が None / 空文字の条件は無視する（絞り込みなし）。
+        """
+        out = None
+        for col, value in conditions.items():
+            if value is None or value == "":
+                continue
+            bits = self.bitmap(col, value)
+            out = bits.copy() if out is None else np.logical_and(out, bits, out=out)
+        return np.ones(self.n_rows, dtype=bool) if out is None else out
+
+
+def get_facet_index(df: pd.DataFrame) -> FacetIndex:
+    return cached_index(df, "facet", FacetIndex)
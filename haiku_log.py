@@ -0,0 +1,233 @@
+"""
+共通ロガー（x_client / haiku_gpt など）。
+
+- 呼び出し側は QueueHandler にレコードを積むだけで、ファイル書込みは QueueListener のスレッドが行う
+- 出力は 1行1レコードの JSON（JSON Lines）。バッファして書き、flush は一定間隔か WARNING 以上のときと、
+  キューが flush_sec の間空いたとき（最後のレコードが次のログまで残らないように）
+- サイズ上限または日付が変わったらローテーションし、古いファイルは gzip で圧縮する
+- どのモジュールのログにも ts, level, logger, msg, session_id, request_id（分かれば latency_sec）が入る
+  session_id / request_id は context() / set_session() で設定した値（contextvars）を使う
+
+使い方:
+    _logger = haiku_log.get_logger("haiku_gpt")
+    _logger.info("OpenAI call OK", extra={"endpoint": "chat.completions", "latency_sec": 0.42})
+
+環境変数:
+    HAIKU_LOG_DIR (outputs/logs) / HAIKU_LOG_FILE (haiku.jsonl) / HAIKU_LOG_LEVEL (INFO)
+    HAIKU_LOG_MAX_BYTES (52428800) / HAIKU_LOG_BACKUPS (30) / HAIKU_LOG_FLUSH_SEC (1.0)
+    HAIKU_LOG_CONSOLE (1: 標準エラーにもテキストで出す)
+"""
+from __future__ import annotations
+import os, gzip, json, time, uuid, queue, atexit, shutil, logging, threading
+import logging.handlers
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+_session_id: ContextVar[Optional[str]] = ContextVar("haiku_log_session_id", default=None)
+_request_id: ContextVar[Optional[str]] = ContextVar("haiku_log_request_id", default=None)
+
+# LogRecord 標準の属性（これ以外は extra で渡された項目として JSON に出す）
+_STANDARD = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime", "taskName"}
+_CONTEXT = ("session_id", "request_id")
+
+
+def new_id() -> str:
+    return uuid.uuid4().hex[:12]
+
+
+def set_session(session_id: Optional[str]) -> None:
+    """現在のスレッド（Streamlit のセッション実行）に session_id を設定する。"""
+    _session_id.set(session_id)
+
+
+@contextmanager
+def context(session_id: Optional[str] = None, request_id: Optional[str] = None):
+    """with ブロック内のログに session_id / request_id を付ける（None の項目は外側の値のまま）。"""
+    tokens = []
+    if session_id is not None:
+        tokens.append((_session_id, _session_id.set(session_id)))
+    if request_id is not None:
+        tokens.append((_request_id, _request_id.set(request_id)))
+    try:
+        yield
+    finally:
+        for var, token in reversed(tokens):
+            var.reset(token)
+
+
+# =============================
+# フォーマッタ・ハンドラ
+# =============================
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        out: Dict[str, Any] = {
+            "ts": datetime.fromtimestamp(record.created).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for k in _CONTEXT:
+            out[k] = getattr(record, k, None)
+        for k, v in vars(record).items():
+            if k not in _STANDARD and k not in out:
+                out[k] = v
+        if record.exc_text:
+            out["exc"] = record.exc_text
+        return json.dumps(out, ensure_ascii=False, default=str)
+
+
+class _ContextQueueHandler(logging.handlers.QueueHandler):
+    """呼び出し元スレッドで contextvars とメッセージを確定させてからキューに積む。"""
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = logging.makeLogRecord(vars(record))
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+        record.exc_info = None
+        if getattr(record, "session_id", None) is None:
+            record.session_id = _session_id.get()
+        if getattr(record, "request_id", None) is None:
+            record.request_id = _request_id.get()
+        return record
+
+
+class RotatingJsonlHandler(logging.handlers.RotatingFileHandler):
+    """
+    サイズ（max_bytes）または日付の変わり目でローテーションし、世代ファイルは gzip にする。
+    StreamHandler と違い毎レコード flush せず、flush_sec ごと（WARNING 以上は即時）にまとめて書く。
+    """
+
+    def __init__(self, filename: str | Path, max_bytes: int, backups: int, flush_sec: float = 1.0):
+        Path(filename).parent.mkdir(parents=True, exist_ok=True)
+        super().__init__(filename, maxBytes=max_bytes, backupCount=backups, encoding="utf-8", delay=True)
+        self.namer = lambda name: f"{name}.gz"
+        self.rotator = self._compress
+        self.flush_sec = flush_sec
+        self._last_flush = time.monotonic()
+        self._dirty = False
+        # 既存ファイルの日付から始める（前日のファイルに追記し続けないように）
+        path = Path(self.baseFilename)
+        self._day = (datetime.fromtimestamp(path.stat().st_mtime).date() if path.exists()
+                     else datetime.now().date())
+
+    @staticmethod
+    def _compress(source: str, dest: str) -> None:
+        with open(source, "rb") as src, gzip.open(dest, "wb") as dst:
+            shutil.copyfileobj(src, dst)
+        os.remove(source)
+
+    def shouldRollover(self, record: logging.LogRecord) -> bool:
+        if datetime.fromtimestamp(record.created).date() != self._day:
+            return True
+        return bool(super().shouldRollover(record))
+
+    def doRollover(self) -> None:
+        self._day = datetime.now().date()
+        super().doRollover()
+
+    def emit(self, record: logging.LogRecord) -> None:
+        try:
+            if self.shouldRollover(record):
+                self.doRollover()
+            if self.stream is None:
+                self.stream = self._open()
+            self.stream.write(self.format(record) + self.terminator)
+            self._dirty = True
+            if record.levelno >= logging.WARNING or time.monotonic() - self._last_flush >= self.flush_sec:
+                self.flush()
+        except Exception:
+            self.handleError(record)
+
+    def flush(self) -> None:
+        super().flush()
+        self._dirty = False
+        self._last_flush = time.monotonic()
+
+    def flush_idle(self) -> None:
+        """書きかけのバッファがあれば flush する（キューが空いたときにリスナーから呼ぶ）。"""
+        if self._dirty:
+            self.flush()
+
+
+class _FlushingQueueListener(logging.handlers.QueueListener):
+    """キューが flush_sec の間空いたら、ハンドラのバッファを書き出す。"""
+
+    def __init__(self, q, *handlers, flush_sec: float = 1.0, **kwargs):
+        super().__init__(q, *handlers, **kwargs)
+        self.flush_sec = flush_sec
+
+    def dequeue(self, block: bool):
+        while True:
+            try:
+                return self.queue.get(block, self.flush_sec if block else None)
+            except queue.Empty:
+                if not block:
+                    raise
+                for h in self.handlers:
+                    if isinstance(h, RotatingJsonlHandler):
+                        h.flush_idle()
+
+
+# =============================
+# 初期化
+# =============================
+_queue_handler: Optional[logging.Handler] = None
+_listener: Optional[logging.handlers.QueueListener] = None
+_setup_lock = threading.Lock()
+
+
+def _setup() -> logging.Handler:
+    global _queue_handler, _listener
+    with _setup_lock:
+        if _queue_handler is not None:
+            return _queue_handler
+        handlers = []
+        log_dir = Path(os.getenv("HAIKU_LOG_DIR", "outputs/logs"))
+        flush_sec = float(os.getenv("HAIKU_LOG_FLUSH_SEC", 1.0))
+        file_handler = RotatingJsonlHandler(
+            log_dir / os.getenv("HAIKU_LOG_FILE", "haiku.jsonl"),
+            max_bytes=int(os.getenv("HAIKU_LOG_MAX_BYTES", 50 * 1024 * 1024)),
+            backups=int(os.getenv("HAIKU_LOG_BACKUPS", 30)),
+            flush_sec=flush_sec,
+        )
+        file_handler.setFormatter(JsonFormatter())
+        handlers.append(file_handler)
+        if os.getenv("HAIKU_LOG_CONSOLE", "1") != "0":
+            console = logging.StreamHandler()
+            console.setFormatter(logging.Formatter("%(asctime)s [%(levelname)s] %(name)s: %(message)s"))
+            handlers.append(console)
+        _listener = _FlushingQueueListener(queue.SimpleQueue(), *handlers, flush_sec=flush_sec,
+                                           respect_handler_level=True)
+        _listener.start()
+        _queue_handler = _ContextQueueHandler(_listener.queue)
+        atexit.register(shutdown)
+        return _queue_handler
+
+
+def shutdown() -> None:
+    """キューに残ったログを書き出してファイルを閉じる（終了時に自動で呼ばれる）。"""
+    global _listener
+    with _setup_lock:
+        listener, _listener = _listener, None
+    if listener is None:
+        return
+    listener.stop()
+    for h in listener.handlers:
+        h.flush()
+        h.close()
+
+
+def get_logger(name: str) -> logging.Logger:
+    """共通のキュー経由ハンドラを付けたロガー（ルートロガーには伝播させない）。"""
+    logger = logging.getLogger(name)
+    handler = _setup()
+    if handler not in logger.handlers:
+        logger.addHandler(handler)
+        logger.setLevel(os.getenv("HAIKU_LOG_LEVEL", "INFO").upper())
+        logger.propagate = False
+    return logger
@@ -0,0 +1,104 @@
+"""
+1回の呼び出しで得た複数の俳句候補を、手元だけで採点・順位付けする。
+
+採点項目（いずれも 0〜1、高いほど良い）:
+- mora       : 5-7-5 に合っているか（ずれが大きいほど減点、読めなければ中間値）
+- overlap    : 選んだ参照句と共有する要素（文字 2-gram）の量
+- repetition : 参照句に擬音語・繰り返し（has_repetition）があるとき、候補にもあるか
+- novelty    : 一茶コーパスの最も近い句（dedup_index）との類似度が低いほど高い（丸写しを避ける）
+総合点は WEIGHTS による加重和。
+"""
+from __future__ import annotations
+import re
+from typing import List, Optional
+
+import pandas as pd
+
+from dedup_index import DedupIndex, get_dedup_index
+from mora import PATTERN, check_575, to_hiragana
+
+WEIGHTS = {"mora": 0.4, "novelty": 0.25, "overlap": 0.2, "repetition": 0.15}
+OVERLAP_SATURATION = 4     # 参照句と共有する 2-gram がこの数あれば overlap は満点
+
+_STRIP = re.compile(r"[\s　、。・「」『』！？!?\-ー～〜/／]")
+_REPEAT_MARK = re.compile(r"[～〜〱〲]")   # くの字点（ゝ・々 の1字繰り返しは数えない）
+_REPEAT_KANA = re.compile(r"([ぁ-ゖ]{2,4})\1")
+
+
+def _bigrams(text: str) -> set:
+    s = _STRIP.sub("", text)
+    return {s[i:i + 2] for i in range(len(s) - 1)}
+
+
+def detect_repetition(haiku_ja: str, reading: Optional[str] = None) -> bool:
+    """
+    繰り返し表現（擬音語・畳語）があるか。コーパスの has_repetition に合わせて、
+    くの字点「～」か、読みの中で 2〜4 音が続けて繰り返される箇所（かさりかさり等）を探す。
+    """
+    if _REPEAT_MARK.search(haiku_ja or ""):
+        return True
+    kana = to_hiragana(re.sub(r"[\s　]", "", reading or haiku_ja or ""))
+    return bool(_REPEAT_KANA.search(kana))
+
+
+# =============================
+# 採点
+# =============================
+def _mora_score(check: dict) -> float:
+    if check["ok"] is None:
+        return 0.5
+    if check["ok"]:
+        return 1.0
+    counts = check["counts"]
+    gap = (sum(abs(c - w) for c, w in zip(counts, PATTERN)) if len(counts) == len(PATTERN)
+           else abs(sum(counts) - sum(PATTERN)) + len(PATTERN))
+    return max(0.0, 1.0 - gap / 4)
+
+
+def score_candidate(cand: dict, references: List[dict], index: Optional[DedupIndex] = None) -> dict:
+    """候補1件の採点結果（項目ごとの点・総合点 score・コーパスの最近傍句）を返す。"""
+    haiku = cand.get("haiku_ja", "")
+    reading = cand.get("reading_ja")
+    check = check_575(haiku, reading)
+
+    grams = _bigrams(haiku)
+    ref_grams = set().union(*(_bigrams(r.get("text", "")) for r in references)) if references else set()
+    overlap = min(1.0, len(grams & ref_grams) / OVERLAP_SATURATION)
+
+    has_rep = detect_repetition(haiku, reading)
+    wants_rep = any(r.get("has_repetition") for r in references)
+    repetition = 1.0 if (has_rep or not wants_rep) else 0.0
+
+    near = index.nearest(haiku, reading, k=1) if index is not None else []
+    sim = near[0]["similarity"] if near else 0.0
+    scores = {"mora": _mora_score(check), "overlap": overlap,
+              "repetition": repetition, "novelty": 1.0 - sim}
+    return {
+        **{k: round(v, 3) for k, v in scores.items()},
+        "score": round(sum(WEIGHTS[k] * v for k, v in scores.items()), 3),
+        "has_repetition": has_rep,
+        "nearest": near[0]["text"] if near else None,
+        "nearest_similarity": round(sim, 3),
+        "mora_check": check,
+    }
+
+
+def rank_candidates(cands: List[dict], references: List[dict], df: Optional[pd.DataFrame] = None) -> List[dict]:
+    """
+    候補を総合点の高い順に並べて返す。各候補には data["rank"]（採点内訳）と
+    data["mora"]（5-7-5 の検査結果）を付ける。空の候補と同じ句の重複は除く。
+    """
+    index = get_dedup_index(df) if df is not None and len(df) else None
+    ranked, seen = [], set()
+    for c in cands:
+        haiku = c.get("haiku_ja", "")
+        key = _STRIP.sub("", haiku)
+        if not key or key in seen:
+            continue
+        seen.add(key)
+        rank = score_candidate(c, references, index)
+        check = rank.pop("mora_check")
+        ranked.append({**c, "rank": rank,
+                       "mora": {"ok": check["ok"], "counts": check["counts"], "repairs": 0}})
+    ranked.sort(key=lambda c: c["rank"]["score"], reverse=True)
+    return ranked
@@ -1,12 +1,21 @@
 
 from __future__ import annotations
-import os, base64
+import os, json, base64, threading
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FuturesTimeout
 from io import BytesIO
 from datetime import datetime
 from pathlib import Path
 from PIL import Image
 from openai import OpenAI
 
+from artifact_store import get_store, content_id, make_key
+from rate_limit import get_limiter, limited
+import metrics
+import haiku_log
+
+_logger = haiku_log.get_logger("haiku_image")
+
 _client = None
 def _get_client() -> OpenAI:
     global _client
@@ -14,6 +23,151 @@ def _get_client() -> OpenAI:
         _client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
     return _client
 
+_MAGIC = [(b"\x89PNG\r\n\x1a\n", "png"), (b"\xff\xd8\xff", "jpeg"), (b"RIFF", "webp")]
+
+class ImageArtifact:
+    """
+    API から受け取ったエンコード済み画像バイト列と、遅延デコードした画素を束ねたもの。
+
+    保存・アップロード・ダウンロードは元のバイト列をそのまま使い、
+    画素（.image）は表示や加工で本当に必要になった時に1回だけデコードする。
+    """
+
+    def __init__(self, data: bytes, fmt: str | None = None):
+        self.data = bytes(data)
+        self.format = fmt or next((f for m, f in _MAGIC if self.data.startswith(m)), "png")
+        self._image: Image.Image | None = None
+        self._size: tuple | None = None
+        self._id: str | None = None
+
+    @classmethod
+    def from_image(cls, img: Image.Image, fmt: str = "png", **save_kwargs) -> "ImageArtifact":
+        """手元の PIL 画像から作る（エンコードはここで1回だけ）。"""
+        buf = BytesIO()
+        img.save(buf, format=fmt.upper(), **save_kwargs)
+        art = cls(buf.getvalue(), fmt)
+        art._image = img
+        return art
+
+    @property
+    def id(self) -> str:
+        """内容の sha256（artifact_store のファイル名・派生画像キャッシュのキー）。"""
+        if self._id is None:
+            self._id = content_id(self.data)
+        return self._id
+
+    @property
+    def mime(self) -> str:
+        return f"image/{self.format}"
+
+    @property
+    def ext(self) -> str:
+        return "jpg" if self.format == "jpeg" else self.format
+
+    @property
+    def size(self) -> tuple:
+        """(幅, 高さ)。ヘッダだけ読むので画素はデコードしない。"""
+        if self._image is not None:
+            return self._image.size
+        if self._size is None:
+            with Image.open(BytesIO(self.data)) as im:
+                self._size = im.size
+        return self._size
+
+    @property
+    def image(self) -> Image.Image:
+        """RGB の PIL 画像（初回アクセス時にデコードしてキャッシュ）。"""
+        if self._image is None:
+            with Image.open(BytesIO(self.data)) as im:
+                self._image = im.convert("RGB")
+        return self._image
+
+
+def as_artifact(img: "Image.Image | ImageArtifact") -> ImageArtifact:
+    return img if isinstance(img, ImageArtifact) else ImageArtifact.from_image(img)
+
+
+# ==== 派生画像（表示用 WebP / JPEG・サムネイル）=====================
+# マスター（API が返した PNG）はそのまま保持し、ページ表示やギャラリーには軽い派生を使う。
+# 生成は別スレッドで行い、artifact id ごとに Future をキャッシュする。
+RENDITIONS = {
+    # 名前: (長辺の上限px, 形式, 品質)
+    "display": (768, "webp", 82),
+    "display_jpeg": (768, "jpeg", 85),
+    "thumb": (256, "webp", 70),
+}
+_RENDITION_CACHE_MAX = 64
+_rendition_executor = ThreadPoolExecutor(
+    max_workers=int(os.getenv("HAIKU_RENDITION_WORKERS", 2)),
+    thread_name_prefix="haiku-rendition",
+)
+_renditions: "OrderedDict[str, Future]" = OrderedDict()
+_renditions_lock = threading.Lock()
+
+def _encode(img: Image.Image, fmt: str, quality: int) -> bytes:
+    buf = BytesIO()
+    if fmt == "jpeg":
+        img.save(buf, format="JPEG", quality=quality, optimize=True, progressive=True)
+    else:
+        img.save(buf, format=fmt.upper(), quality=quality, method=4)
+    return buf.getvalue()
+
+def _rendition_key(art_id: str, name: str, when: datetime | None = None) -> str:
+    fmt = RENDITIONS[name][1]
+    return make_key(art_id, f"{name}.{'jpg' if fmt == 'jpeg' else fmt}", when)
+
+def _render_all(art: ImageArtifact) -> dict:
+    """マスターを1回だけデコードし、大きい順に縮小しながら全派生を作る。"""
+    out = {}
+    src = art.image
+    for name, (max_px, fmt, quality) in sorted(RENDITIONS.items(), key=lambda kv: -kv[1][0]):
+        if max(src.size) > max_px:
+            src = src.resize(_fit(src.size, max_px), Image.LANCZOS)
+        out[name] = ImageArtifact(_encode(src, fmt, quality), fmt)
+    return out
+
+def _store_renditions(fut: Future, art_id: str, store, when: datetime | None) -> None:
+    if fut.cancelled() or fut.exception() is not None:
+        return
+    for name, rend in fut.result().items():
+        store.put_key(_rendition_key(art_id, name, when), rend.data)
+
+def _fit(size: tuple, max_px: int) -> tuple:
+    w, h = size
+    r = max_px / max(w, h)
+    return max(1, round(w * r)), max(1, round(h * r))
+
+def start_renditions(img: Image.Image | ImageArtifact, store=None, when: datetime | None = None) -> Future:
+    """
+    派生画像の生成をバックグラウンドで開始する（同じ画像なら既存の Future を返す）。
+    store（artifact_store）を渡すと <id>.<名前>.<拡張子> でマスターの隣にも保存する。
+    生成済みの画像でも、store を渡すたびにその store への書込みを予約する。
+    """
+    art = as_artifact(img)
+    with _renditions_lock:
+        fut = _renditions.get(art.id)
+        if fut is not None:
+            _renditions.move_to_end(art.id)
+        else:
+            fut = _renditions[art.id] = _rendition_executor.submit(_render_all, art)
+            while len(_renditions) > _RENDITION_CACHE_MAX:
+                _renditions.popitem(last=False)
+    if store is not None:
+        # 完了済みならこの場で、未完了なら生成スレッドで書込みを積む（put_key は待たない）
+        fut.add_done_callback(lambda f: _store_renditions(f, art.id, store, when))
+    return fut
+
+def get_rendition(img: Image.Image | ImageArtifact, name: str, timeout: float | None = None) -> ImageArtifact | None:
+    """派生画像を返す。timeout 内に出来ない・生成に失敗したときは None（呼び出し側はマスターで代用する）。"""
+    try:
+        return start_renditions(img).result(timeout=timeout)[name]
+    except FuturesTimeout:
+        return None
+    except Exception as e:
+        # 壊れた画像・エンコーダ未対応など。表示は PNG のままで続ける
+        _logger.warning(f"rendition {name} failed: {e}", exc_info=True, extra={"rendition": name})
+        return None
+
 def build_image_prompt(haiku_ja: str, explanation_ja: str, season: str, keyword: str, aesthetic: str) -> str:
     import random
     season_en = {"春":"spring","夏":"summer","秋":"autumn","冬":"winter","新年":"new year","無季":"seasonless"}.get(season,"seasonal")
@@ -132,22 +286,36 @@ Keyword (seasonal word or theme): {keyword}
         prompt += f"\n- Aesthetic nuance: {tail[aesthetic]}\n"
     return prompt
 
-def generate_image(prompt_text: str, size: str = "1024x1024") -> Image.Image:
+def generate_image(prompt_text: str, size: str = "1024x1024") -> ImageArtifact:
     client = _get_client()
-    resp = client.images.generate(model="gpt-image-1", prompt=prompt_text, size=size, n=1)
-    b64 = resp.data[0].b64_json
-    img_bytes = base64.b64decode(b64)
-    return Image.open(BytesIO(img_bytes))
-
-def save_artifacts(img: Image.Image, meta: dict, output_dir: Path | None = None) -> dict:
-    output_dir = output_dir or Path("outputs")
-    output_dir.mkdir(exist_ok=True)
-    ts = datetime.now().strftime("%Y%m%d_%H%M%S")
-    png_path = output_dir / f"haiku_image_{ts}.png"
-    json_path = output_dir / f"haiku_meta_{ts}.json"
-    img.save(png_path, "PNG")
-    json_path.write_text(__import__("json").dumps(meta, ensure_ascii=False, indent=2), encoding="utf-8")
-    return {"png": str(png_path), "json": str(json_path)}
+    with metrics.timed("images.generate", model="gpt-image-1") as rec:
+        metrics.note(queue_wait_sec=get_limiter("image").acquire())
+        resp = client.images.generate(model="gpt-image-1", prompt=prompt_text, size=size, n=1)
+        b64 = resp.data[0].b64_json
+        img_bytes = base64.b64decode(b64)
+        rec["image_bytes"] = len(img_bytes)
+    return ImageArtifact(img_bytes)
+
+def save_artifacts(img: Image.Image | ImageArtifact, meta: dict, output_dir: Path | None = None,
+                   wait: bool = False) -> dict:
+    """
+    画像とメタ JSON を artifact_store に保存する。ファイル名は画像内容のハッシュ（artifact_id）で、
+    書込みはバックグラウンドで行う。直後にファイルを読む呼び出し元（X 投稿・バッチ）は wait=True。
+    """
+    store = get_store(output_dir)
+    art = as_artifact(img)
+    now = datetime.now()
+    art_id = art.id
+    png_key, png_fut = store.put(art.data, art.ext, now)
+    start_renditions(art, store, now)
+    meta_bytes = json.dumps({**meta, "artifact_id": art_id}, ensure_ascii=False, indent=2).encode("utf-8")
+    json_key = make_key(art_id, "json", now)
+    json_fut = store.put_key(json_key, meta_bytes)
+    if wait:
+        png_fut.result()
+        json_fut.result()
+    return {"artifact_id": art_id, "png": store.locate(png_key), "json": store.locate(json_key),
+            "renditions": {name: store.locate(_rendition_key(art_id, name, now)) for name in RENDITIONS}}
 
 # ==== 追加: 既存画像を英語俳句入りで再出力する関数 =====================
 
@@ -158,43 +326,171 @@ from openai import OpenAI
 
 # 既存の _get_client() がある前提
 
-def edit_image_with_text(base_img: Image.Image, prompt: str, size: str = "1024x1024") -> Image.Image:
+# images/edits の HTTP フォールバック用。同一ホストへの接続を keep-alive で使い回す
+# （呼び出しごとの TLS ハンドシェイクを避ける）。プール数・タイムアウトは環境変数で調整:
+#   HAIKU_HTTP_POOL (10) / HAIKU_HTTP_CONNECT_TIMEOUT (10秒) / HAIKU_HTTP_READ_TIMEOUT (120秒)
+_http_session = None
+def _get_http_session() -> requests.Session:
+    global _http_session
+    if _http_session is None:
+        pool = int(os.getenv("HAIKU_HTTP_POOL", 10))
+        sess = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=pool, pool_maxsize=pool)
+        sess.mount("https://", adapter)
+        sess.mount("http://", adapter)
+        _http_session = sess
+    return _http_session
+
+def _http_timeout() -> tuple:
+    return (float(os.getenv("HAIKU_HTTP_CONNECT_TIMEOUT", 10)), float(os.getenv("HAIKU_HTTP_READ_TIMEOUT", 120)))
+
+
+class _TransientHTTPError(requests.HTTPError):
+    """429 / 5xx（再試行で回復しうる HTTP エラー）。"""
+
+_HTTP_RETRY_ON = (_TransientHTTPError, requests.ConnectionError, requests.Timeout)
+
+def _post_images_edit(png_bytes: bytes, filename: str, mime: str, data: dict) -> dict:
+    base_url = (os.getenv("OPENAI_BASE_URL") or "https://api.openai.com/v1").rstrip("/")
+    r = _get_http_session().post(
+        f"{base_url}/images/edits",
+        headers={"Authorization": f"Bearer {os.getenv('OPENAI_API_KEY')}"},
+        files={"image": (filename, png_bytes, mime)},
+        data=data,
+        timeout=_http_timeout(),
+    )
+    if r.status_code == 429 or r.status_code >= 500:
+        raise _TransientHTTPError(f"{r.status_code} {r.reason}: {r.text[:200]}", response=r)
+    r.raise_for_status()   # その他の 4xx は再試行しない
+    return r.json()
+
+def edit_image_with_text(base_img: Image.Image | ImageArtifact, prompt: str, size: str = "1024x1024") -> ImageArtifact:
     """
     gpt-image-1 で既存画像を編集。まず SDK の images.edit を試し、
     未サポートなら /v1/images/edits を HTTP でフォールバック。
+    ImageArtifact を渡せば元のバイト列をそのまま送る（再エンコードしない）。
     """
-    buf = io.BytesIO()
-    base_img.save(buf, format="PNG")
-    png_bytes = buf.getvalue()
+    base = as_artifact(base_img)
+    png_bytes = base.data
 
     # 1) SDK で try（images.edit がある環境）
     client = _get_client()
     if hasattr(client.images, "edit"):
         try:
-            resp = client.images.edit(
-                model="gpt-image-1",
-                image=png_bytes,        # bytes を渡せる SDK ではこれでOK
-                prompt=prompt,
-                size=size,
-            )
-            b64 = resp.data[0].b64_json
-            return Image.open(io.BytesIO(base64.b64decode(b64))).convert("RGB")
+            with metrics.timed("images.edit", model="gpt-image-1", path="sdk") as rec:
+                metrics.note(queue_wait_sec=get_limiter("image").acquire())
+                resp = client.images.edit(
+                    model="gpt-image-1",
+                    image=png_bytes,        # bytes を渡せる SDK ではこれでOK
+                    prompt=prompt,
+                    size=size,
+                )
+                out_bytes = base64.b64decode(resp.data[0].b64_json)
+                rec["image_bytes"] = len(out_bytes)
+            return ImageArtifact(out_bytes)
         except Exception:
             pass  # 失敗時は HTTP にフォールバック
 
-    # 2) フォールバック：HTTP 直叩き（どの環境でも動く）
-    api_key = os.getenv("OPENAI_API_KEY")
-    headers = {"Authorization": f"Bearer {api_key}"}
-    files = {
-        "image": ("image.png", png_bytes, "image/png"),
-    }
+    # 2) フォールバック：HTTP 直叩き（どの環境でも動く）。プール済みセッション＋_retry_call と同じ再試行
+    from haiku_gpt import _retry_call
     data = {
         "model": "gpt-image-1",
         "prompt": prompt,
         "size": size,
         # 必要なら "quality": "high", "input_fidelity": "low" などを追加
     }
-    r = requests.post("https://api.openai.com/v1/images/edits", headers=headers, files=files, data=data, timeout=90)
-    r.raise_for_status()
-    out_b64 = r.json()["data"][0]["b64_json"]
-    return Image.open(io.BytesIO(base64.b64decode(out_b64))).convert("RGB")
+    with metrics.timed("images.edit", model="gpt-image-1", path="http") as rec:
+        body = _retry_call(
+            limited("image", lambda: _post_images_edit(png_bytes, f"image.{base.ext}", base.mime, data)),
+            endpoint="images.edit", model="gpt-image-1", record=False, retry_on=_HTTP_RETRY_ON,
+        )
+        out_bytes = base64.b64decode(body["data"][0]["b64_json"])
+        rec["image_bytes"] = len(out_bytes)
+    return ImageArtifact(out_bytes)
+
+# ==== ローカル合成: 英語俳句を PIL で画像内に配置（API 編集の高速な代替） ==========
+# build_directives と同じパラメータ（配置・インセット・下端からの距離・行間）で組版する。
+# フォントは HAIKU_OVERLAY_FONT → fonts/Allura-Regular.ttf（同梱する場合）→ システムのセリフ体 → PIL 既定 の順に探す。
+import functools
+from PIL import ImageDraw, ImageFilter, ImageFont
+
+_FONT_CANDIDATES = [
+    Path(__file__).resolve().parent / "fonts" / "Allura-Regular.ttf",
+    Path("/usr/share/fonts/truetype/dejavu/DejaVuSerif-Italic.ttf"),
+    Path("/usr/share/fonts/truetype/dejavu/DejaVuSerif.ttf"),
+    Path("/Library/Fonts/Georgia Italic.ttf"),
+    Path("C:/Windows/Fonts/georgiai.ttf"),
+]
+
+@functools.lru_cache(maxsize=64)
+def _overlay_font(size: int, path: str | None = None) -> ImageFont.ImageFont:
+    candidates = [Path(path)] if path else []
+    if os.getenv("HAIKU_OVERLAY_FONT"):
+        candidates.append(Path(os.environ["HAIKU_OVERLAY_FONT"]))
+    for p in candidates + _FONT_CANDIDATES:
+        if p.exists():
+            return ImageFont.truetype(str(p), size)
+    return ImageFont.load_default(size)
+
+# 配置 → (横: left/center/right, 縦: top/middle/bottom)
+_ANCHORS = {
+    "下部中央": ("center", "bottom"), "右下": ("right", "bottom"), "左下": ("left", "bottom"),
+    "中央": ("center", "middle"), "右上": ("right", "top"), "左上": ("left", "top"),
+    "上部中央": ("center", "top"),
+}
+
+def overlay_text_local(base_img: Image.Image | ImageArtifact, text: str, pos_choice: str = "下部中央",
+                       inset_pct: float = 5, min_bottom_px: int = 52, line_spacing: float = 1.35,
+                       font_path: str | None = None) -> ImageArtifact:
+    """
+    英語俳句をローカルで画像に重ねる。改行は保持し、安全枠に収まるまでフォントを縮める。
+    読みやすさのため控えめな影と細い縁取りを付ける。min_bottom_px は 1024px 基準で拡縮する。
+    """
+    with metrics.timed("images.overlay_local"):
+        src = as_artifact(base_img).image
+        W, H = src.size
+        scale = H / 1024
+        inset = round(min(W, H) * inset_pct / 100)
+        box_l, box_r = inset, W - inset
+        box_t, box_b = inset, H - max(inset, round(min_bottom_px * scale))
+        lines = [ln.strip() for ln in text.strip().splitlines()]
+        h_align, v_align = _ANCHORS.get(pos_choice, _ANCHORS["下部中央"])
+
+        # 枠の幅に収まり、高さが画像の4割を超えない最大サイズを探す
+        size = max(12, round(H * 0.056))
+        while True:
+            font = _overlay_font(size, font_path)
+            widths = [font.getlength(ln) for ln in lines]
+            step = size * line_spacing
+            block_h = size + step * (len(lines) - 1)
+            if (max(widths, default=0) <= box_r - box_l and block_h <= min(box_b - box_t, H * 0.4)) or size <= 12:
+                break
+            size -= 2
+
+        block_w = max(widths, default=0)
+        x0 = {"left": box_l, "center": (W - block_w) / 2, "right": box_r - block_w}[h_align]
+        y0 = {"top": box_t, "middle": (H - block_h) / 2, "bottom": box_b - block_h}[v_align]
+        positions = []
+        for i, (ln, w) in enumerate(zip(lines, widths)):
+            x = {"left": x0, "center": x0 + (block_w - w) / 2, "right": x0 + block_w - w}[h_align]
+            positions.append((x, y0 + i * step, ln))
+
+        # 影と文字はテキスト周辺の切り出し領域だけで描いて合成する（全面ぼかしを避ける）
+        stroke = max(1, round(size / 40))
+        off = blur = max(1, round(2 * scale))
+        pad = stroke + off + 3 * blur
+        cl, ct = max(0, int(x0) - pad), max(0, int(y0) - pad)
+        cr, cb = min(W, int(x0 + block_w) + pad), min(H, int(y0 + block_h + size * 0.4) + pad)
+        region = src.crop((cl, ct, cr, cb)).convert("RGBA")
+        shadow = Image.new("RGBA", region.size, (0, 0, 0, 0))
+        layer = Image.new("RGBA", region.size, (0, 0, 0, 0))
+        sd, d = ImageDraw.Draw(shadow), ImageDraw.Draw(layer)
+        for x, y, ln in positions:
+            sd.text((x - cl + off, y - ct + off), ln, font=font, fill=(0, 0, 0, 150))
+            d.text((x - cl, y - ct), ln, font=font, fill=(250, 246, 236, 255),
+                   stroke_width=stroke, stroke_fill=(30, 30, 40, 170))
+        shadow = shadow.filter(ImageFilter.GaussianBlur(blur))
+        out = src.copy()
+        out.paste(Image.alpha_composite(Image.alpha_composite(region, shadow), layer).convert("RGB"), (cl, ct))
+        # 最終画像はダウンロード・再利用されるので、圧縮率より速度を優先して1回だけ PNG 化する
+        return ImageArtifact.from_image(out, compress_level=1)
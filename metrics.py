@@ -0,0 +1,296 @@
+"""
+呼び出し単位の計測レコードと出力先（sink）。
+
+1回の外部呼び出し（chat / images / X 投稿 / 参照句検索など）ごとに dict のレコードを作り、
+登録された sink すべてに渡す。レコードの主なキー:
+
+    endpoint, model, ok, tries, queue_wait_sec, ttfb_sec, latency_sec,
+    prompt_tokens, completion_tokens, cached_tokens, image_bytes, error, ts
+    （chat はさらに prompt_template, prefix_tokens, suffix_tokens, est_cached_tokens, est_uncached_tokens）
+
+sink:
+- RingBufferSink : 直近 N 件をメモリに保持（既定で常に有効、summary() の集計元）
+- JsonlSink      : 1行1レコードで追記（HAIKU_METRICS_JSONL でパス指定すると自動登録）
+- PrometheusSink : 累計カウンタ＋直近分位点を Prometheus テキスト形式で出力
+"""
+from __future__ import annotations
+import os, json, math, time, functools, threading
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional
+
+QUANTILES = (50, 95, 99)
+
+
+# =============================
+# sink
+# =============================
+class RingBufferSink:
+    def __init__(self, maxlen: int = 2000):
+        self.records: deque = deque(maxlen=maxlen)
+        self._lock = threading.Lock()
+
+    def write(self, rec: dict) -> None:
+        with self._lock:
+            self.records.append(rec)
+
+    def snapshot(self) -> List[dict]:
+        with self._lock:
+            return list(self.records)
+
+
+class JsonlSink:
+    def __init__(self, path: str | Path):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._f = open(self.path, "a", encoding="utf-8", buffering=1)
+
+    def write(self, rec: dict) -> None:
+        line = json.dumps(rec, ensure_ascii=False, default=str) + "\n"
+        with self._lock:
+            self._f.write(line)
+
+
+_PROM_HELP = {
+    "haiku_calls_total": "Calls recorded per endpoint.",
+    "haiku_call_errors_total": "Calls that ended with an error.",
+    "haiku_prompt_tokens_total": "Prompt tokens reported by the API.",
+    "haiku_completion_tokens_total": "Completion tokens reported by the API.",
+    "haiku_cached_tokens_total": "Prompt tokens served from the provider cache.",
+    "haiku_est_cached_tokens_total": "Prompt tokens expected to hit the provider cache (estimate).",
+    "haiku_image_bytes_total": "Bytes of uploaded images.",
+    "haiku_latency_seconds": "Call latency in seconds (quantiles over the recent window).",
+    "haiku_queue_wait_seconds": "Rate-limiter wait in seconds (quantiles over the recent window).",
+    "haiku_ttfb_seconds": "Time to first streamed token in seconds (quantiles over the recent window).",
+}
+
+
+_PROM_TIMINGS = ("latency_sec", "queue_wait_sec", "ttfb_sec")
+
+def _prom_timing(field: str) -> str:
+    return f"haiku_{field.replace('_sec', '_seconds')}"
+
+
+class PrometheusSink:
+    """
+    累計（件数・エラー・トークン・画像バイト）を counter、所要時間を summary として、
+    Prometheus のテキスト形式（# HELP / # TYPE 付き）で出す。summary の quantile は直近 window 件、
+    _count / _sum はプロセス起動からの累計。
+    """
+
+    def __init__(self, window: int = 2000):
+        self._ring = RingBufferSink(window)
+        self._lock = threading.Lock()
+        self._totals: Dict[tuple, float] = {}
+        self._timings: Dict[tuple, List[float]] = {}   # (metric, endpoint) -> [count, sum]
+
+    def _inc(self, name: str, endpoint: str, value: float) -> None:
+        key = (name, endpoint)
+        self._totals[key] = self._totals.get(key, 0.0) + value
+
+    def write(self, rec: dict) -> None:
+        self._ring.write(rec)
+        ep = rec.get("endpoint", "")
+        with self._lock:
+            self._inc("haiku_calls_total", ep, 1)
+            if not rec.get("ok"):
+                self._inc("haiku_call_errors_total", ep, 1)
+            for field in ("prompt_tokens", "completion_tokens", "cached_tokens", "est_cached_tokens", "image_bytes"):
+                if rec.get(field):
+                    self._inc(f"haiku_{field}_total", ep, rec[field])
+            for field in _PROM_TIMINGS:
+                if rec.get(field) is not None:
+                    acc = self._timings.setdefault((_prom_timing(field), ep), [0, 0.0])
+                    acc[0] += 1
+                    acc[1] += rec[field]
+
+    def render(self) -> str:
+        series: Dict[str, List[str]] = {}
+        with self._lock:
+            totals = sorted(self._totals.items())
+            timings = {k: tuple(v) for k, v in self._timings.items()}
+        for (name, ep), value in totals:
+            series.setdefault(name, []).append(f'{name}{{endpoint="{ep}"}} {value:g}')
+        kinds = {name: "counter" for name in series}
+
+        by_ep: Dict[str, List[dict]] = {}
+        for r in self._ring.snapshot():
+            by_ep.setdefault(r.get("endpoint", ""), []).append(r)
+        for field in _PROM_TIMINGS:
+            metric = _prom_timing(field)
+            for ep in sorted({e for m, e in timings if m == metric}):
+                kinds[metric] = "summary"
+                lines = series.setdefault(metric, [])
+                qs = percentiles(r.get(field) for r in by_ep.get(ep, []))
+                for q in QUANTILES if qs else ():
+                    lines.append(f'{metric}{{endpoint="{ep}",quantile="{q / 100:g}"}} {qs[f"p{q}"]:.6f}')
+                count, total = timings[(metric, ep)]
+                lines.append(f'{metric}_sum{{endpoint="{ep}"}} {total:.6f}')
+                lines.append(f'{metric}_count{{endpoint="{ep}"}} {count}')
+
+        out = []
+        for name, lines in series.items():
+            out.append(f"# HELP {name} {_PROM_HELP.get(name, name)}")
+            out.append(f"# TYPE {name} {kinds[name]}")
+            out.extend(lines)
+        return "\n".join(out) + "\n"
+
+
+_sinks: List[Any] = []
+_sinks_lock = threading.Lock()
+ring = RingBufferSink()
+_sinks.append(ring)
+if os.getenv("HAIKU_METRICS_JSONL"):
+    _sinks.append(JsonlSink(os.environ["HAIKU_METRICS_JSONL"]))
+
+
+def add_sink(sink: Any) -> Any:
+    with _sinks_lock:
+        _sinks.append(sink)
+    return sink
+
+
+def remove_sink(sink: Any) -> None:
+    with _sinks_lock:
+        if sink in _sinks:
+            _sinks.remove(sink)
+
+
+# =============================
+# レコード
+# =============================
+_current: ContextVar[Optional[dict]] = ContextVar("haiku_metrics_current", default=None)
+_last: ContextVar[Optional[dict]] = ContextVar("haiku_metrics_last", default=None)
+
+
+def emit(rec: dict) -> None:
+    _last.set(rec)
+    with _sinks_lock:
+        sinks = list(_sinks)
+    for sink in sinks:
+        try:
+            sink.write(rec)
+        except Exception:
+            pass   # 計測の失敗で本処理を止めない
+
+
+def current() -> Optional[dict]:
+    """計測中のレコード（無ければ None）。"""
+    return _current.get()
+
+
+def last_record() -> Optional[dict]:
+    """現在のスレッド／タスクで直近に完了したレコード（セッション間で混ざらない）。"""
+    return _last.get()
+
+
+def note(**fields: Any) -> None:
+    """
+    実行中のレコードに値を書き足す。queue_wait_sec は加算、それ以外は上書き。
+    計測中でなければ何もしない。
+    """
+    _apply(_current.get(), fields)
+
+
+def _apply(rec: Optional[dict], fields: Dict[str, Any]) -> None:
+    if rec is None:
+        return
+    for k, v in fields.items():
+        if k == "queue_wait_sec":
+            rec[k] = round(rec.get(k, 0.0) + v, 4)
+        else:
+            rec[k] = v
+
+
+def new_record(endpoint: str, model: Optional[str] = None, **fields: Any) -> dict:
+    """timed と同じ形の空レコード（ジェネレータなど with で包めない計測を手で組み立てる用）。"""
+    return {"endpoint": endpoint, "model": model, "ok": False, "tries": 1,
+            "queue_wait_sec": 0.0, "ts": time.strftime("%Y-%m-%d %H:%M:%S"), **fields}
+
+
+@contextmanager
+def attach(rec: dict):
+    """with ブロック内の note() を rec に書き込む（emit はしない）。yield をまたいで使わないこと。"""
+    token = _current.set(rec)
+    try:
+        yield rec
+    finally:
+        _current.reset(token)
+
+
+@contextmanager
+def timed(endpoint: str, model: Optional[str] = None, **fields: Any):
+    """with ブロック全体を1レコードとして計測し、終了時に emit する。"""
+    rec = new_record(endpoint, model, **fields)
+    token = _current.set(rec)
+    start = time.perf_counter()
+    try:
+        yield rec
+        rec["ok"] = True
+    except BaseException as e:
+        rec.setdefault("error", {"type": e.__class__.__name__, "msg": str(e)})
+        raise
+    finally:
+        rec["latency_sec"] = round(time.perf_counter() - start, 4)
+        _current.reset(token)
+        emit(rec)
+
+
+def instrument(endpoint: str, model: Optional[str] = None):
+    """関数呼び出しを timed で包むデコレータ（参照句検索や X 投稿など段階ごとの計測用）。"""
+    def deco(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with timed(endpoint, model=model):
+                return fn(*args, **kwargs)
+        return wrapper
+    return deco
+
+
+def note_usage(result: Any, rec: Optional[dict] = None) -> None:
+    """OpenAI の応答に usage があればトークン数をレコード（省略時は実行中のもの）に書く。"""
+    usage = getattr(result, "usage", None)
+    if usage is not None:
+        details = getattr(usage, "prompt_tokens_details", None)
+        _apply(rec if rec is not None else _current.get(),
+               {"prompt_tokens": getattr(usage, "prompt_tokens", None),
+                "completion_tokens": getattr(usage, "completion_tokens", None),
+                "cached_tokens": getattr(details, "cached_tokens", None)})
+
+
+# =============================
+# 集計
+# =============================
+def percentiles(values: Iterable[float], qs: Iterable[int] = QUANTILES) -> Dict[str, float]:
+    vals = sorted(v for v in values if v is not None)
+    if not vals:
+        return {}
+    out = {}
+    for q in qs:
+        # nearest-rank 法
+        idx = min(len(vals) - 1, max(0, math.ceil(q / 100 * len(vals)) - 1))
+        out[f"p{q}"] = vals[idx]
+    return out
+
+
+def summary(records: Optional[List[dict]] = None) -> Dict[str, dict]:
+    """endpoint ごとの件数・エラー数と、latency / queue_wait / ttfb の p50/p95/p99（chat はトークン内訳も）。"""
+    records = ring.snapshot() if records is None else records
+    by_ep: Dict[str, List[dict]] = {}
+    for r in records:
+        by_ep.setdefault(r.get("endpoint", ""), []).append(r)
+    out = {}
+    for ep, recs in sorted(by_ep.items()):
+        out[ep] = {
+            "count": len(recs),
+            "errors": sum(1 for r in recs if not r.get("ok")),
+            **{f: percentiles(r.get(f) for r in recs) for f in ("latency_sec", "queue_wait_sec", "ttfb_sec")},
+        }
+        # プロンプトキャッシュ: 推定（固定プレフィックス由来）と、API が返した実績の合計
+        if any("prefix_tokens" in r for r in recs):
+            out[ep]["prompt_cache"] = {f: sum(r.get(f) or 0 for r in recs) for f in (
+                "prompt_tokens", "cached_tokens", "est_cached_tokens", "est_uncached_tokens")}
+    return out
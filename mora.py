@@ -0,0 +1,81 @@
+"""
+俳句のモーラ（音）数を数え、5-7-5 を検査する。
+
+数え方はプロンプト・CSV の「読み」列と同じ:
+- 仮名1文字 = 1モーラ。ただし拗音・小書きの ゃゅょぁぃぅぇぉゎ は前の文字と合わせて1モーラ
+- っ・ん・ー はそれぞれ1モーラ
+- 読みはひらがな（カタカナも可）で、句切れは空白（半角・全角）
+
+漢字を含む句はそのままでは数えられないため、読み（reading_ja）を使う。
+読みが無く pykakasi が入っていれば、それで仮名に変換して数える。
+"""
+from __future__ import annotations
+import re, functools
+from typing import List, Optional
+
+PATTERN = (5, 7, 5)
+
+_SMALL = set("ゃゅょぁぃぅぇぉゎャュョァィゥェォヮ")
+_KANA = re.compile(r"[ぁ-ゖゝゞァ-ヺー]")
+_KANJI = re.compile(r"[㐀-鿿々〆ヵヶ]")
+
+
+def to_hiragana(text: str) -> str:
+    return "".join(chr(ord(ch) - 0x60) if "ァ" <= ch <= "ヶ" else ch for ch in text)
+
+
+def count_mora(kana: str) -> int:
+    """仮名文字列のモーラ数（仮名以外の文字は数えない）。"""
+    return sum(1 for ch in kana if _KANA.match(ch) and ch not in _SMALL)
+
+
+def split_ku(text: str) -> List[str]:
+    """空白・改行で区切られた句（上五・中七・下五）に分ける。"""
+    return [p for p in re.split(r"[\s　/／]+", text.strip()) if p]
+
+
+@functools.lru_cache(maxsize=1)
+def _kakasi():
+    try:
+        import pykakasi
+        return pykakasi.kakasi()
+    except Exception:
+        return None
+
+
+def reading_of(haiku_ja: str, reading: Optional[str] = None) -> Optional[str]:
+    """
+    モーラを数えるための読み。reading があればそれを、句が仮名だけならそのまま、
+    漢字を含むときは pykakasi（任意依存）で変換する。読めなければ None。
+    """
+    if reading and reading.strip():
+        return reading
+    if not _KANJI.search(haiku_ja):
+        return haiku_ja
+    kks = _kakasi()
+    if kks is None:
+        return None
+    return " ".join("".join(t["hira"] for t in kks.convert(ku)) for ku in split_ku(haiku_ja))
+
+
+def check_575(haiku_ja: str, reading: Optional[str] = None) -> dict:
+    """
+    5-7-5 の検査結果を返す:
+      ok        : True / False（読みが得られず検査できなければ None）
+      counts    : 句ごとのモーラ数
+      bad_lines : 5-7-5 から外れた句の位置（0始まり）
+    句切れが3つでなければ、全体のモーラ数が17かどうかだけを見る。
+    """
+    kana = reading_of(haiku_ja, reading)
+    if kana is None:
+        return {"ok": None, "counts": [], "bad_lines": [], "reading": None}
+    kana = to_hiragana(kana)
+    parts = split_ku(kana)
+    counts = [count_mora(p) for p in parts]
+    if len(counts) == len(PATTERN):
+        bad = [i for i, (c, want) in enumerate(zip(counts, PATTERN)) if c != want]
+        ok = not bad
+    else:
+        ok = sum(counts) == sum(PATTERN)
+        bad = [] if ok else list(range(len(PATTERN)))
+    return {"ok": ok, "counts": counts, "bad_lines": bad, "reading": kana}
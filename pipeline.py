@@ -0,0 +1,61 @@
+"""
+俳句確定後に「画像生成」と「英語ブロック生成」を先回りして並行実行するパイプライン。
+
+app.py のまとめて生成モードで使う。結果は Future として保持し、
+②③の表示時に受け取る（両方を待っても max(画像, 英訳) の時間で済む）。
+"""
+from __future__ import annotations
+import os, contextvars
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Dict, Optional
+
+_executor = ThreadPoolExecutor(
+    max_workers=int(os.getenv("HAIKU_PIPELINE_WORKERS", 8)),
+    thread_name_prefix="haiku-pipeline",
+)
+
+
+class PipelineJob:
+    """1回の俳句生成に対応する先行ジョブ群（"image" / "english"）。"""
+
+    def __init__(self, futures: Dict[str, Future], haiku_ja: str):
+        self.futures = futures
+        self.haiku_ja = haiku_ja
+        self.cancelled = False
+
+    def done(self, name: str) -> bool:
+        f = self.futures.get(name)
+        return f is not None and f.done()
+
+    def result(self, name: str, timeout: Optional[float] = None) -> Any:
+        """結果を待って返す。キャンセル済み・失敗時は例外を送出。"""
+        return self.futures[name].result(timeout=timeout)
+
+    def take(self, name: str, timeout: Optional[float] = None) -> Any:
+        """結果を一度だけ受け取る（受け取り後は futures から外れ、次回は通常生成になる）。"""
+        f = self.futures.pop(name, None)
+        return None if f is None else f.result(timeout=timeout)
+
+    def cancel(self) -> None:
+        """
+        未着手のジョブは取り消す。実行中の API 呼び出しは止められないため、
+        結果を使わないようフラグを立てるだけ（完了後に破棄される）。
+        """
+        self.cancelled = True
+        for f in self.futures.values():
+            f.cancel()
+        self.futures.clear()
+
+
+def start_pipeline(image_prompt: str, haiku_ja: str, explanation_ja: str,
+                   size: str = "1024x1024") -> PipelineJob:
+    from image_gen import generate_image
+    from haiku_gpt import generate_english_tweet_block
+
+    # 呼び出し元の contextvars（ログの session_id など）をワーカースレッドへ引き継ぐ
+    futures = {
+        "image": _executor.submit(contextvars.copy_context().run, generate_image, image_prompt, size=size),
+        "english": _executor.submit(contextvars.copy_context().run,
+                                    generate_english_tweet_block, haiku_ja, explanation_ja),
+    }
+    return PipelineJob(futures, haiku_ja)
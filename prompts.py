@@ -0,0 +1,167 @@
+"""
+プロンプトを「固定プレフィックス＋可変サフィックス」の形で定義するテンプレート集。
+
+OpenAI のプロンプトキャッシュは、先頭 1024 トークン以上がバイト単位で一致する呼び出しに
+128 トークン刻みで効く。指示・ルールなど毎回同じ部分はモジュール定数の固定プレフィックスにまとめて
+先頭に置き、入力ごとに変わる部分（条件・参照句・俳句本文）は必ずその後ろのサフィックスに入れる。
+
+- PromptTemplate.messages(**vars) : system=固定プレフィックス, user=サフィックス
+- count_tokens                    : tiktoken があれば正確に、無ければ文字種から概算
+- PromptTemplate.report(**vars)   : prefix / suffix のトークン数とキャッシュ見込み（metrics に載せる）
+"""
+from __future__ import annotations
+import re, functools
+from typing import Dict
+
+CACHE_MIN_TOKENS = 1024
+CACHE_INCREMENT = 128
+
+
+@functools.lru_cache(maxsize=1)
+def _encoder():
+    try:
+        import tiktoken
+        return tiktoken.get_encoding("o200k_base")
+    except Exception:
+        return None
+
+
+_WIDE = re.compile(r"[\u3000-\u9fff\uff00-\uffef]")
+
+@functools.lru_cache(maxsize=256)
+def count_tokens(text: str) -> int:
+    """
+    トークン数。tiktoken（o200k_base）が無い環境では、日本語は1文字≒1トークン、
+    それ以外は4文字≒1トークンとして概算する。
+    """
+    enc = _encoder()
+    if enc is not None:
+        return len(enc.encode(text))
+    wide = len(_WIDE.findall(text))
+    return wide + (len(text) - wide + 3) // 4
+
+
+def estimate_cached_tokens(prefix_tokens: int) -> int:
+    """固定プレフィックスのうちプロバイダ側キャッシュに乗る見込みのトークン数。"""
+    if prefix_tokens < CACHE_MIN_TOKENS:
+        return 0
+    return prefix_tokens // CACHE_INCREMENT * CACHE_INCREMENT
+
+
+class PromptTemplate:
+    """prefix は一切整形しない固定文字列、suffix は str.format で埋めるテンプレート。"""
+
+    def __init__(self, name: str, prefix: str, suffix: str):
+        self.name = name
+        self.prefix = prefix
+        self.suffix = suffix
+
+    def render(self, **vars) -> str:
+        return self.suffix.format(**vars)
+
+    def messages(self, **vars) -> list:
+        return [{"role": "system", "content": self.prefix},
+                {"role": "user", "content": self.render(**vars)}]
+
+    def report(self, suffix_text: str) -> Dict[str, int | str]:
+        """1回分の prefix / suffix トークン数と、キャッシュされる見込み（推定）。"""
+        prefix_tokens = count_tokens(self.prefix)
+        suffix_tokens = count_tokens(suffix_text)
+        cached = estimate_cached_tokens(prefix_tokens)
+        return {
+            "prompt_template": self.name,
+            "prefix_tokens": prefix_tokens,
+            "suffix_tokens": suffix_tokens,
+            "est_cached_tokens": cached,
+            "est_uncached_tokens": prefix_tokens + suffix_tokens - cached,
+        }
+
+
+# =============================
+# 俳句生成（call_gpt_haiku）
+# =============================
+HAIKU_PROMPT = PromptTemplate("haiku", """あなたは「小林一茶 × 新作俳句 × 参照句運用」の専門家です。
+以下のJSONだけを出力してください（余文・解説・前置き禁止）：
+{
+  "haiku_ja": "五七五の新作（日本語）",
+  "reading_ja": "haiku_ja の読み（現代仮名遣いのひらがな。5音 7音 5音を半角スペースで区切る）",
+  "explanation_ja": "日本語の意訳・背景（100-200字）",
+  "reasons_refs_ja": "結論ファースト1文＋改行＋(1)(2)(3)をMarkdown箇条書き形式（- (1) ... の形）で出力する。形式例:『【結論】...\\n- (1) ...\\n- (2) ...\\n- (3) ...』"
+  "references_numbered": "1. 〇〇 | 出典: △△ (年)\\n2. 〇〇 | 出典: △△ (年)\\n3. 〇〇 | 出典: △△ (年)"
+}
+厳守事項：
+- 必ず命を懸けて5音・7音・5音の構成にする（合計17モーラ）
+- 5音 7音 5音とスペースで5音 7音 5音を区切って表示する
+- モーラ数は、ゃゅょ→1モーラ、っ→1モーラ、ん→1モーラ、長音（ー）→1モーラとして数える
+- 記号・英語・ルビ・句読点・解説は出力しない（俳句のみ）
+- 文末は名詞・体言止め可、助詞で終わっても良い
+-自己チェックを以下3点実行してください
+1) ひらがなに内部変換してモーラを数える（出力には見せない）
+2) 5-7-5になっていなければ即座に言い換えて再生成
+3) 最終出力は俳句3行のみ
+- 自然と感情をテーマにする
+- 選択された感情（plutchik）と日本的情緒（aesthetic）を句の内容または語感に必ず反映すること。   
+- 必ず参照句を活用して新作俳句を作成してください
+- 小林一茶らしさである、擬音語活用については参照句をして生かしてください。
+- 小動物への愛についても参照句を生かしてください。
+- 参照句の文末を似せてください。
+- 参照句(1)(2)(3)の具体要素（語／音象徴／構図）を最低1つずつ反映すること
+- JSON以外は出力しない。
+- 「理由」は“参照俳句の選定理由”。文頭を『この句は』で始めない。
+- 「reasons_refs_ja」は必ず『【結論】』で始め、次行以降に(1)(2)(3)を改行で並べる。
+- 各(1)(2)(3)では、参照句の具体要素（構造/リズム/テーマ/語感 等）と、新作への変奏を簡潔に述べる。
+- **参照句に擬音語（繰り返し表現 🎵）が含まれる場合、そのリズムや響きを新作でどう活かしたかを必ず書く。**
+- 「意訳」は俳句の情景と感情のみ（参照句の話は書かない）。日本的情緒を1つ以上含める。
+- 固有名詞や現代語過多を避け、一茶らしい素朴さと生命へのまなざしを重視。
+
+""", """入力条件：
+season = {season}
+plutchik = {plutchik}
+aesthetic = {aesthetic}
+keyword = {keyword}
+experience = {experience}
+
+参照俳句（必ず(1)(2)(3)で言及）:
+{refs_numbered}
+""")
+
+
+# =============================
+# 音数の修正（5-7-5 検査に落ちた句だけを直す短い依頼）
+# =============================
+REPAIR_PROMPT = PromptTemplate("repair", """あなたは俳句の音数（モーラ）を整える校正者です。
+指定された句だけを言い換えて、全体を5音・7音・5音にしてください。
+- 意味・季語・情景・語感はできるだけ保ち、指定されていない句は変えない
+- モーラは、ゃゅょ等の小書きは前の文字と合わせて1、っ・ん・ー は各1として数える
+以下のJSONだけを出力してください：
+{"haiku_ja": "修正後の俳句（5音 7音 5音を半角スペースで区切る）", "reading_ja": "その読み（ひらがな、半角スペース区切り）"}
+""", """俳句: {haiku_ja}
+読み: {reading}
+数えたモーラ: {counts}（正しくは 5 / 7 / 5）
+直す句: {lines}
+""")
+
+
+# =============================
+# 英語ブロック（generate_english_tweet_block）
+# =============================
+ENGLISH_PROMPT = PromptTemplate("english", """あなたは「俳句英訳 × X（Twitter）投稿整形」の専門家です。
+次の4ブロックだけを出力：
+🌿 俳句（日本語）
+
+{haiku_ja}
+
+🍃 Haiku (English)
+
+{haiku_en_3lines}
+
+✨ Explanation
+
+{explanation_en_short}
+
+制約：合計280字以内。英訳は3行、説明は1-2文。絵文字は🌿🍃✨のみ。""", """俳句（日本語）:
+{haiku_ja}
+
+俳句の説明（日本語の意訳/背景の要点）:
+{explanation_ja}
+""")
@@ -0,0 +1,179 @@
+"""
+OpenAI 呼び出し用のクライアント側レートリミッタ（トークンバケット）。
+
+429 を受けてから待つのではなく、呼び出し前に RPM（リクエスト/分）と TPM（トークン/分）の
+バケットから取り出して送信ペースを上限内に保つ。chat と image は別バケット。
+
+- 既定はプロセス内（スレッド間）で共有
+- HAIKU_RATE_LIMIT_DB を指定すると SQLite 上のバケットを使い、同一ホストの複数プロセスで共有
+
+上限は環境変数で調整する:
+    HAIKU_CHAT_RPM (500) / HAIKU_CHAT_TPM (200000) / HAIKU_IMAGE_RPM (20)
+"""
+from __future__ import annotations
+import os, time, asyncio, sqlite3, threading
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+import metrics
+
+
+class TokenBucket:
+    """capacity 個まで貯まり、毎秒 rate 個ずつ補充されるバケット（スレッドセーフ）。"""
+
+    def __init__(self, capacity: float, rate: float):
+        self.capacity = float(capacity)
+        self.rate = float(rate)
+        self._tokens = float(capacity)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def try_acquire(self, n: float) -> float:
+        """取り出せたら 0、足りなければ必要な待ち秒数を返す（その場合は何も消費しない）。"""
+        n = min(n, self.capacity)
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            if self._tokens >= n:
+                self._tokens -= n
+                return 0.0
+            return (n - self._tokens) / self.rate
+
+
+class SqliteTokenBucket:
+    """TokenBucket と同じ振る舞いを SQLite のトランザクションで複数プロセス間に共有する版。"""
+
+    def __init__(self, path: str, name: str, capacity: float, rate: float):
+        self.name = name
+        self.capacity = float(capacity)
+        self.rate = float(rate)
+        self._local = threading.local()
+        self._path = path
+        conn = self._conn()
+        conn.execute("""CREATE TABLE IF NOT EXISTS buckets (
+            name TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL)""")
+        conn.execute("INSERT OR IGNORE INTO buckets VALUES (?,?,?)", (name, self.capacity, time.time()))
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = sqlite3.connect(self._path, timeout=30, isolation_level=None)
+        return conn
+
+    def try_acquire(self, n: float) -> float:
+        n = min(n, self.capacity)
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")   # 書込ロックを取ってから読む（プロセス間で直列化）
+        try:
+            tokens, updated = conn.execute(
+                "SELECT tokens, updated FROM buckets WHERE name=?", (self.name,)).fetchone()
+            now = time.time()
+            tokens = min(self.capacity, tokens + max(0.0, now - updated) * self.rate)
+            wait = 0.0
+            if tokens >= n:
+                tokens -= n
+            else:
+                wait = (n - tokens) / self.rate
+            conn.execute("UPDATE buckets SET tokens=?, updated=? WHERE name=?", (tokens, now, self.name))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return wait
+
+
+class RateLimiter:
+    """1エンドポイント分の RPM（＋任意で TPM）バケットの組。"""
+
+    def __init__(self, name: str, rpm: float, tpm: Optional[float] = None, db_path: Optional[str] = None):
+        def _bucket(suffix: str, per_min: float):
+            if db_path:
+                return SqliteTokenBucket(db_path, f"{name}:{suffix}", per_min, per_min / 60.0)
+            return TokenBucket(per_min, per_min / 60.0)
+
+        self.name = name
+        self.requests = _bucket("rpm", rpm)
+        self.tokens = _bucket("tpm", tpm) if tpm else None
+
+    def _plan(self, tokens: int) -> list:
+        plan = [(self.requests, 1)]
+        if self.tokens is not None and tokens:
+            plan.append((self.tokens, tokens))
+        return plan
+
+    def acquire(self, tokens: int = 0) -> float:
+        """RPM → TPM の順に枠が空くまで待つ（ブロッキング）。待った秒数を返す。"""
+        waited = 0.0
+        for bucket, n in self._plan(tokens):
+            while True:
+                wait = bucket.try_acquire(n)
+                if not wait:
+                    break
+                time.sleep(wait)
+                waited += wait
+        return waited
+
+    async def acquire_async(self, tokens: int = 0) -> float:
+        """acquire の asyncio 版（asyncio.sleep で待つ）。"""
+        waited = 0.0
+        for bucket, n in self._plan(tokens):
+            while True:
+                wait = bucket.try_acquire(n)
+                if not wait:
+                    break
+                await asyncio.sleep(wait)
+                waited += wait
+        return waited
+
+
+_limiters: Dict[str, RateLimiter] = {}
+_limiters_lock = threading.Lock()
+
+def get_limiter(kind: str) -> RateLimiter:
+    """"chat" / "image" のプロセス共有リミッタ。"""
+    with _limiters_lock:
+        lim = _limiters.get(kind)
+        if lim is None:
+            db = os.getenv("HAIKU_RATE_LIMIT_DB") or None
+            if kind == "image":
+                lim = RateLimiter("image", float(os.getenv("HAIKU_IMAGE_RPM", 20)), db_path=db)
+            else:
+                lim = RateLimiter(kind, float(os.getenv("HAIKU_CHAT_RPM", 500)),
+                                  float(os.getenv("HAIKU_CHAT_TPM", 200_000)), db_path=db)
+            _limiters[kind] = lim
+    return lim
+
+
+def estimate_chat_tokens(messages: list, max_completion: int = 800) -> int:
+    """
+    TPM 用の概算トークン数。日本語は概ね1文字≒1トークンなので文字数で近似し、
+    応答分として max_completion を足す。
+    """
+    return sum(len(str(m.get("content", ""))) for m in messages) + max_completion
+
+
+def limited(kind: str, fn: Callable[[], Any], tokens: int = 0) -> Callable[[], Any]:
+    """fn を呼ぶ前に kind のリミッタで枠を確保するラッパ（_retry_call の各試行ごとに効く）。"""
+    def _call():
+        metrics.note(queue_wait_sec=get_limiter(kind).acquire(tokens))
+        return fn()
+    return _call
+
+
+class AsyncLimited:
+    """
+    alimited の返り値。呼ぶと kind のリミッタで枠を確保してから fn を実行する。
+    timeout は fn（API 呼び出し）にだけ掛け、枠待ちの時間は含めない。
+    """
+
+    def __init__(self, kind: str, fn: Callable[[], Awaitable[Any]], tokens: int = 0):
+        self.kind, self.fn, self.tokens = kind, fn, tokens
+
+    async def __call__(self, timeout: Optional[float] = None) -> Any:
+        metrics.note(queue_wait_sec=await get_limiter(self.kind).acquire_async(self.tokens))
+        return await asyncio.wait_for(self.fn(), timeout) if timeout else await self.fn()
+
+
+def alimited(kind: str, fn: Callable[[], Awaitable[Any]], tokens: int = 0) -> AsyncLimited:
+    """limited の asyncio 版。"""
+    return AsyncLimited(kind, fn, tokens)
@@ -0,0 +1,100 @@
+"""
+LLM 応答の永続キャッシュ（SQLite、TTL＋LRU 件数上限）。
+
+キーは「名前空間＋入力（payload・model・temperature など）」の正規化 JSON の sha256。
+同じ条件での再読込・再試行・デモ用の共有プロンプトで API 呼び出しを省く。
+
+環境変数:
+- HAIKU_CACHE_PATH     : DB ファイル（既定 outputs/cache/responses.sqlite3）
+- HAIKU_CACHE_TTL_SEC  : 有効期限（秒、既定 7日）
+- HAIKU_CACHE_MAX      : 最大件数（超過分は最終アクセスが古い順に削除、既定 5000）
+- HAIKU_CACHE_DISABLE  : "1" でキャッシュ無効
+"""
+from __future__ import annotations
+import os, json, time, sqlite3, hashlib, threading, unicodedata
+from pathlib import Path
+from typing import Any, Optional
+
+
+def _normalize(obj: Any) -> Any:
+    """キー計算用に値を正規化（文字列は NFKC＋前後空白除去、dict はキー順固定）。"""
+    if isinstance(obj, str):
+        return unicodedata.normalize("NFKC", obj).strip()
+    if isinstance(obj, dict):
+        return {str(k): _normalize(v) for k, v in sorted(obj.items(), key=lambda kv: str(kv[0]))}
+    if isinstance(obj, (list, tuple)):
+        return [_normalize(v) for v in obj]
+    return obj
+
+
+def make_key(namespace: str, **parts: Any) -> str:
+    canon = json.dumps({"ns": namespace, **_normalize(parts)}, ensure_ascii=False,
+                       sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(canon.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    def __init__(self, path: str | Path, ttl_sec: float = 7 * 24 * 3600, max_entries: int = 5000):
+        self.path = Path(path)
+        self.ttl_sec = ttl_sec
+        self.max_entries = max_entries
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.path), timeout=10, check_same_thread=False,
+                                     isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""CREATE TABLE IF NOT EXISTS responses (
+            key TEXT PRIMARY KEY,
+            value TEXT NOT NULL,
+            created_at REAL NOT NULL,
+            accessed_at REAL NOT NULL)""")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_responses_accessed ON responses(accessed_at)")
+
+    def get(self, key: str) -> Optional[Any]:
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute("SELECT value, created_at FROM responses WHERE key=?", (key,)).fetchone()
+            if row is None:
+                return None
+            if now - row[1] > self.ttl_sec:
+                self._conn.execute("DELETE FROM responses WHERE key=?", (key,))
+                return None
+            self._conn.execute("UPDATE responses SET accessed_at=? WHERE key=?", (now, key))
+        return json.loads(row[0])
+
+    def set(self, key: str, value: Any) -> None:
+        now = time.time()
+        blob = json.dumps(value, ensure_ascii=False)
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO responses VALUES (?,?,?,?)", (key, blob, now, now))
+            self._conn.execute("DELETE FROM responses WHERE created_at < ?", (now - self.ttl_sec,))
+            self._conn.execute(
+                """DELETE FROM responses WHERE key IN (
+                       SELECT key FROM responses ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)""",
+                (self.max_entries,),
+            )
+
+    def clear(self) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM responses")
+
+
+_cache: Optional[ResponseCache] = None
+_cache_lock = threading.Lock()
+
+def get_cache() -> Optional[ResponseCache]:
+    """プロセス共有のキャッシュ。無効化されているか開けない場合は None。"""
+    global _cache
+    if os.getenv("HAIKU_CACHE_DISABLE") == "1":
+        return None
+    with _cache_lock:
+        if _cache is None:
+            try:
+                _cache = ResponseCache(
+                    os.getenv("HAIKU_CACHE_PATH", "outputs/cache/responses.sqlite3"),
+                    ttl_sec=float(os.getenv("HAIKU_CACHE_TTL_SEC", 7 * 24 * 3600)),
+                    max_entries=int(os.getenv("HAIKU_CACHE_MAX", 5000)),
+                )
+            except (sqlite3.Error, OSError):
+                return None
+    return _cache
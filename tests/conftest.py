@@ -0,0 +1,10 @@
+"""
+テスト共通設定。モジュールはリポジトリ直下に平置きなので、そこを import パスに足す。
+ログは一時ディレクトリに出し、outputs/ を汚さない。
+"""
+import os, sys, tempfile
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+os.environ.setdefault("HAIKU_LOG_DIR", tempfile.mkdtemp(prefix="haiku-test-logs-"))
+os.environ.setdefault("HAIKU_LOG_CONSOLE", "0")
@@ -0,0 +1,75 @@
+import threading
+from datetime import datetime
+
+from artifact_store import ArtifactStore, LocalBackend, location_exists, make_key, read_location
+
+
+class GatedBackend(LocalBackend):
+    """put() を gate が開くまで止める（書込み待ち中の振る舞いを見るため）。"""
+
+    def __init__(self, root):
+        super().__init__(root)
+        self.gate = threading.Event()
+        self.puts = []
+
+    def put(self, key, data):
+        self.gate.wait(5)
+        self.puts.append((key, data))
+        super().put(key, data)
+
+
+def test_get_returns_pending_bytes_before_write(tmp_path):
+    backend = GatedBackend(tmp_path)
+    store = ArtifactStore(backend)
+    key, fut = store.put(b"image-bytes", "png")
+    assert not fut.done()
+    assert not backend.exists(key)
+    assert store.get(key) == b"image-bytes"
+    backend.gate.set()
+    assert fut.result(timeout=5) == key
+    assert store.get(key) == b"image-bytes"
+    assert (tmp_path / key).read_bytes() == b"image-bytes"
+
+
+def test_put_is_content_addressed_and_deduplicated(tmp_path):
+    backend = GatedBackend(tmp_path)
+    store = ArtifactStore(backend)
+    when = datetime(2026, 10, 17)
+    key1, fut1 = store.put(b"same", "png", when)
+    key2, fut2 = store.put(b"same", "png", when)
+    assert key1 == key2 and fut1 is fut2
+    assert key1.startswith("2026/10/17/") and key1.endswith(".png")
+    backend.gate.set()
+    store.flush()
+    assert len(backend.puts) == 1
+
+    key3, _ = store.put(b"same", "png", when)          # 書込み済みの内容は書き直さない
+    store.flush()
+    assert key3 == key1 and len(backend.puts) == 1
+
+
+def test_put_key_keeps_latest_payload_while_in_flight(tmp_path):
+    backend = GatedBackend(tmp_path)
+    store = ArtifactStore(backend)
+    first = store.put_key("meta.json", b"v1")
+    second = store.put_key("meta.json", b"v2")
+    assert store.put_key("meta.json", b"v2") is second
+    assert first is not second
+    assert store.get("meta.json") == b"v2"
+    backend.gate.set()
+    store.flush()
+    assert (tmp_path / "meta.json").read_bytes() == b"v2"
+    assert store._pending == {}
+
+
+def test_make_key_spreads_by_date_and_hash_prefix():
+    assert make_key("abcdef", ".webp", datetime(2026, 1, 2)) == "2026/01/02/ab/abcdef.webp"
+
+
+def test_local_locations_round_trip(tmp_path):
+    store = ArtifactStore(LocalBackend(tmp_path))
+    key, fut = store.put(b"data", "json")
+    fut.result(timeout=5)
+    loc = store.locate(key)
+    assert location_exists(loc) and read_location(loc) == b"data"
+    assert not location_exists(str(tmp_path / "missing.png"))
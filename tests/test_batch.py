@@ -0,0 +1,83 @@
+import json
+from pathlib import Path
+
+from batch import Checkpoint, load_jobs
+
+ROOT = Path(__file__).resolve().parents[1]
+
+
+def _write_jsonl(path, rows):
+    path.write_text("".join(json.dumps(r, ensure_ascii=False) + "\n" for r in rows), encoding="utf-8")
+
+
+def test_load_jobs_ids_distinct_for_identical_rows(tmp_path):
+    path = tmp_path / "jobs.jsonl"
+    row = {"season": "秋", "keyword": "月"}
+    _write_jsonl(path, [row, row])
+    ids = [j["id"] for j in load_jobs(path)]
+    assert len(set(ids)) == 2
+
+
+def test_load_jobs_ids_stable_across_loads(tmp_path):
+    path = tmp_path / "jobs.jsonl"
+    _write_jsonl(path, [{"season": "春"}, {"season": "夏"}])
+    assert [j["id"] for j in load_jobs(path)] == [j["id"] for j in load_jobs(path)]
+
+
+def test_load_jobs_keeps_explicit_id_and_reads_csv(tmp_path):
+    path = tmp_path / "jobs.csv"
+    path.write_text("id,season,keyword\nmy-job,冬,雪\n,冬,雪\n", encoding="utf-8-sig")
+    jobs = load_jobs(path)
+    assert jobs[0]["id"] == "my-job"
+    assert jobs[1]["id"] and jobs[1]["id"] != "my-job"
+    assert jobs[1]["season"] == "冬"
+
+
+def test_checkpoint_resume_skips_only_done(tmp_path):
+    path = tmp_path / "checkpoint.jsonl"
+    ckpt = Checkpoint(path)
+    ckpt.record({"id": "a", "status": "done"})
+    ckpt.record({"id": "b", "status": "failed"})
+    with open(path, "a", encoding="utf-8") as f:
+        f.write('{"id": "c", "status": "do')   # クラッシュ時の書きかけ行
+
+    resumed = Checkpoint(path)
+    assert resumed.done == {"a"}
+    resumed.record({"id": "b", "status": "done"})
+    assert Checkpoint(path).done == {"a", "b"}
+
+
+def test_run_batch_resume_skips_finished_jobs(tmp_path, monkeypatch):
+    from PIL import Image
+
+    import haiku_gpt
+    import image_gen
+    from batch import run_batch
+
+    corpus = tmp_path / "corpus.csv"
+    with open(ROOT / "haiku_with_repetition.csv", encoding="utf-8-sig") as f:
+        corpus.write_text("".join(line for _, line in zip(range(200), f)), encoding="utf-8-sig")
+    monkeypatch.setenv("HAIKU_CORPUS_CACHE", str(tmp_path / "cache"))
+
+    calls = []
+    def fake_haiku(payload, **kwargs):
+        calls.append(payload)
+        return {"haiku_ja": "秋の暮 一人歩きの 長き影", "reading_ja": "", "explanation_ja": "説明"}
+    colors = iter(range(1, 100))
+    monkeypatch.setattr(haiku_gpt, "call_gpt_haiku", fake_haiku)
+    monkeypatch.setattr(image_gen, "generate_image", lambda prompt, size="1024x1024": image_gen.ImageArtifact.from_image(
+        Image.new("RGB", (64, 64), (next(colors), 0, 0))))
+
+    path = tmp_path / "jobs.jsonl"
+    _write_jsonl(path, [{"season": "秋", "keyword": "月"}, {"season": "冬", "keyword": "雪"}])
+    jobs = load_jobs(path)
+    out = tmp_path / "out"
+
+    first = run_batch(jobs, str(corpus), out, concurrency=2)
+    assert first == {"skipped": 0, "done": 2, "failed": 0}
+    assert Checkpoint(out / "checkpoint.jsonl").done == {j["id"] for j in jobs}
+
+    second = run_batch(load_jobs(path), str(corpus), out, concurrency=2)
+    assert second["skipped"] == len(jobs)
+    assert len(calls) == 2
+    assert {c["aesthetic"] for c in calls} == {"スキップ"}   # 未指定は画面の「スキップ」と同じ扱い
@@ -0,0 +1,60 @@
+import json
+
+import pytest
+
+from haiku_gpt import _JsonFieldStream
+
+DOC = json.dumps({
+    "haiku_ja": "秋の暮 \"一人\" 歩きの\n長き影",
+    "reading_ja": "あきのくれ ひとりあるきの ながきかげ",
+    "meta": {"haiku_ja": "入れ子は無視", "n": [1, 2, {"x": "y"}]},
+    "score": 0.8,
+    "explanation_ja": "カンマ, コロン: 波括弧 {} 角括弧 [] \\ バックスラッシュ é",
+    "reasons_refs_ja": ["配列の中の文字列", "も無視"],
+    "references_numbered": "1. 句",
+}, ensure_ascii=False, indent=1)
+
+EXPECTED = [
+    ("haiku_ja", "秋の暮 \"一人\" 歩きの\n長き影"),
+    ("reading_ja", "あきのくれ ひとりあるきの ながきかげ"),
+    ("explanation_ja", "カンマ, コロン: 波括弧 {} 角括弧 [] \\ バックスラッシュ é"),
+    ("references_numbered", "1. 句"),
+]
+
+
+def _feed(chunks):
+    parser = _JsonFieldStream()
+    out = []
+    for chunk in chunks:
+        out.extend(parser.feed(chunk))
+    return parser, out
+
+
+def test_json_field_stream_whole_document():
+    parser, out = _feed([DOC])
+    assert out == EXPECTED
+    assert parser.buf == DOC
+
+
+@pytest.mark.parametrize("size", [1, 2, 3, 7, 16])
+def test_json_field_stream_fixed_size_chunks(size):
+    _, out = _feed([DOC[i:i + size] for i in range(0, len(DOC), size)])
+    assert out == EXPECTED
+
+
+def test_json_field_stream_every_split_point():
+    for cut in range(1, len(DOC)):
+        _, out = _feed([DOC[:cut], DOC[cut:]])
+        assert out == EXPECTED, cut
+
+
+def test_json_field_stream_emits_field_as_soon_as_it_closes():
+    parser = _JsonFieldStream()
+    assert parser.feed('{"haiku_ja": "古池') == []
+    assert parser.feed('や"') == [("haiku_ja", "古池や")]
+    assert parser.feed(', "explanation_ja": "') == []
+
+
+def test_json_field_stream_escaped_quote_split_across_chunks():
+    _, out = _feed(['{"haiku_ja": "a\\', '"b"}'])
+    assert out == [("haiku_ja", 'a"b')]
@@ -0,0 +1,91 @@
+import re
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from haiku_index import FacetIndex, NgramIndex
+
+CORPUS = Path(__file__).resolve().parents[1] / "haiku_with_repetition.csv"
+
+
+@pytest.fixture(scope="module")
+def corpus_df():
+    return pd.read_csv(CORPUS, encoding="utf-8-sig")
+
+
+@pytest.fixture(scope="module")
+def ngram_index(corpus_df):
+    return NgramIndex.from_df(corpus_df)
+
+
+def _baseline_rows(df, terms):
+    """以前の pick_references の絞り込み（正規表現の OR を3列それぞれに str.contains）。"""
+    pattern = "|".join(map(re.escape, terms))
+    mask = (df["俳句"].astype(str).str.contains(pattern, na=False) |
+            df["読み"].astype(str).str.contains(pattern, na=False) |
+            df["季語候補"].astype(str).str.contains(pattern, na=False))
+    return np.flatnonzero(mask.to_numpy())
+
+
+@pytest.mark.parametrize("terms", [
+    ["月"], ["雪", "ゆき"], ["かさり"], ["蛙", "かわず", "かはづ"], ["木の芽"],
+    ["ほととぎす", "時鳥"], ["秋の暮"], ["存在しない語句"], ["～"],
+])
+def test_ngram_index_matches_str_contains(corpus_df, ngram_index, terms):
+    assert ngram_index.search(terms).tolist() == _baseline_rows(corpus_df, terms).tolist()
+
+
+def test_ngram_index_matches_str_contains_on_sampled_substrings(corpus_df, ngram_index):
+    rng = np.random.default_rng(0)
+    texts = corpus_df["俳句"].dropna().astype(str).tolist()
+    for _ in range(50):
+        text = texts[rng.integers(len(texts))]
+        start = int(rng.integers(len(text)))
+        term = text[start:start + int(rng.integers(1, 5))]
+        assert ngram_index.search([term]).tolist() == _baseline_rows(corpus_df, [term]).tolist(), term
+
+
+def _baseline_facets(df, season, plutchik, aesthetic):
+    """以前の pick_references の df_base 絞り込み。"""
+    base = df
+    if season:
+        base = base[base["季節"] == season]
+    if plutchik:
+        base = base[base["plutchik_main"] == plutchik]
+    if aesthetic and aesthetic != "スキップ":
+        base = base[base["nihon_main"] == aesthetic]
+    return base.index.tolist()
+
+
+def _check_facets(df):
+    index = FacetIndex(df)
+    seasons = [""] + sorted(df["季節"].dropna().astype(str).unique())[:4]
+    emotions = [""] + sorted(df["plutchik_main"].dropna().astype(str).unique())[:3]
+    aesthetics = ["スキップ", "存在しない"] + sorted(df["nihon_main"].dropna().astype(str).unique())[:3]
+    for season in seasons:
+        for plutchik in emotions:
+            for aesthetic in aesthetics:
+                mask = index.mask({"季節": season, "plutchik_main": plutchik,
+                                   "nihon_main": aesthetic if aesthetic != "スキップ" else None})
+                assert df.index[mask].tolist() == _baseline_facets(df, season, plutchik, aesthetic)
+
+
+def test_facet_index_matches_baseline_filters(corpus_df):
+    _check_facets(corpus_df)
+
+
+def test_facet_index_matches_baseline_filters_on_compiled_corpus(tmp_path):
+    from corpus_store import load_corpus
+    _check_facets(load_corpus(CORPUS, cache_root=tmp_path))
+
+
+def test_facet_bitmaps_are_read_only(corpus_df):
+    index = FacetIndex(corpus_df)
+    season = corpus_df["季節"].dropna().iloc[0]
+    with pytest.raises(ValueError):
+        index.bitmap("季節", season)[0] = True
+    before = index.bitmap("季節", season).copy()
+    index.mask({"季節": season, "plutchik_main": corpus_df["plutchik_main"].iloc[0]})
+    assert (index.bitmap("季節", season) == before).all()
@@ -0,0 +1,40 @@
+from pathlib import Path
+
+import pandas as pd
+import pytest
+
+from mora import count_mora, split_ku
+
+CORPUS = Path(__file__).resolve().parents[1] / "haiku_with_repetition.csv"
+
+
+def _counts(reading: str) -> tuple:
+    return tuple(count_mora(ku) for ku in split_ku(reading))
+
+
+@pytest.mark.parametrize("reading, expected", [
+    # コーパスの「読み」列から（字余りの句も含む）
+    ("かれすすき かさりかさりと よあけたり", (5, 7, 5)),
+    ("ざぶざぶと はぎおきなおる やはんかな", (5, 7, 5)),
+    ("きぎおのおの なのりいでたる このめかな", (6, 7, 5)),
+    ("はるかぜや いしずえしめる あさなあさな", (5, 7, 6)),
+    ("しんまちや われわれもめの ゆうすずみ", (5, 7, 5)),
+])
+def test_count_mora_corpus_readings(reading, expected):
+    assert _counts(reading) == expected
+
+
+def test_count_mora_small_kana_and_special_morae():
+    assert count_mora("しゃ") == 1          # 拗音は前の文字と合わせて1モーラ
+    assert count_mora("きって") == 3        # っ は1モーラ
+    assert count_mora("らーめん") == 4      # ー・ん も1モーラ
+    assert count_mora("シャッター") == 4    # カタカナも同じ
+    assert count_mora("古池や") == 1        # 仮名以外は数えない
+
+
+def test_count_mora_matches_corpus_575():
+    df = pd.read_csv(CORPUS, encoding="utf-8-sig", usecols=["読み"])
+    readings = df["読み"].dropna().astype(str)
+    ok = readings.map(lambda r: _counts(r) == (5, 7, 5)).mean()
+    # 字余り・字足らずの句を除き、読み列はほぼ 5-7-5 で数えられる
+    assert ok > 0.9
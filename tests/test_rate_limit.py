@@ -0,0 +1,33 @@
+import pytest
+
+from rate_limit import TokenBucket
+
+
+def test_token_bucket_refills_at_rate():
+    bucket = TokenBucket(capacity=10, rate=5)
+    assert bucket.try_acquire(10) == 0.0
+    wait = bucket.try_acquire(5)
+    assert wait == pytest.approx(1.0, abs=0.05)   # 5 個は 5/秒 で約1秒後
+
+    bucket._updated -= 1.0                         # 1秒経過したことにする
+    assert bucket.try_acquire(5) == 0.0
+
+
+def test_token_bucket_caps_at_capacity():
+    bucket = TokenBucket(capacity=10, rate=5)
+    bucket.try_acquire(10)
+    bucket._updated -= 100.0                       # 長く空いても capacity までしか貯まらない
+    assert bucket.try_acquire(10) == 0.0
+    assert bucket.try_acquire(1) > 0.0
+
+
+def test_token_bucket_failed_acquire_consumes_nothing():
+    bucket = TokenBucket(capacity=10, rate=1)
+    bucket.try_acquire(8)
+    assert bucket.try_acquire(5) > 0.0
+    assert bucket.try_acquire(2) == 0.0
+
+
+def test_token_bucket_request_larger_than_capacity_is_clamped():
+    bucket = TokenBucket(capacity=10, rate=1)
+    assert bucket.try_acquire(50) == 0.0
@@ -0,0 +1,63 @@
+import pytest
+
+import response_cache
+from response_cache import ResponseCache, make_key
+
+
+class FakeClock:
+    def __init__(self, now=1_000_000.0):
+        self.now = now
+
+    def time(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(response_cache, "time", clock)
+    return clock
+
+
+def test_make_key_normalizes_payload():
+    a = make_key("haiku", payload={"keyword": " 月 ", "season": "秋"}, model="m")
+    b = make_key("haiku", payload={"season": "秋", "keyword": "月"}, model="m")
+    assert a == b
+    assert a != make_key("english", payload={"season": "秋", "keyword": "月"}, model="m")
+    assert make_key("haiku", payload={"keyword": "ＡＢＣ"}) == make_key("haiku", payload={"keyword": "ABC"})
+
+
+def test_entries_expire_after_ttl(tmp_path, clock):
+    cache = ResponseCache(tmp_path / "c.sqlite3", ttl_sec=60, max_entries=10)
+    cache.set("k", {"haiku_ja": "句"})
+    clock.now += 59
+    assert cache.get("k") == {"haiku_ja": "句"}
+    clock.now += 2                                  # 作成から 61 秒（アクセスしても延びない）
+    assert cache.get("k") is None
+
+
+def test_set_evicts_least_recently_used(tmp_path, clock):
+    cache = ResponseCache(tmp_path / "c.sqlite3", ttl_sec=3600, max_entries=2)
+    cache.set("a", 1)
+    clock.now += 1
+    cache.set("b", 2)
+    clock.now += 1
+    assert cache.get("a") == 1                      # a を最近使ったことにする
+    clock.now += 1
+    cache.set("c", 3)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1 and cache.get("c") == 3
+
+
+def test_set_drops_expired_entries(tmp_path, clock):
+    cache = ResponseCache(tmp_path / "c.sqlite3", ttl_sec=10, max_entries=10)
+    cache.set("old", 1)
+    clock.now += 11
+    cache.set("new", 2)
+    count = cache._conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+    assert count == 1
+
+
+def test_entries_survive_reopen(tmp_path, clock):
+    ResponseCache(tmp_path / "c.sqlite3").set("k", ["x", "y"])
+    assert ResponseCache(tmp_path / "c.sqlite3").get("k") == ["x", "y"]
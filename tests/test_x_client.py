@@ -0,0 +1,71 @@
+import time
+
+from x_client import PostQueue
+
+
+def test_post_queue_recovers_jobs_from_crashed_worker(tmp_path):
+    path = tmp_path / "post_queue.sqlite3"
+    q = PostQueue(path, lease_sec=0.0)
+    job_id = q.enqueue("俳句")
+    assert [j["id"] for j in q.claim_many(1)] == [job_id]
+    q._conn.close()                                  # running のままプロセスが落ちた
+
+    time.sleep(0.01)
+    restarted = PostQueue(path, lease_sec=60.0)
+    assert [j["id"] for j in restarted.claim_many(1)] == [job_id]
+    assert restarted.get(job_id)["status"] == "running"
+
+
+def test_post_queue_does_not_reclaim_live_lease(tmp_path):
+    q = PostQueue(tmp_path / "post_queue.sqlite3", lease_sec=60.0)
+    q.enqueue("俳句")
+    assert len(q.claim_many(1)) == 1
+    assert q.claim_many(1) == []
+
+
+def test_post_queue_finished_jobs_stay_finished(tmp_path):
+    q = PostQueue(tmp_path / "post_queue.sqlite3", lease_sec=0.0)
+    done_id, failed_id = q.enqueue("a"), q.enqueue("b")
+    jobs = {j["id"]: j for j in q.claim_many(2)}
+    q.done(done_id, "https://x.com/i/web/status/1")
+    q.fail(jobs[failed_id], "403")
+    time.sleep(0.01)
+    assert q.claim_many(5) == []
+    assert q.pending_count([done_id, failed_id]) == 0
+
+
+def test_post_queue_pending_count_by_ids(tmp_path):
+    q = PostQueue(tmp_path / "post_queue.sqlite3")
+    mine = q.enqueue("mine")
+    q.enqueue("foreign")
+    assert q.pending_count() == 2
+    assert q.pending_count([mine]) == 1
+    assert q.pending_count([]) == 0
+
+
+def test_post_worker_survives_queue_errors():
+    import sqlite3
+
+    from x_client import PostWorker
+
+    class FlakyQueue:
+        def __init__(self):
+            self.calls = 0
+
+        def claim_many(self, limit):
+            self.calls += 1
+            if self.calls == 1:
+                raise sqlite3.OperationalError("database is locked")
+            return []
+
+        def next_ready_at(self):
+            return None
+
+    q = FlakyQueue()
+    worker = PostWorker(q, poll_sec=0.01, batch=1)
+    deadline = time.time() + 3
+    while q.calls < 3 and time.time() < deadline:
+        worker.wake()
+        time.sleep(0.02)
+    assert q.calls >= 3
+    assert worker._thread.is_alive()
@@ -0,0 +1,200 @@
+"""
+一茶コーパスの意味的類似検索（TF-IDF → LSA の密ベクトル + IVF 近似最近傍）。
+
+- 俳句・読み・季語候補を文字 1-2gram の TF-IDF にし、TruncatedSVD で低次元化・L2 正規化
+- ベクトルは float32 の .npy として保存し mmap で開く（複数ワーカーでページキャッシュ共有）
+- scikit-learn は構築時のみ使用。クエリ側は語彙・idf・射影行列を numpy で直接適用する
+- k-means の重心で粗く量子化し、クエリに近い nprobe 個のリストだけを内積で走査する
+
+コンパイル済みコーパス（corpus_store）のディレクトリ配下 `vectors/` にキャッシュする。
+事前ビルド:
+    python vector_index.py haiku_with_repetition.csv
+"""
+from __future__ import annotations
+import os, re, sys, json, math, shutil
+from collections import Counter
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from haiku_index import SEARCH_FIELDS, cached_index
+
+VECTOR_VERSION = 1
+N_COMPONENTS = 128
+N_LISTS = 128
+DEFAULT_NPROBE = 12
+_WHITE_SPACES = re.compile(r"\s\s+")
+
+
+class VectorIndex:
+    """正規化済み行ベクトル（リスト順に並べ替え済み）と IVF の重心を持つ近似検索器。"""
+
+    def __init__(self, vocab: Dict[str, int], idf: np.ndarray, components: np.ndarray,
+                 centroids: np.ndarray, vectors: np.ndarray, ids: np.ndarray, offsets: np.ndarray):
+        self.vocab = vocab            # 文字 n-gram → 列番号
+        self.idf = idf
+        self.components = components  # (n_components, n_features) の LSA 射影
+        self.centroids = centroids
+        self.vectors = vectors
+        self.ids = ids
+        self.offsets = offsets
+
+    # ---------- 構築 ----------
+    @classmethod
+    def build(cls, df: pd.DataFrame, n_components: int = N_COMPONENTS,
+              n_lists: int = N_LISTS, seed: int = 0) -> "VectorIndex":
+        from sklearn.feature_extraction.text import TfidfVectorizer
+        from sklearn.decomposition import TruncatedSVD
+        from sklearn.cluster import MiniBatchKMeans
+
+        docs = [" ".join(vals) for vals in zip(*[
+            df[c].fillna("").astype(str).tolist() if c in df.columns else [""] * len(df)
+            for c in SEARCH_FIELDS
+        ])]
+        vec = TfidfVectorizer(analyzer="char", ngram_range=(1, 2), min_df=2, sublinear_tf=True)
+        tfidf = vec.fit_transform(docs)
+        n_components = max(1, min(n_components, tfidf.shape[1] - 1, len(docs) - 1))
+        svd = TruncatedSVD(n_components=n_components, random_state=seed)
+        X = _normalize(svd.fit_transform(tfidf).astype(np.float32))
+
+        n_lists = max(1, min(n_lists, len(docs)))
+        km = MiniBatchKMeans(n_clusters=n_lists, random_state=seed, n_init=3, batch_size=2048).fit(X)
+        centroids = _normalize(km.cluster_centers_.astype(np.float32))
+        labels = km.labels_
+        order = np.argsort(labels, kind="stable").astype(np.int32)
+        offsets = np.searchsorted(labels[order], np.arange(n_lists + 1)).astype(np.int64)
+        vocab = {g: int(j) for g, j in vec.vocabulary_.items()}
+        return cls(vocab, vec.idf_.astype(np.float32), svd.components_.astype(np.float32),
+                   centroids, np.ascontiguousarray(X[order]), order, offsets)
+
+    # ---------- 保存・読込 ----------
+    def save(self, out_dir: Path) -> None:
+        tmp = out_dir.with_name(f"{out_dir.name}.tmp{os.getpid()}")
+        shutil.rmtree(tmp, ignore_errors=True)
+        tmp.mkdir(parents=True)
+        np.save(tmp / "vectors.npy", self.vectors)
+        np.save(tmp / "ids.npy", self.ids)
+        np.save(tmp / "offsets.npy", self.offsets)
+        np.save(tmp / "centroids.npy", self.centroids)
+        np.save(tmp / "idf.npy", self.idf)
+        np.save(tmp / "components.npy", self.components)
+        (tmp / "vocab.json").write_text(json.dumps(self.vocab, ensure_ascii=False), encoding="utf-8")
+        (tmp / "meta.json").write_text(json.dumps({"version": VECTOR_VERSION,
+                                                   "n_rows": int(len(self.ids))}), encoding="utf-8")
+        # 古い版・行数違いのディレクトリが残っていると os.replace は失敗するので、先に退避する
+        old = out_dir.with_name(f"{out_dir.name}.old{os.getpid()}")
+        try:
+            if out_dir.exists():
+                os.replace(out_dir, old)
+            os.replace(tmp, out_dir)
+        except OSError:
+            shutil.rmtree(tmp, ignore_errors=True)
+            raise
+        finally:
+            shutil.rmtree(old, ignore_errors=True)
+
+    @classmethod
+    def load(cls, out_dir: Path) -> Optional["VectorIndex"]:
+        try:
+            meta = json.loads((out_dir / "meta.json").read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return None
+        if meta.get("version") != VECTOR_VERSION:
+            return None
+        vocab = json.loads((out_dir / "vocab.json").read_text(encoding="utf-8"))
+        return cls(vocab,
+                   np.load(out_dir / "idf.npy"),
+                   np.load(out_dir / "components.npy", mmap_mode="r"),
+                   np.load(out_dir / "centroids.npy"),
+                   np.load(out_dir / "vectors.npy", mmap_mode="r"),
+                   np.load(out_dir / "ids.npy", mmap_mode="r"),
+                   np.load(out_dir / "offsets.npy"))
+
+    # ---------- 検索 ----------
+    def embed(self, text: str) -> np.ndarray:
+        """TfidfVectorizer(analyzer="char", ngram_range=(1, 2), sublinear_tf) → SVD と同じ変換。"""
+        text = _WHITE_SPACES.sub(" ", text.lower())
+        counts = Counter(text)
+        counts.update(text[i:i + 2] for i in range(len(text) - 1))
+        cols, weights = [], []
+        for g, c in counts.items():
+            j = self.vocab.get(g)
+            if j is not None:
+                cols.append(j)
+                weights.append((1.0 + math.log(c)) * self.idf[j])
+        if not cols:
+            return np.zeros(self.components.shape[0], dtype=np.float32)
+        w = np.asarray(weights, dtype=np.float32)
+        w /= np.linalg.norm(w)
+        return _normalize(self.components[:, cols] @ w)
+
+    def search(self, text: str, k: int = 20, nprobe: int = DEFAULT_NPROBE) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        text に近い行を最大 k 件返す。戻り値は (行番号, コサイン類似度) で類似度の降順。
+        nprobe を重心数以上にすると全件の厳密検索になる。
+        """
+        if not text or not text.strip() or k <= 0:
+            return np.empty(0, dtype=np.int32), np.empty(0, dtype=np.float32)
+        q = self.embed(text)
+        n_lists = len(self.centroids)
+        if nprobe >= n_lists:
+            vecs, ids = self.vectors, self.ids
+        else:
+            lists = np.argpartition(-(self.centroids @ q), nprobe - 1)[:nprobe]
+            sel = np.concatenate([np.arange(self.offsets[l], self.offsets[l + 1]) for l in lists])
+            vecs, ids = self.vectors[sel], self.ids[sel]
+        scores = vecs @ q
+        k = min(k, len(scores))
+        if k == 0:
+            return np.empty(0, dtype=np.int32), np.empty(0, dtype=np.float32)
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top], kind="stable")]
+        return np.asarray(ids[top], dtype=np.int32), np.asarray(scores[top], dtype=np.float32)
+
+
+def _normalize(X: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(X, axis=-1, keepdims=True)
+    return X / np.where(norms == 0, 1.0, norms)
+
+
+def ensure_saved(df: pd.DataFrame, out_dir: Path) -> None:
+    """out_dir に df と同じ行数の現行版インデックスが無ければ構築して保存する（python corpus_store.py 用）。"""
+    idx = VectorIndex.load(out_dir)
+    if idx is None or len(idx.ids) != len(df):
+        VectorIndex.build(df).save(out_dir)
+
+
+def _load_or_build(df: pd.DataFrame) -> VectorIndex:
+    """
+    保存済み（python corpus_store.py で事前ビルド、または前回の初回検索で保存）なら読むだけ。
+    無ければここで構築し、コンパイル済みコーパスの隣に保存する。意味検索を使わない限り呼ばれない。
+    """
+    corpus_dir = df.attrs.get("corpus_dir")
+    out_dir = Path(corpus_dir) / "vectors" if corpus_dir else None
+    if out_dir is not None:
+        idx = VectorIndex.load(out_dir)
+        if idx is not None and len(idx.ids) == len(df):
+            return idx
+    idx = VectorIndex.build(df)
+    if out_dir is not None:
+        try:
+            idx.save(out_dir)
+        except OSError:
+            pass   # 書込不可の環境ではメモリ上のインデックスだけ使う
+    return idx
+
+
+def get_vector_index(df: pd.DataFrame) -> VectorIndex:
+    return cached_index(df, "vector", _load_or_build)
+
+
+if __name__ == "__main__":
+    from corpus_store import load_corpus
+    for p in sys.argv[1:] or ["haiku_with_repetition.csv"]:
+        df = load_corpus(p)
+        out_dir = Path(df.attrs["corpus_dir"]) / "vectors"
+        shutil.rmtree(out_dir, ignore_errors=True)
+        VectorIndex.build(df).save(out_dir)
+        print(out_dir)
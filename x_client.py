@@ -1,9 +1,23 @@
-
 from __future__ import annotations
-import os
+import os, time, uuid, random, sqlite3, threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from typing import Optional
+from io import BytesIO
+from pathlib import Path
+from typing import Iterable, List, Optional
 import tweepy
+from PIL import Image
+
+import metrics
+import haiku_log
+from artifact_store import location_exists, read_location
+
+# クライアントはプロセス内で使い回す（鍵が変わったら作り直す）。
+# wait_on_rate_limit は使わない：レート制限での待機は投稿キューのワーカーが受け持ち、
+# 画面側のスレッドを最大15分止めないようにする。
+_clients = None
+_clients_key = None
+_clients_lock = threading.Lock()
 
 def _get_x_clients():
     ck = os.getenv("TWITTER_API_KEY")
@@ -13,43 +27,369 @@ def _get_x_clients():
     if not all([ck, cs, at, ats]):
         raise RuntimeError("X(Twitter) のAPI鍵が未設定です（.env を確認）")
 
-    client = tweepy.Client(consumer_key=ck, consumer_secret=cs, access_token=at, access_token_secret=ats, wait_on_rate_limit=True)
-    auth = tweepy.OAuth1UserHandler(ck, cs, at, ats)
-    api = tweepy.API(auth, wait_on_rate_limit=True)
-    return client, api
+    global _clients, _clients_key
+    with _clients_lock:
+        if _clients is None or _clients_key != (ck, cs, at, ats):
+            client = tweepy.Client(consumer_key=ck, consumer_secret=cs, access_token=at, access_token_secret=ats)
+            auth = tweepy.OAuth1UserHandler(ck, cs, at, ats)
+            api = tweepy.API(auth)
+            _clients, _clients_key = (client, api), (ck, cs, at, ats)
+        return _clients
 
-def _log_x(message: str):
-    import os
-    os.makedirs("outputs/logs", exist_ok=True)
-    path = f"outputs/logs/x_post_{datetime.now():%Y%m%d}.log"
-    with open(path, "a", encoding="utf-8") as f:
-        f.write(f"[{datetime.now():%H:%M:%S}] {message}\n")
+_logger = haiku_log.get_logger("x_client")
 
-def post_to_x(text: str, image_path: Optional[str] = None) -> str:
-    """Xに投稿。画像あり→v1.1でアップロード→v2でツイート作成。投稿URLを返す。"""
+def _log_fields(start: float, **fields) -> dict:
+    return {"endpoint": "x.post", "latency_sec": round(time.perf_counter() - start, 4), **fields}
+
+def _clip(text: str) -> str:
     if not text or not text.strip():
         raise ValueError("投稿テキストが空です。")
     text = text.strip()
     if len(text) > 280:
         text = text[:277] + "…"
+    return text
+
+# アップロード前の縮小: X 側でも再圧縮されるため、目標サイズ以下の JPEG にしてから送る。
+# 目標を超える（再エンコードでも縮まない）ものは分割アップロード（INIT/APPEND/FINALIZE）にする。
+#   HAIKU_X_MEDIA_TARGET_BYTES (900000) / HAIKU_X_CHUNK_THRESHOLD (1048576)
+X_MEDIA_TARGET_BYTES = int(os.getenv("HAIKU_X_MEDIA_TARGET_BYTES", 900_000))
+X_CHUNK_THRESHOLD = int(os.getenv("HAIKU_X_CHUNK_THRESHOLD", 1024 * 1024))
 
+def _prepare_media(image_path: str) -> tuple:
+    """
+    (ファイル名, バイト列)。目標サイズ以下ならそのまま、超えれば JPEG に再エンコードする。
+    image_path はローカルパスか artifact_store の s3:// の場所。
+    """
+    path = Path(image_path)
+    data = read_location(image_path)
+    if len(data) <= X_MEDIA_TARGET_BYTES:
+        return path.name, data
+    with Image.open(BytesIO(data)) as im:
+        img = im.convert("RGB")
+    for quality in (90, 85, 80, 70, 60):
+        buf = BytesIO()
+        img.save(buf, format="JPEG", quality=quality, optimize=True, progressive=True)
+        if buf.tell() <= X_MEDIA_TARGET_BYTES:
+            break
+    out = buf.getvalue()
+    return (f"{path.stem}.jpg", out) if len(out) < len(data) else (path.name, data)
+
+def _upload_media(api, image_path: Optional[str]):
+    if image_path and location_exists(image_path):
+        with metrics.timed("x.media_upload") as rec:
+            name, data = _prepare_media(image_path)
+            chunked = len(data) > X_CHUNK_THRESHOLD
+            rec.update(image_bytes=len(data), chunked=chunked)
+            media = api.media_upload(filename=name, file=BytesIO(data), chunked=chunked,
+                                     media_category="tweet_image")
+        return [media.media_id]
+    return None
+
+def _create_tweet(client, text: str, media_ids) -> str:
+    resp = client.create_tweet(text=text, media_ids=media_ids)
+    tweet_id = resp.data.get("id")
+    return f"https://x.com/i/web/status/{tweet_id}"
+
+@metrics.instrument("x.post")
+def post_to_x(text: str, image_path: Optional[str] = None) -> str:
+    """Xに投稿。画像あり→v1.1でアップロード→v2でツイート作成。投稿URLを返す。"""
+    text = _clip(text)
     client, api = _get_x_clients()
     media_ids = None
+    start = time.perf_counter()
 
-    if image_path and os.path.exists(image_path):
-        try:
-            media = api.media_upload(filename=image_path)
-            media_ids = [media.media_id]
-        except Exception as e:
-            _log_x(f"画像アップロード失敗: {e}")
-            raise RuntimeError(f"画像アップロードに失敗しました: {e}")
+    try:
+        media_ids = _upload_media(api, image_path)
+    except Exception as e:
+        _logger.error(f"画像アップロード失敗: {e}", extra=_log_fields(start, error=e.__class__.__name__))
+        raise RuntimeError(f"画像アップロードに失敗しました: {e}")
 
     try:
-        resp = client.create_tweet(text=text, media_ids=media_ids)
-        tweet_id = resp.data.get("id")
-        url = f"https://x.com/i/web/status/{tweet_id}"
-        _log_x(f"投稿成功: {url}")
+        url = _create_tweet(client, text, media_ids)
+        _logger.info(f"投稿成功: {url}", extra=_log_fields(start, url=url))
         return url
     except Exception as e:
-        _log_x(f"投稿失敗: {e}")
+        _logger.error(f"投稿失敗: {e}", extra=_log_fields(start, error=e.__class__.__name__))
         raise RuntimeError(f"ツイート作成に失敗しました: {e}")
+
+
+# ==== 投稿キュー（SQLite）＋バックグラウンドワーカー ==========================
+# enqueue_post() は job id をすぐ返し、実際の画像アップロードとツイート作成はワーカーが行う。
+# 429 のときはレスポンスの x-rate-limit-reset までキュー全体を止め、5xx・通信エラーは
+# 指数バックオフで再試行する。running のジョブには期限（lease_until）を付け、期限を過ぎても
+# 終わらないもの（落ちた・固まったワーカーのもの）は次のポーリングで queued に戻す。
+#
+# 環境変数: HAIKU_POST_QUEUE_PATH (outputs/cache/post_queue.sqlite3) / HAIKU_POST_MAX_ATTEMPTS (5)
+#           HAIKU_POST_LEASE_SEC (300)
+
+_POST_MAX_ATTEMPTS = int(os.getenv("HAIKU_POST_MAX_ATTEMPTS", 5))
+_POST_LEASE_SEC = float(os.getenv("HAIKU_POST_LEASE_SEC", 300))
+
+
+class PostQueue:
+    """投稿ジョブの永続キュー。status: queued → running → done / failed。"""
+
+    def __init__(self, path: str | Path, lease_sec: float = _POST_LEASE_SEC):
+        self.path = Path(path)
+        self.lease_sec = lease_sec
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.path), timeout=10, check_same_thread=False,
+                                     isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""CREATE TABLE IF NOT EXISTS posts (
+            id TEXT PRIMARY KEY,
+            text TEXT NOT NULL,
+            image_path TEXT,
+            status TEXT NOT NULL,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            next_at REAL NOT NULL,
+            url TEXT,
+            error TEXT,
+            created_at REAL NOT NULL,
+            updated_at REAL NOT NULL,
+            lease_until REAL)""")
+        cols = {r[1] for r in self._conn.execute("PRAGMA table_info(posts)")}
+        if "lease_until" not in cols:
+            # 旧形式のキュー: 実行中のジョブは最終更新から lease_sec を期限とみなす
+            self._conn.execute("ALTER TABLE posts ADD COLUMN lease_until REAL")
+            self._conn.execute("UPDATE posts SET lease_until=updated_at+? WHERE status='running'",
+                               (self.lease_sec,))
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_posts_ready ON posts(status, next_at)")
+
+    def enqueue(self, text: str, image_path: Optional[str] = None, not_before: Optional[float] = None) -> str:
+        job_id = uuid.uuid4().hex[:16]
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO posts (id, text, image_path, status, next_at, created_at, updated_at) "
+                "VALUES (?,?,?,'queued',?,?,?)",
+                (job_id, text, image_path, not_before or now, now, now))
+        return job_id
+
+    def claim_many(self, limit: int = 1) -> List[dict]:
+        """
+        期限切れの running を queued に戻したうえで、実行可能なジョブを古い順に
+        最大 limit 件 running にして返す（期限は now + lease_sec）。
+        """
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.execute(
+                    "UPDATE posts SET status='queued', lease_until=NULL, updated_at=? "
+                    "WHERE status='running' AND lease_until<?", (now, now))
+                rows = self._conn.execute(
+                    "SELECT id, text, image_path, attempts FROM posts "
+                    "WHERE status='queued' AND next_at<=? ORDER BY next_at LIMIT ?", (now, limit)).fetchall()
+                self._conn.executemany(
+                    "UPDATE posts SET status='running', lease_until=?, updated_at=? WHERE id=?",
+                    [(now + self.lease_sec, now, r[0]) for r in rows])
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return [{"id": r[0], "text": r[1], "image_path": r[2], "attempts": r[3]} for r in rows]
+
+    def claim(self) -> Optional[dict]:
+        """実行可能な最古のジョブを running にして返す（無ければ None）。"""
+        jobs = self.claim_many(1)
+        return jobs[0] if jobs else None
+
+    def next_ready_at(self) -> Optional[float]:
+        """次に実行可能になる時刻（running の期限切れによる回収も含む）。"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT MIN(CASE status WHEN 'queued' THEN next_at ELSE lease_until END) FROM posts "
+                "WHERE status IN ('queued','running')").fetchone()
+        return row[0]
+
+    def _update(self, job_id: str, **fields) -> None:
+        fields["updated_at"] = time.time()
+        cols = ", ".join(f"{k}=?" for k in fields)
+        with self._lock:
+            self._conn.execute(f"UPDATE posts SET {cols} WHERE id=?", (*fields.values(), job_id))
+
+    def done(self, job_id: str, url: str) -> None:
+        self._update(job_id, status="done", url=url, error=None, lease_until=None)
+
+    def retry(self, job: dict, at: float, error: str, count: bool = True) -> None:
+        """at（エポック秒）以降に再実行する。count=False（レート制限待ち）は試行回数に数えない。"""
+        attempts = job["attempts"] + (1 if count else 0)
+        status = "queued" if attempts < _POST_MAX_ATTEMPTS else "failed"
+        self._update(job["id"], status=status, attempts=attempts, next_at=at, error=error, lease_until=None)
+
+    def fail(self, job: dict, error: str) -> None:
+        self._update(job["id"], status="failed", attempts=job["attempts"] + 1, error=error, lease_until=None)
+
+    def pending_count(self, job_ids: Optional[Iterable[str]] = None) -> int:
+        """queued / running のジョブ数。job_ids を渡すとその中だけ数える。"""
+        sql = "SELECT COUNT(*) FROM posts WHERE status IN ('queued','running')"
+        args: tuple = ()
+        if job_ids is not None:
+            args = tuple(job_ids)
+            if not args:
+                return 0
+            sql += f" AND id IN ({','.join('?' * len(args))})"
+        with self._lock:
+            return self._conn.execute(sql, args).fetchone()[0]
+
+    def get(self, job_id: str) -> Optional[dict]:
+        with self._lock:
+            cur = self._conn.execute("SELECT * FROM posts WHERE id=?", (job_id,))
+            row = cur.fetchone()
+            names = [d[0] for d in cur.description]
+        return dict(zip(names, row)) if row else None
+
+
+def _rate_limit_reset(e: Exception) -> float:
+    """429 応答の x-rate-limit-reset（エポック秒）。無ければ 15 分後。"""
+    resp = getattr(e, "response", None)
+    try:
+        return float(resp.headers["x-rate-limit-reset"]) + 1
+    except Exception:
+        return time.time() + 15 * 60
+
+
+class PostWorker:
+    """
+    PostQueue を1本のスレッドで処理する。実行可能なジョブを最大 batch 件まとめて取り、
+    画像アップロードは並列に済ませてから、ツイート作成を順に行う
+    （ツイート作成のレート制限はアカウント単位なので直列で十分）。
+    """
+
+    def __init__(self, queue: PostQueue, poll_sec: float = 1.0, batch: Optional[int] = None):
+        self.queue = queue
+        self.poll_sec = poll_sec
+        self.batch = batch or int(os.getenv("HAIKU_X_UPLOAD_WORKERS", 4))
+        self._uploader = ThreadPoolExecutor(max_workers=self.batch, thread_name_prefix="haiku-x-upload")
+        self._wake = threading.Event()
+        self._paused_until = 0.0
+        self._thread = threading.Thread(target=self._run, name="haiku-x-poster", daemon=True)
+        self._thread.start()
+
+    def wake(self) -> None:
+        self._wake.set()
+
+    def _sleep(self, sec: float) -> None:
+        self._wake.wait(max(0.0, sec))
+        self._wake.clear()
+
+    def _run(self) -> None:
+        errors = 0
+        while True:
+            try:
+                self._step()
+                errors = 0
+            except Exception:
+                # SQLite の "database is locked" などでスレッドが止まると以後だれも投稿しないので、
+                # 記録して間隔を空けながら続ける
+                errors += 1
+                delay = min(60.0, self.poll_sec * (2 ** errors)) + random.uniform(0, 0.5)
+                _logger.exception(f"投稿ワーカーのエラー（{delay:.1f}秒後に再開）",
+                                  extra={"errors": errors, "retry_in_sec": round(delay, 2)})
+                time.sleep(delay)
+
+    def _step(self) -> None:
+        pause = self._paused_until - time.time()
+        if pause > 0:
+            time.sleep(pause)   # レート制限中は wake されても待つ
+            return
+        jobs = self.queue.claim_many(self.batch)
+        if not jobs:
+            nxt = self.queue.next_ready_at()
+            self._sleep(self.poll_sec if nxt is None else min(self.poll_sec * 30, nxt - time.time()))
+            return
+        self._process(jobs)
+
+    def _upload(self, job: dict):
+        if job["image_path"] and not location_exists(job["image_path"]):
+            # 画像の書込み（artifact_store）が終わっていなければ少し後で再試行
+            raise FileNotFoundError(f"画像がまだありません: {job['image_path']}")
+        _, api = _get_x_clients()
+        return _upload_media(api, job["image_path"])
+
+    def _process(self, jobs: List[dict]) -> None:
+        start = time.perf_counter()
+        uploads = [(job, self._uploader.submit(self._upload, job)) for job in jobs]
+        for job, fut in uploads:
+            if self._paused_until > time.time():
+                # 途中でレート制限に入ったら残りは戻す（アップロード済みでも media_id は再取得する）
+                self.queue.retry(job, self._paused_until, "rate limited", count=False)
+                continue
+            with haiku_log.context(request_id=job["id"]):   # ワーカーのログは job id で追える
+                try:
+                    media_ids = fut.result()
+                    with metrics.timed("x.post.queued"):
+                        client, _ = _get_x_clients()
+                        url = _create_tweet(client, _clip(job["text"]), media_ids)
+                    self.queue.done(job["id"], url)
+                    _logger.info(f"投稿成功: {url}", extra=_log_fields(
+                        start, endpoint="x.post.queued", url=url, attempts=job["attempts"]))
+                except Exception as e:
+                    self._handle_error(job, e, start)
+
+    def _handle_error(self, job: dict, e: Exception, start: float) -> None:
+        """アップロード・ツイート作成の失敗を 一時停止 / 再試行 / 失敗 に振り分ける。"""
+        fields = _log_fields(start, endpoint="x.post.queued", error=e.__class__.__name__,
+                             attempts=job["attempts"])
+        if isinstance(e, tweepy.TooManyRequests):
+            reset = _rate_limit_reset(e)
+            self._paused_until = reset
+            self.queue.retry(job, reset, str(e), count=False)
+            _logger.warning(f"レート制限: {datetime.fromtimestamp(reset):%H:%M:%S} まで待機", extra=fields)
+        elif isinstance(e, tweepy.HTTPException) and not isinstance(e, tweepy.TwitterServerError):
+            # 4xx（重複投稿・権限など）は再試行しても通らない
+            self.queue.fail(job, str(e))
+            _logger.error(f"投稿失敗: {e}", extra=fields)
+        elif isinstance(e, (tweepy.TweepyException, OSError)):
+            delay = min(300.0, 2.0 * (2 ** job["attempts"])) + random.uniform(0, 1)
+            self.queue.retry(job, time.time() + delay, str(e))
+            _logger.warning(f"投稿再試行予定: {delay:.0f}秒後 {e}", extra={**fields, "retry_in_sec": round(delay, 2)})
+        else:
+            self.queue.fail(job, str(e))
+            _logger.error(f"投稿失敗: {e}", extra=fields)
+
+
+_queue: Optional[PostQueue] = None
+_worker: Optional[PostWorker] = None
+_queue_lock = threading.Lock()
+
+def _get_queue() -> PostQueue:
+    """プロセス共有の投稿キュー（初回にワーカーも起動する）。"""
+    global _queue, _worker
+    with _queue_lock:
+        if _queue is None:
+            _queue = PostQueue(os.getenv("HAIKU_POST_QUEUE_PATH", "outputs/cache/post_queue.sqlite3"))
+            _worker = PostWorker(_queue)
+    return _queue
+
+def enqueue_post(text: str, image_path: Optional[str] = None, not_before: Optional[float] = None) -> str:
+    """
+    投稿をキューに積み、job id をすぐ返す（画面側はブロックしない）。
+    not_before（エポック秒）で予約投稿もできる。結果は get_post(job_id) で確認する。
+    """
+    text = _clip(text)
+    queue = _get_queue()
+    job_id = queue.enqueue(text, image_path, not_before)
+    _worker.wake()
+    return job_id
+
+def get_post(job_id: str) -> Optional[dict]:
+    """ジョブの状態（status / url / error / attempts など）。"""
+    return _get_queue().get(job_id)
+
+def wait_posts(job_ids: Optional[Iterable[str]] = None, timeout: Optional[float] = None,
+               poll_sec: float = 1.0) -> int:
+    """
+    job_ids（省略時はキュー全体）の投稿が終わるまで、最大 timeout 秒待つ（バッチ終了時用）。
+    終わっていないジョブ数を返す。
+    """
+    queue = _get_queue()
+    job_ids = None if job_ids is None else list(job_ids)
+    deadline = None if timeout is None else time.time() + timeout
+    while True:
+        left = queue.pending_count(job_ids)
+        if left == 0 or (deadline is not None and time.time() >= deadline):
+            return left
+        time.sleep(poll_sec)